@@ -6,28 +6,44 @@ import ctypes
 import struct
 
 from tools.frame_check import *
+from tools.frame_index import get_index_path
+from tools.frame_stats import get_max_value
 from tools.load_bin import *
 from tools.util import *
-
-# common
-from ionpy import Node, Builder, Buffer, Port, Param, Type, TypeCode
-from  gendc_python.gendc_separator import descriptor as gendc
+from tools.simulated_camera import *
+from tools.frame_timing import *
+import tools.summary as summary
+from tools.soak import *
+from tools.rolling import RollingBinScanner
+from tools.storage_benchmark import *
+from tools.background_analysis import BackgroundAnalysis, MAX_PENDING
+from tools.telemetry import *
+import tools.results_db as results_db
+import tools.host_sampler as host_sampler
+import tools.contention as contention
+import tools.phase_timer as phase_timer
+from tools.phase_timer import PhaseTimer, phase
+from tools.frame_quality import *
+from contextlib import redirect_stdout
 
 import datetime,time
 import argparse
 from pathlib import Path
 
 import os
-if os.name == 'nt':
+if os.name == 'nt' and "SENSING_DEV_ROOT" in os.environ:
     os.add_dll_directory(os.path.join(os.environ["SENSING_DEV_ROOT"], "bin"))
 
-from aravis import Aravis
+# ionpy and aravis are imported where the pipeline and the device are used,
+# so that --help and the simulated backend work without the sensing-dev SDK
 
 import re
 import json
 
 log_display = True
 
+ANALYSIS_LOG = 'analysis_log.txt'
+
 
 def set_commandline_options():
     parser = argparse.ArgumentParser(description="Performance test for your U3V Camera")
@@ -46,8 +62,72 @@ def set_commandline_options():
                         action='store_true', help='Run performance test in Realtime-evaluation.')
     parser.add_argument('-db', '--delete-bins', \
                         action='store_true', help='Delete bin files in --realtime-ecaluation-mode.')
+
+    parser.add_argument('-be', '--backend', default='aravis', choices=['aravis', 'simulated'], \
+                        help='Device backend. simulated runs the test with a synthetic camera')
+    parser.add_argument('--sim-width', default=1920, type=int, \
+                        help='Width of the simulated camera')
+    parser.add_argument('--sim-height', default=1080, type=int, \
+                        help='Height of the simulated camera')
+    parser.add_argument('--sim-pixelformat', default='Mono8', type=str, \
+                        help='PixelFormat of the simulated camera')
+    parser.add_argument('--sim-gendc', action='store_true', \
+                        help='Simulated camera streams GenDC')
+    parser.add_argument('--sim-fps', default=60.0, type=float, \
+                        help='Frame rate of the simulated camera (0: as fast as possible)')
+    parser.add_argument('--sim-drop-pattern', default=None, type=str, \
+                        help='Frames dropped by the simulated camera e.g. 10,20-25,every:100,rate:0.01')
+    parser.add_argument('-du', '--duration', default=None, type=str, \
+                        help='Run each test for this long instead of --number-of-frames e.g. 3600, 30m, 24h')
+    parser.add_argument('-ci', '--checkpoint-interval', default=60.0, type=float, \
+                        help='Seconds between soak summary checkpoints with --duration')
+    parser.add_argument('-rl', '--rolling', action='store_true', \
+                        help='Scan and delete each bin file as soon as the saver moves on to the next one')
+    parser.add_argument('-dc', '--disk-cap', default=None, type=float, \
+                        help='Stop recording when bin files take more than this many MB with --rolling')
+    parser.add_argument('-rp', '--reuse-pipeline', action='store_true', \
+                        help='Build the pipeline once and reuse it in all tests')
+    parser.add_argument('-pf', '--preflight', action='store_true', \
+                        help='Check that the volume of --directory can store the data of the cameras before the tests')
+    parser.add_argument('--preflight-fps', default=None, type=float, \
+                        help='Frame rate for --preflight if the device does not report AcquisitionFrameRate')
+    parser.add_argument('--preflight-duration', default=10.0, type=float, \
+                        help='Seconds of each phase of --preflight')
+    parser.add_argument('--preflight-min-headroom', default=MIN_HEADROOM, type=float, \
+                        help='Sustained write throughput required by --preflight, as a multiple of the camera data rate')
+    parser.add_argument('-pl', '--pipelined', action='store_true', \
+                        help='Analyse each test in a background process while the next test records')
+    parser.add_argument('-mp', '--max-pending', default=MAX_PENDING, type=int, \
+                        help='Tests waiting for or in analysis with --pipelined before recording waits')
+    parser.add_argument('-tp', '--telemetry-port', default=None, type=int, \
+                        help='Serve live metrics in the Prometheus text format on http://127.0.0.1:<port>/metrics')
+    parser.add_argument('-tf', '--telemetry-file', default=None, type=str, \
+                        help='Rewrite live metrics in the Prometheus text format to this file')
+    parser.add_argument('--telemetry-interval', default=SAMPLE_INTERVAL, type=float, \
+                        help='Seconds between samples of the live metrics')
+    parser.add_argument('-hs', '--host-sampler', action='store_true', \
+                        help='Sample CPU, memory, disk and context switches of the host from /proc during each test (Linux)')
+    parser.add_argument('--host-sampler-interval', default=host_sampler.SAMPLE_INTERVAL, type=float, \
+                        help='Seconds between samples of --host-sampler')
+    parser.add_argument('-st', '--stress', default=None, type=str, \
+                        help='Run contention generators next to each test: comma separated list of ' + ', '.join(contention.STRESS_KINDS))
+    parser.add_argument('--stress-levels', default=contention.STRESS_LEVELS, type=str, \
+                        help='Comma separated duty cycles (%%) of --stress; the tests are spread over them in increasing order')
+    parser.add_argument('-fq', '--frame-quality', action='store_true', \
+                        help='Mean, black and saturated pixels of the frames in realtime-evaluation mode (-re), subsampled when behind the camera')
+    parser.add_argument('-pr', '--profile', action='store_true', \
+                        help='Profile the analysis phases (bin scan, deletion, frame logs) of each test with cProfile')
+    parser.add_argument('--results-db', default=None, type=str, \
+                        help='Ingest the results of this campaign into this SQLite file (see tools/results_db.py)')
+    parser.add_argument('-lf', '--log-format', default='text', choices=LOG_FORMATS, \
+                        help='Format of frame logs: text, npz (compact binary) or both')
     return parser
 
+# with --reuse-pipeline in realtime-evaluation mode, runs that return within
+# DRAIN_MIN_WAIT of a frame interval returned a frame queued between the tests
+DRAIN_MIN_WAIT = 0.5
+DRAIN_TIMEOUT = 5.0
+
 def log_write(logtype, msg):
     if log_display:
         print("[LOG {0}][{1}] {2}".format(Path(__file__).name, logtype, msg))
@@ -64,6 +144,24 @@ def log_status_write(msg):
 def generate_prefix(ith_device):
     return 'camera-' + str(ith_device) + '-'
 
+def open_device(args):
+    if args.backend == 'simulated':
+        return SimulatedDevice(args.sim_width, args.sim_height, args.sim_pixelformat, args.sim_gendc, args.number_of_device, args.sim_fps)
+
+    from aravis import Aravis
+    Aravis.update_device_list()
+    connected_num_device = Aravis.get_n_devices()
+    if connected_num_device == 0:
+        Aravis.shutdown()
+        raise Exception("No device was found.")
+    first_camera = Aravis.get_device_id(0)
+    return Aravis.Camera.new(first_camera).get_device()
+
+def close_device(backend):
+    if backend == 'aravis':
+        from aravis import Aravis
+        Aravis.shutdown()
+
 def get_device_info(parser):
     dev_info ={}
     test_info = {}
@@ -77,6 +175,54 @@ def get_device_info(parser):
     test_info["Realtime-display mode"] = args.realtime_display_mode
     test_info["Delete Bin files"] = args.delete_bins
     test_info["Realtime-evaluation mode"] = args.realtime_evaluation_mode
+    test_info["Log format"] = args.log_format
+    test_info["Duration"] = parse_duration(args.duration) if args.duration else None
+    # the results are kept for every frame, so not with --duration
+    test_info["Frame quality"] = args.frame_quality and args.realtime_evaluation_mode and not test_info["Duration"]
+    if args.frame_quality and not test_info["Frame quality"]:
+        log_warning_write("--frame-quality needs -re without --duration and is disabled.")
+    test_info["Rolling"] = args.rolling and not args.realtime_evaluation_mode
+    test_info["Reuse pipeline"] = args.reuse_pipeline
+    test_info["Preflight"] = args.preflight and not args.realtime_evaluation_mode
+    if test_info["Preflight"]:
+        test_info["Preflight duration"] = args.preflight_duration
+        test_info["Preflight min headroom"] = args.preflight_min_headroom
+    if test_info["Rolling"]:
+        test_info["Disk cap (MB)"] = args.disk_cap
+    if test_info["Duration"]:
+        test_info["Checkpoint interval"] = args.checkpoint_interval
+    # bin files are scanned while recording with --rolling
+    test_info["Pipelined"] = args.pipelined and not args.realtime_evaluation_mode and not args.rolling
+    if test_info["Pipelined"]:
+        test_info["Max pending analyses"] = args.max_pending
+    test_info["Telemetry"] = args.telemetry_port is not None or args.telemetry_file is not None
+    if test_info["Telemetry"]:
+        test_info["Telemetry port"] = args.telemetry_port
+        test_info["Telemetry file"] = args.telemetry_file
+        test_info["Telemetry interval"] = args.telemetry_interval
+
+    test_info["Host sampler"] = args.host_sampler
+    if args.host_sampler and not host_sampler.is_supported():
+        log_warning_write("--host-sampler needs /proc and is disabled on this host.")
+        test_info["Host sampler"] = False
+    if test_info["Host sampler"]:
+        test_info["Host sampler interval"] = args.host_sampler_interval
+    test_info["Stress"] = args.stress.split(',') if args.stress else None
+    if test_info["Stress"]:
+        for kind in test_info["Stress"]:
+            if kind not in contention.STRESS_KINDS:
+                raise Exception("Unknown stress kind {} (choose from {})".format(kind, ', '.join(contention.STRESS_KINDS)))
+        test_info["Stress levels"] = contention.parse_stress_levels(args.stress_levels)
+        skipped_levels = contention.get_skipped_levels(test_info["Stress levels"], args.number_of_tests)
+        if skipped_levels:
+            log_warning_write("{} tests for {} stress levels: level {}% will not run. Set --number-of-tests to at least {}.".format(
+                args.number_of_tests, len(test_info["Stress levels"]), '%, '.join(str(l) for l in skipped_levels), len(test_info["Stress levels"])))
+    test_info["Profile"] = args.profile
+    test_info["Results DB"] = args.results_db
+    test_info["Backend"] = args.backend
+    if args.backend == 'simulated':
+        test_info["Simulated fps"] = args.sim_fps
+        test_info["Simulated drops"] = args.sim_drop_pattern
 
     dev_info["Number of Devices"] = args.number_of_device
 
@@ -93,13 +239,7 @@ def get_device_info(parser):
     os.mkdir(test_info["Output Directory"])
 
     # Access to the device
-    Aravis.update_device_list()
-    connected_num_device = Aravis.get_n_devices()
-    if connected_num_device == 0:
-        Aravis.shutdown()
-        raise Exception("No device was found.")
-    first_camera = Aravis.get_device_id(0)
-    device = Aravis.Camera.new(first_camera).get_device()
+    device = open_device(args)
 
     if device.is_feature_available("OperationMode"):
         dev_info["OperationMode"] = device.get_string_feature_value("OperationMode")
@@ -117,9 +257,13 @@ def get_device_info(parser):
     dev_info["Height"] = device.get_integer_feature_value("Height")
     dev_info["PayloadSize"] = device.get_integer_feature_value("PayloadSize")
     dev_info["PixelFormat"] = device.get_string_feature_value("PixelFormat")
+    if args.preflight_fps:
+        dev_info["FrameRate"] = args.preflight_fps
+    elif device.is_feature_available("AcquisitionFrameRate"):
+        dev_info["FrameRate"] = device.get_float_feature_value("AcquisitionFrameRate")
 
     del device
-    Aravis.shutdown()
+    close_device(args.backend)
 
     for key in dev_info:
         log_info_write("{0:>20s} : {1}".format(key, dev_info[key]))
@@ -164,11 +308,23 @@ def get_bytedepth(int_pf):
     else:
         raise Exception(int_pf + " is not supported as default in this tool.\nPlease update getPixelFormatInInt() ")
 
-def process_and_save(dev_info, test_info, output_directory_path, eval_while_recording):
-
-    # sys.exit(1)
-    framecount_record = {}
-
+def create_output_buffers(dev_info):
+    # output arrays of realtime-evaluation mode: an image and a framecount per device
+    data_type = np.uint8 if get_bytedepth(eval(dev_info["PixelFormat"])) == 1 else np.uint16
+
+    output_datas = []
+    output_size = (dev_info["Height"], dev_info["Width"], )
+    if dev_info["PixelFormat"] == "RGB8" or dev_info["PixelFormat"] == "BGR8":
+        output_size += (3,)
+    fcdatas = []
+    for i in range(dev_info["Number of Devices"]):
+        output_datas.append(np.full(output_size, fill_value=0, dtype=data_type))
+        fcdatas.append(np.zeros(1, dtype=np.uint32))
+    return output_datas, fcdatas
+
+def build_ion_pipeline(dev_info, test_info, output_directory_path, eval_while_recording, output_datas, fcdatas):
+    # return the builder and the buffers bound to it, which have to outlive the builder
+    from ionpy import Node, Builder, Buffer, Port, Param, Type, TypeCode
     builder = Builder()
     builder.set_target('host')
     builder.with_bb_module('ion-bb')
@@ -192,90 +348,336 @@ def process_and_save(dev_info, test_info, output_directory_path, eval_while_reco
     log_status_write("Acquisition BB: {}".format(acquisition_BB))
     node = builder.add(acquisition_BB)\
         .set_params([num_devices, frame_sync, realtime_display_mode, ])
-    
+
     # the second BB: optional
     if eval_while_recording:
         output_p = node.get_port('output')
         frame_count_p = node.get_port('frame_count')
         # output values
-        data_type = np.uint8 if get_bytedepth(eval(dev_info["PixelFormat"])) == 1 else np.uint16
-        
         outputs = []
-        output_datas = []
-        output_size = (dev_info["Height"], dev_info["Width"], )
-        if dev_info["PixelFormat"] == "RGB8" or dev_info["PixelFormat"] == "BGR8":
-            output_size += (3,)
-        fcdatas = []
         frame_counts = []
         for i in range(dev_info["Number of Devices"]):
-            output_datas.append(np.full(output_size, fill_value=0, dtype=data_type))
             outputs.append(Buffer(array= output_datas[i]))
-            fcdatas.append(np.zeros(1, dtype=np.uint32))
             frame_counts.append(Buffer(array=fcdatas[i]))
 
         output_p.bind(outputs)
         frame_count_p.bind(frame_counts)
 
+        return builder, [outputs, frame_counts]
+
+    prefix_params = [Param('prefix', generate_prefix(0)), Param('prefix', generate_prefix(1))]
+    terminators = [Buffer(Type(TypeCode.Int, 32, 1), ()), Buffer(Type(TypeCode.Int, 32, 1), ())]
+    out_nodes = []
+
+    if dev_info["GenDCStreamingMode"]:
+        for ith_device in range(dev_info["Number of Devices"]):
+            saving_BB = get_bb_for_save_image(dev_info["GenDCStreamingMode"], dev_info["PixelFormat"])
+            log_status_write("Saving BB: {}".format(saving_BB))
+            out_nodes.append(builder.add(saving_BB)\
+                .set_iports([node.get_port('gendc')[ith_device], node.get_port('device_info')[ith_device], payloadsize_p, ])\
+                .set_params([prefix_params[ith_device], output_directory]))
+
+    else:
+        for ith_device in range(dev_info["Number of Devices"]):
+            saving_BB = get_bb_for_save_image(dev_info["GenDCStreamingMode"], dev_info["PixelFormat"])
+            log_status_write("Saving BB: {}".format(saving_BB))
+            out_nodes.append(builder.add(saving_BB)\
+                .set_iports([
+                    node.get_port('output')[ith_device],
+                    node.get_port('device_info')[ith_device],
+                    node.get_port('frame_count')[ith_device],
+                    wp, hp, ])\
+                .set_params([prefix_params[ith_device], output_directory]))
+
+    if dev_info["GenDCStreamingMode"]:
+        payloadsize_p.bind(dev_info["PayloadSize"])
+    else:
+        wp.bind(dev_info["Width"])
+        hp.bind(dev_info["Height"])
+
+    # output values
+    for ith_device in range(dev_info["Number of Devices"]):
+        out_nodes[ith_device].get_port('output').bind(terminators[ith_device])
+
+    return builder, [terminators]
+
+def build_simulated_pipeline(dev_info, test_info, output_directory_path, eval_while_recording, output_datas, fcdatas):
+    log_status_write("Acquisition BB: simulated camera")
+    prefixes = [generate_prefix(i) for i in range(dev_info["Number of Devices"])]
+    builder = SimulatedBuilder(dev_info, output_directory_path, prefixes,
+                               test_info["Simulated fps"], test_info["Simulated drops"],
+                               output_datas if eval_while_recording else None,
+                               fcdatas if eval_while_recording else None)
+    return builder, []
+
+class TimedBuilder:
+    # builder.run() with the time the first and the last run returned;
+    # the first run includes the compile of the pipeline and the device open
+    def __init__(self, builder):
+        self.builder_ = builder
+        self.first_run_end_ns_ = None
+        self.last_run_end_ns_ = None
+        self.num_runs_ = 0
+
+    def run(self):
+        self.builder_.run()
+        self.last_run_end_ns_ = time.perf_counter_ns()
+        self.num_runs_ += 1
+        if self.first_run_end_ns_ is None:
+            self.first_run_end_ns_ = self.last_run_end_ns_
+
+    def __getattr__(self, name):
+        return getattr(self.builder_, name)
+
+def can_reuse_pipeline(test_info, eval_while_recording):
+    # the output directory of the ion savers is fixed when the pipeline is built
+    return eval_while_recording or test_info["Backend"] == 'simulated'
+
+def drain_queued_frames(builder, frame_interval):
+    # the camera kept streaming while the previous test was post-processed; the
+    # frames queued meanwhile come back at once and are discarded until a run
+    # has to wait for a new frame, so that the gap is not logged as drops
+    num_discarded = 0
+    end = time.perf_counter() + DRAIN_TIMEOUT
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        builder.run()
+        if time.perf_counter() - start >= frame_interval * DRAIN_MIN_WAIT:
+            break
+        num_discarded += 1
+    return num_discarded
+
+def get_pipeline(dev_info, test_info, output_directory_path, eval_while_recording, pipeline):
+    # pipeline: dict kept across tests with --reuse-pipeline, None otherwise
+    if pipeline:
+        if not eval_while_recording:
+            pipeline["builder"].set_output_directory(output_directory_path)
+        else:
+            frame_interval = 1.0 / dev_info["FrameRate"] if dev_info.get("FrameRate") else pipeline.get("frame_interval")
+            if frame_interval:
+                num_discarded = drain_queued_frames(pipeline["builder"], frame_interval)
+                log_info_write("{} frames queued since the previous test are discarded".format(num_discarded))
+            else:
+                log_warning_write("The frame interval is unknown; frames queued since the previous test are not discarded.")
+        return pipeline["builder"], pipeline["output_datas"], pipeline["fcdatas"]
+
+    output_datas, fcdatas = create_output_buffers(dev_info) if eval_while_recording else (None, None)
+    if test_info["Backend"] == 'simulated':
+        builder, bound_buffers = build_simulated_pipeline(dev_info, test_info, output_directory_path, eval_while_recording, output_datas, fcdatas)
+    else:
+        builder, bound_buffers = build_ion_pipeline(dev_info, test_info, output_directory_path, eval_while_recording, output_datas, fcdatas)
+
+    if pipeline is not None and can_reuse_pipeline(test_info, eval_while_recording):
+        # the bound buffers have to outlive the builder
+        pipeline.update({"builder": builder, "bound_buffers": bound_buffers,
+                         "output_datas": output_datas, "fcdatas": fcdatas})
+    return builder, output_datas, fcdatas
+
+def process_and_save(dev_info, test_info, output_directory_path, eval_while_recording, pipeline=None, test_time=None, telemetry=None, timer=None):
+
+    # sys.exit(1)
+    sampler = None
+    builder = None
+    try:
+        if test_info["Host sampler"]:
+            sampler = host_sampler.HostSampler(output_directory_path, test_info["Host sampler interval"])
+            sampler.start()
+        setup_start_ns = time.perf_counter_ns()
+        with phase(timer, "pipeline_build"):
+            pipeline_builder, output_datas, fcdatas = get_pipeline(dev_info, test_info, output_directory_path, eval_while_recording, pipeline)
+        build_end_ns = time.perf_counter_ns()
+        builder = TimedBuilder(pipeline_builder)
+        return record(builder, dev_info, test_info, output_directory_path, eval_while_recording, fcdatas, telemetry, timer, output_datas)
+    finally:
+        if builder and builder.first_run_end_ns_ is not None:
+            if test_time is not None:
+                test_time["setup"] = (builder.first_run_end_ns_ - setup_start_ns) / 1e9
+                test_time["recording"] = (builder.last_run_end_ns_ - builder.first_run_end_ns_) / 1e9
+            if timer:
+                # the ion pipeline is compiled in the first builder.run()
+                timer.add("first_run", (builder.first_run_end_ns_ - build_end_ns) / 1e9)
+                timer.add("recording", (builder.last_run_end_ns_ - builder.first_run_end_ns_) / 1e9)
+            if pipeline is not None and builder.num_runs_ > 1:
+                # to discard the queued frames before the next test if the device has no frame rate
+                pipeline["frame_interval"] = (builder.last_run_end_ns_ - builder.first_run_end_ns_) / 1e9 / (builder.num_runs_ - 1)
+        if sampler:
+            overhead = sampler.stop()
+            sampler.write(output_directory_path, overhead, builder.first_run_end_ns_ if builder else None,
+                          builder.last_run_end_ns_ if builder else None)
+            log_info_write("Host sampler: {num_samples} samples, {cpu_ms_per_sample:.3f} ms CPU per sample "
+                           "({cpu_share_pct:.3f}% of a core), interval {interval_s} s".format(**overhead))
+
+def set_telemetry_probes(telemetry, dev_info, output_directory_path, probes):
+    if telemetry:
+        telemetry.set_probes(os.path.basename(output_directory_path),
+                             [generate_prefix(nd) for nd in range(dev_info["Number of Devices"])], probes)
+
+def record(builder, dev_info, test_info, output_directory_path, eval_while_recording, fcdatas, telemetry=None, timer=None, output_datas=None):
+    framecount_record = {}
+
+    if eval_while_recording and test_info["Duration"]:
+        run_soak(builder, dev_info, test_info, fcdatas, output_directory_path, telemetry)
+
+    elif eval_while_recording:
         for i in range(dev_info["Number of Devices"]):
             framecount_record[i] = []
+        set_telemetry_probes(telemetry, dev_info, output_directory_path,
+                             [FramecountListProbe(framecount_record[nd]) for nd in range(dev_info["Number of Devices"])])
 
         log_status_write("Recording and evaluating Process... Framecount is stored during the record.")
 
+        run_start_ns = np.zeros(test_info["Number of Frames"], dtype=np.int64)
+        run_end_ns = np.zeros(test_info["Number of Frames"], dtype=np.int64)
+
+        quality = None
+        if test_info["Frame quality"]:
+            pfnc_pixelformat = get_pixelformat_in_int(dev_info["PixelFormat"])
+            max_value = get_max_value(pfnc_pixelformat, get_bytedepth(pfnc_pixelformat))
+            quality = FrameQualityMonitor(output_datas, fcdatas, max_value, test_info["Number of Frames"])
+            quality.start()
+
         for x in range(test_info["Number of Frames"]):
+            run_start_ns[x] = time.perf_counter_ns()
             builder.run()
+            run_end_ns[x] = time.perf_counter_ns()
 
             for nd in range(dev_info["Number of Devices"]):
-                framecount_record[nd].append(fcdatas[i][0])
+                framecount_record[nd].append(fcdatas[nd][0])
+            if quality:
+                quality.push()
 
-    else:
-        prefix_params = [Param('prefix', generate_prefix(0)), Param('prefix', generate_prefix(1))]
-        terminators = [Buffer(Type(TypeCode.Int, 32, 1), ()), Buffer(Type(TypeCode.Int, 32, 1), ())]
-        out_nodes = []
-
-        if dev_info["GenDCStreamingMode"]:
-            for ith_device in range(dev_info["Number of Devices"]):
-                saving_BB = get_bb_for_save_image(dev_info["GenDCStreamingMode"], dev_info["PixelFormat"])
-                log_status_write("Saving BB: {}".format(saving_BB))
-                out_nodes.append(builder.add(saving_BB)\
-                    .set_iports([node.get_port('gendc')[ith_device], node.get_port('device_info')[ith_device], payloadsize_p, ])\
-                    .set_params([prefix_params[ith_device], output_directory]))
-            
-        else:
-            for ith_device in range(dev_info["Number of Devices"]):
-                saving_BB = get_bb_for_save_image(dev_info["GenDCStreamingMode"], dev_info["PixelFormat"])
-                log_status_write("Saving BB: {}".format(saving_BB))
-                out_nodes.append(builder.add(saving_BB)\
-                    .set_iports([
-                        node.get_port('output')[ith_device], 
-                        node.get_port('device_info')[ith_device], 
-                        node.get_port('frame_count')[ith_device], 
-                        wp, hp, ])\
-                    .set_params([prefix_params[ith_device], output_directory]))
-   
-        if dev_info["GenDCStreamingMode"]:
-            payloadsize_p.bind(dev_info["PayloadSize"])
-        else:
-            wp.bind(dev_info["Width"])
-            hp.bind(dev_info["Height"])
+        if quality:
+            quality.stop()
+            quality.write(output_directory_path, [generate_prefix(nd) for nd in range(dev_info["Number of Devices"])])
+            for nd in range(dev_info["Number of Devices"]):
+                print_frame_quality(generate_prefix(nd), quality.get_stats(nd))
 
-        # output values 
-        for ith_device in range(dev_info["Number of Devices"]):
-            out_nodes[ith_device].get_port('output').bind(terminators[ith_device])
+        log_status_write("Post Recording Process... Frame timing logs will be generated.")
+        with phase(timer, "timing_log", profile=True):
+            write_timing_data(run_start_ns, run_end_ns, [framecount_record[nd] for nd in framecount_record], output_directory_path)
+            for nd in framecount_record:
+                timing_stats = get_timing_stats(run_start_ns, run_end_ns, framecount_record[nd])
+                print_timing_stats(generate_prefix(nd), timing_stats)
+                write_timing_log(generate_prefix(nd), timing_stats, output_directory_path)
 
+    else:
         log_status_write("Recording Process... Bin files are generated.")
+        set_telemetry_probes(telemetry, dev_info, output_directory_path,
+                             [BinFileProbe(output_directory_path, generate_prefix(nd), get_record_size(dev_info)) for nd in range(dev_info["Number of Devices"])])
+
+        scanner = None
+        if test_info["Rolling"]:
+            disk_cap = test_info["Disk cap (MB)"]
+            scanner = RollingBinScanner(output_directory_path, [generate_prefix(nd) for nd in range(dev_info["Number of Devices"])],
+                                        int(disk_cap * 1024 * 1024) if disk_cap else None)
+            scanner.start()
+
+        def should_stop():
+            if scanner and scanner.has_failed():
+                log_warning_write("Scanning bin files failed: {}. Recording is stopped.".format(scanner.error_))
+                return True
+            if scanner and scanner.is_over_cap():
+                log_warning_write("Bin files exceed the disk cap of {} MB. Recording is stopped.".format(test_info["Disk cap (MB)"]))
+                return True
+            return False
+
+        if test_info["Duration"]:
+            end_ns = time.perf_counter_ns() + int(test_info["Duration"] * 1e9)
+            while time.perf_counter_ns() < end_ns and not should_stop():
+                builder.run()
+        else:
+            for x in range(test_info["Number of Frames"]):
+                if should_stop():
+                    break
+                builder.run()
 
-        for x in range(test_info["Number of Frames"]):
-            builder.run()
+        if test_info["Backend"] == 'simulated':
+            builder.close()
+
+        if test_info["Pipelined"]:
+            # the bin files are checked by the background analysis
+            return None
 
         log_status_write("Post Recording Process... check frameskip.")
-        for ith_device in range(dev_info["Number of Devices"]):
-            pti = PerformanceTestItems(output_directory_path, generate_prefix(ith_device))
-            filtered_items_list, configs = pti.check_frame_catch_rate_of_ext('bin')
-            fc = FrameCheck(output_directory_path, filtered_items_list[0], display_result=True)
-            framecount_record[ith_device] = fc.frame_check_bin_prefix(os.path.join(output_directory_path, configs[0]), False)
+        if scanner:
+            with phase(timer, "bin_scan", profile=True):
+                framecounts = scanner.finish()
+                log_info_write("{} bin files scanned while recording, peak disk usage {:.1f} MB".format(
+                    scanner.num_scanned_, scanner.peak_disk_usage_ / (1024 * 1024)))
+                for ith_device in range(dev_info["Number of Devices"]):
+                    fc = FrameCheck(output_directory_path, [], display_result=True)
+                    framecount_record[ith_device] = fc.frame_check_bin_prefix(
+                        os.path.join(output_directory_path, generate_prefix(ith_device) + CONFIG_SUFFIX), False,
+                        framecounts=framecounts[ith_device])
+            return framecount_record
+
+        with phase(timer, "bin_scan", profile=True):
+            return check_bin_files(dev_info, output_directory_path)
 
     return framecount_record
 
+def check_bin_files(dev_info, output_directory_path):
+    framecount_record = {}
+    # GenDC containers carry the device timestamp of every frame
+    timestamps = dev_info["GenDCStreamingMode"]
+    frame_checks = {}
+    for ith_device in range(dev_info["Number of Devices"]):
+        pti = PerformanceTestItems(output_directory_path, generate_prefix(ith_device))
+        filtered_items_list, configs = pti.check_frame_catch_rate_of_ext('bin')
+        fc = FrameCheck(output_directory_path, filtered_items_list[0], display_result=True)
+        framecount_record[ith_device] = fc.frame_check_bin_prefix(os.path.join(output_directory_path, configs[0]), False, timestamps=timestamps)
+        frame_checks[generate_prefix(ith_device)] = fc
+    if timestamps:
+        write_timestamp_logs(output_directory_path, frame_checks)
+    return framecount_record
+
+
+def run_soak(builder, dev_info, test_info, fcdatas, output_directory_path, telemetry=None):
+    # framecounts are folded into running statistics instead of being kept,
+    # so memory stays constant however long the test runs
+    log_status_write("Soak Process... Summary is checkpointed every {} s.".format(test_info["Checkpoint interval"]))
+    num_devices = dev_info["Number of Devices"]
+    start_ns = time.perf_counter_ns()
+    end_ns = start_ns + int(test_info["Duration"] * 1e9)
+    checkpoint_interval_ns = int(test_info["Checkpoint interval"] * 1e9)
+    next_checkpoint_ns = start_ns + checkpoint_interval_ns
+    rings = [FramecountRing() for nd in range(num_devices)]
+    stats = [RunningStats(start_ns) for nd in range(num_devices)]
+    set_telemetry_probes(telemetry, dev_info, output_directory_path, [RunningStatsProbe(stats[nd], rings[nd]) for nd in range(num_devices)])
+
+    def checkpoint(now_ns):
+        for nd in range(num_devices):
+            stats[nd].fold_ring(rings[nd])
+            write_soak_summary(generate_prefix(nd), stats[nd].to_dict(now_ns), output_directory_path)
+
+    now_ns = start_ns
+    while now_ns < end_ns:
+        builder.run()
+        now_ns = time.perf_counter_ns()
+        for nd in range(num_devices):
+            rings[nd].append(fcdatas[nd][0], now_ns)
+            if rings[nd].is_full():
+                stats[nd].fold_ring(rings[nd])
+        if now_ns >= next_checkpoint_ns:
+            checkpoint(now_ns)
+            next_checkpoint_ns += checkpoint_interval_ns
+
+    checkpoint(now_ns)
+    for nd in range(num_devices):
+        print_soak_summary(generate_prefix(nd), stats[nd].to_dict(now_ns))
+
+
+def check_storage(dev_info, test_info):
+    if "FrameRate" not in dev_info:
+        raise Exception("The frame rate of the device is unknown. Set it with --preflight-fps")
+    log_status_write("Storage pre-flight... Writing to {} for {} s twice.".format(test_info["Output Directory"], test_info["Preflight duration"]))
+    result = run_storage_benchmark(test_info["Output Directory"], get_record_size(dev_info), dev_info["Number of Devices"],
+                                   dev_info["FrameRate"], test_info["Preflight duration"])
+    print_storage_benchmark(result)
+    write_storage_benchmark(result, test_info["Output Directory"])
+    if result["headroom"] is None or result["headroom"] < test_info["Preflight min headroom"]:
+        raise Exception("The volume of {} sustains {:.1f} MB/s, less than {} times the {:.1f} MB/s of the cameras".format(
+            test_info["Output Directory"], result["unpaced"]["mb_per_s"] or 0.0, test_info["Preflight min headroom"], result["required_mb_per_s"]))
 
 def delete_bin_files(output_directory, ith_sensor):
     log_status_write("Post Recording Process... Deleting bin files.")
@@ -283,11 +685,74 @@ def delete_bin_files(output_directory, ith_sensor):
     for i, bf in enumerate(bin_files):
         bin_file = os.path.join(output_directory, bf)
         os.remove(bin_file)
-            
+        # frame index is useless without its bin file
+        if os.path.isfile(get_index_path(bin_file)):
+            os.remove(get_index_path(bin_file))
+
+def post_process(dev_info, test_info, output_directory, frame_counts, timer=None):
+    if test_info["Delete Bin files"]:
+        with phase(timer, "delete_bin_files", profile=True):
+            for nd in range(dev_info["Number of Devices"]):
+                delete_bin_files(output_directory, nd)
+    log_status_write("Post Recording Process... A log for frameskip will be generated.")
+
+    with phase(timer, "write_log", profile=True):
+        for nd in  frame_counts:
+            ret = write_log(dev_info["Width"], dev_info["Height"], generate_prefix(nd), frame_counts[nd],  output_directory, test_info["Log format"])
+
+def analyze_test(dev_info, test_info, output_directory):
+    # runs in the background analysis process; the output of the checks goes
+    # to analysis_log.txt of the test and the catch rate of each device is returned
+    start = time.perf_counter()
+    log_file = os.path.join(output_directory, ANALYSIS_LOG)
+    timer = PhaseTimer(test_info["Profile"])
+    with open(log_file, mode='w') as f, redirect_stdout(f):
+        with timer.phase("bin_scan", profile=True):
+            frame_counts = check_bin_files(dev_info, output_directory)
+        post_process(dev_info, test_info, output_directory, frame_counts, timer)
+    # added to the phases of the recording
+    timer.write(output_directory)
+    result = {"log": log_file, "devices": {}}
+    for nd in frame_counts:
+        framecount = frame_counts[nd]
+        if len(framecount) > 0:
+            num_frames = framecount[-1] - framecount[0] + 1
+            result["devices"][nd] = (len(framecount), num_frames, len(framecount) * 100.0 / num_frames)
+    result["time"] = time.perf_counter() - start
+    return result
+
+def print_analysis_result(i, result):
+    print(f"test-{i} analysis time(s): {result['time']} ({result['log']})")
+    for nd in result["devices"]:
+        num_catch, num_frames, rate = result["devices"][nd]
+        print("  {}frame catch rate : {}% ({} / {} frames)".format(generate_prefix(nd), rate, num_catch, num_frames))
+
 if __name__ == "__main__":
 
     parser = set_commandline_options()
+    discovery_start = time.perf_counter()
     dev_info, test_info = get_device_info(parser)
+    campaign_phases = {"device_discovery": time.perf_counter() - discovery_start}
+    # device, test parameters, host and tool versions for the results database
+    results_db.write_campaign_info(test_info["Output Directory"], dev_info, test_info)
+
+    pipeline = None
+    if test_info["Reuse pipeline"]:
+        pipeline = {}
+        if not can_reuse_pipeline(test_info, test_info["Realtime-evaluation mode"]):
+            log_warning_write("The pipeline is rebuilt in every test as the output directory of the savers cannot be changed once it is built.")
+
+    if test_info["Preflight"]:
+        check_storage(dev_info, test_info)
+
+    telemetry = None
+    if test_info["Telemetry"]:
+        telemetry = TelemetrySampler(test_info["Output Directory"], test_info["Telemetry file"],
+                                     test_info["Telemetry port"], test_info["Telemetry interval"])
+        telemetry.start()
+
+    analysis = BackgroundAnalysis(test_info["Max pending analyses"]) if test_info["Pipelined"] else None
+    stress_steps = []
 
     for i in range(test_info["Number of Tests"]):
         start = time.time()
@@ -295,16 +760,67 @@ if __name__ == "__main__":
         ith_test_output_directory = os.path.join(test_info["Output Directory"], str(i))
         os.mkdir(ith_test_output_directory)
 
-        frame_counts = process_and_save(dev_info, test_info, ith_test_output_directory, test_info["Realtime-evaluation mode"])
-
-        if test_info["Delete Bin files"]:
-            for nd in range(dev_info["Number of Devices"]):
-                delete_bin_files(ith_test_output_directory, nd)
-        log_status_write("Post Recording Process... A log for frameskip will be generated.")
-        
-        for nd in  frame_counts:
-            ret = write_log(dev_info["Width"], dev_info["Height"], generate_prefix(nd), frame_counts[nd],  ith_test_output_directory)
+        injector = None
+        if test_info["Stress"]:
+            level = contention.get_stress_level(test_info["Stress levels"], i, test_info["Number of Tests"])
+            log_info_write("test-{} stress level: {}% ({})".format(i, level, ', '.join(test_info["Stress"])))
+            injector = contention.ContentionInjector(test_info["Stress"], level, ith_test_output_directory)
+            injector.start()
+
+        test_time = {}
+        timer = PhaseTimer(test_info["Profile"])
+        try:
+            frame_counts = process_and_save(dev_info, test_info, ith_test_output_directory, test_info["Realtime-evaluation mode"], pipeline, test_time, telemetry, timer)
+        finally:
+            if injector:
+                load = injector.stop()
+                stress_steps.append({"test": i, "level": level, "load": load})
+                log_info_write("test-{} stress load: {}".format(i, ', '.join('{} {:.1f}'.format(k, v) for k, v in load.items())))
+        if test_time:
+            print(f"test-{i} setup time(s): {test_time['setup']}, recording time(s): {test_time['recording']}")
+
+        if analysis:
+            # written before the analysis adds its phases
+            timer.write(ith_test_output_directory)
+            waited = analysis.submit(analyze_test, dev_info, test_info, ith_test_output_directory)
+            if waited > 0.1:
+                log_warning_write("Waited {:.1f} s for the background analysis of an earlier test".format(waited))
+        else:
+            post_process(dev_info, test_info, ith_test_output_directory, frame_counts, timer)
+            timer.write(ith_test_output_directory)
 
         end = time.time()
-        print(f"test-{i} time in total(s) for {test_info['Number of Frames']} frames:", end - start)
+        if test_info["Duration"]:
+            print(f"test-{i} time in total(s) for {test_info['Duration']} s:", end - start)
+        else:
+            print(f"test-{i} time in total(s) for {test_info['Number of Frames']} frames:", end - start)
+
+    if telemetry:
+        num_samples, cpu_ms, cpu_ratio = telemetry.stop()
+        log_info_write("Telemetry sampler: {} samples, {:.3f} ms CPU per sample ({:.3f}% of a core)".format(num_samples, cpu_ms, cpu_ratio))
+
+    if analysis:
+        log_status_write("Waiting for the background analysis...")
+        for i, future in enumerate(analysis.join()):
+            try:
+                print_analysis_result(i, future.result())
+            except Exception as e:
+                log_warning_write("Analysis of test-{} failed: {}".format(i, e))
+
+    # statistics across all tests, timed with the frame rate of the device
+    s, rows = summary.summarize(test_info["Output Directory"], dev_info.get("FrameRate") or test_info.get("Simulated fps"))
+    summary.print_summary(s)
+    summary.write_summary(test_info["Output Directory"], s, rows)
+
+    phases = phase_timer.summarize_phases(test_info["Output Directory"], campaign_phases)
+    phase_timer.print_phase_summary(phases)
+    phase_timer.write_phase_summary(test_info["Output Directory"], phases)
+
+    if test_info["Stress"]:
+        report = contention.get_stress_report(test_info["Output Directory"], test_info["Stress"], test_info["Stress levels"], stress_steps)
+        contention.print_stress_report(report)
+        contention.write_stress_report(test_info["Output Directory"], report)
+
+    if test_info["Results DB"]:
+        results_db.ingest(test_info["Results DB"], [test_info["Output Directory"]])
     
@@ -0,0 +1,63 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ctypes
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+
+################################################################################
+#
+# Background analysis of finished tests
+#
+# One worker process at a lower CPU priority than the acquisition analyses the
+# tests in the order they were recorded. At most max_pending tests wait for or
+# are in analysis; recording of the next test waits for the oldest one beyond
+# that, so a campaign never has more than max_pending tests of bin files on
+# the disk on top of the one being recorded.
+#
+# The worker is spawned, not forked: by the first test the acquisition,
+# telemetry and host sampler threads are running, and a forked child can
+# deadlock on a lock one of them held.
+#
+################################################################################
+
+MAX_PENDING = 2
+ANALYSIS_NICENESS = 10
+BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+
+
+def lower_priority():
+    if hasattr(os, 'nice'):
+        os.nice(ANALYSIS_NICENESS)
+    elif os.name == 'nt':
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), BELOW_NORMAL_PRIORITY_CLASS)
+
+
+class BackgroundAnalysis:
+    def __init__(self, max_pending=MAX_PENDING):
+        self.executor_ = ProcessPoolExecutor(max_workers=1, initializer=lower_priority,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        self.max_pending_ = max(1, max_pending)
+        self.pending_ = deque()
+        self.futures_ = []
+
+    def submit(self, fn, *args):
+        # returns the seconds spent waiting for a free slot
+        start = time.perf_counter()
+        while self.pending_ and self.pending_[0].done():
+            self.pending_.popleft()
+        while len(self.pending_) >= self.max_pending_:
+            wait([self.pending_.popleft()])
+        future = self.executor_.submit(fn, *args)
+        self.pending_.append(future)
+        self.futures_.append(future)
+        return time.perf_counter() - start
+
+    def join(self):
+        # futures of every submitted analysis in the order of submission
+        self.executor_.shutdown(wait=True)
+        return self.futures_
@@ -0,0 +1,150 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mmap
+import struct
+from contextlib import contextmanager
+import numpy as np
+
+from tools.util import *
+import tools.gendc_header as gendc_header
+
+
+################################################################################
+#
+# memory-map a bin file and give a read-only memoryview over its content.
+# frames are addressed by offsets on the view, so nothing is copied per frame
+# and the pages are paged in/out by the OS regardless of the file size.
+#
+################################################################################
+@contextmanager
+def map_bin_file(bin_file):
+    with open(bin_file, mode='rb') as ifs:
+        # mmap cannot map an empty file
+        if os.fstat(ifs.fileno()).st_size == 0:
+            yield memoryview(b'')
+            return
+        with mmap.mmap(ifs.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            filecontent = memoryview(mm)
+            try:
+                yield filecontent
+            finally:
+                filecontent.release()
+
+
+def import_gendc_python():
+    # gendc_python comes with the sensing-dev SDK; None if it is not installed
+    try:
+        from gendc_python.gendc_separator import descriptor as gendc
+    except ImportError:
+        return None
+    return gendc
+
+
+def read_frame_by_gendc_python(filecontent, cursor):
+    # return the framecount, the container size and the timestamp of the container at cursor
+    gendc = import_gendc_python()
+    if gendc is None:
+        raise Exception("gendc_python is not installed")
+    gendc_container = gendc.Container(filecontent[cursor:])
+    image_component_idx = gendc_container.get_1st_component_idx_by_typeid(GDC_INTENSITY)
+    image_component = gendc_container.get_component_by_index(image_component_idx)
+    part = image_component.get_part_by_index(0)
+    typespecific3 = part.get_typespecific_by_index(2)
+    saved_idx = int.from_bytes(typespecific3.to_bytes(8, 'little')[0:4], "little")
+    return saved_idx, gendc_container.get_container_size(), image_component.get("Timestamp")
+
+
+def iterate_frame(filecontent, framesize):
+    # yield offset, framecount, size and timestamp of every frame of the file.
+    # the format is decided once from the first descriptor; errors of
+    # gendc_python on a GenDC file are raised, not read as binarysaver records
+    gendc = is_gendc_file(filecontent)
+    cursor = 0
+    while cursor < len(filecontent):
+        if gendc:
+            saved_idx, size, timestamp = read_frame_by_gendc_python(filecontent, cursor)
+        else:
+            saved_idx = struct.unpack_from('I', filecontent, cursor)[0]
+            size, timestamp = 4 + framesize, 0
+        yield cursor, saved_idx, size, timestamp
+        cursor += size
+
+
+def is_gendc_file(filecontent):
+    return gendc_header.is_gendc_descriptor(filecontent)
+
+
+################################################################################
+#
+# Frame index of a bin file: the offset and the framecount of every frame,
+# plus the container size and the timestamp for GenDC.
+#
+################################################################################
+def scan_by_gendc_python(filecontent, framesize):
+    frames = np.array(list(iterate_frame(filecontent, framesize)), dtype=np.uint64).reshape(-1, 4)
+    frame_index = {
+        'offset': frames[:, 0].copy(),
+        'framecount': frames[:, 1].astype(np.uint32),
+    }
+    if is_gendc_file(filecontent):
+        frame_index['container_size'] = frames[:, 2].copy()
+        frame_index['timestamp'] = frames[:, 3].copy()
+    return frame_index
+
+
+def scan_raw(filecontent, framesize):
+    # image_io_binarysaver_* writes fixed-size records: 4-byte framecount + frame.
+    # returns None if the file does not consist of whole records.
+    stride = 4 + framesize
+    if len(filecontent) % stride != 0:
+        return None
+    num_frames = len(filecontent) // stride
+    # strided view over the mapped file; copy out the framecounts so that the
+    # view does not keep the mapping exported
+    return {
+        'offset': np.arange(num_frames, dtype=np.uint64) * np.uint64(stride),
+        'framecount': np.ndarray(shape=(num_frames,), dtype='<u4',
+                                 buffer=filecontent, strides=(stride,)).copy(),
+    }
+
+
+def scan_gendc(filecontent, framesize, cross_check=False):
+    # header-only scan; gendc_python is used as the fallback and to validate
+    # the first and the last container (or all of them with cross_check)
+    try:
+        frame_index = gendc_header.scan_gendc(filecontent)
+    except Exception as e:
+        print('GenDC header reader failed ({}). fall back to gendc_python'.format(e))
+        return scan_by_gendc_python(filecontent, framesize)
+
+    if import_gendc_python() is None:
+        if cross_check:
+            raise Exception("gendc_python is required to cross-check GenDC containers")
+        return frame_index
+
+    num_frames = len(frame_index['offset'])
+    check_idx = range(num_frames) if cross_check else sorted({0, num_frames - 1})
+    for k in check_idx:
+        if k < 0:
+            break
+        expected_idx, _, _ = read_frame_by_gendc_python(filecontent, int(frame_index['offset'][k]))
+        if expected_idx != frame_index['framecount'][k]:
+            print('GenDC header reader does not match gendc_python at container {}. fall back to gendc_python'.format(k))
+            return scan_by_gendc_python(filecontent, framesize)
+    return frame_index
+
+
+def scan_frame_index(filecontent, framesize, cross_check=False):
+    if is_gendc_file(filecontent):
+        return scan_gendc(filecontent, framesize, cross_check)
+    frame_index = scan_raw(filecontent, framesize)
+    if frame_index is not None:
+        return frame_index
+    return scan_by_gendc_python(filecontent, framesize)
+
+
+def scan_framecount(filecontent, framesize, cross_check=False):
+    # return the framecounts of all frames in a bin file as uint32 array
+    return scan_frame_index(filecontent, framesize, cross_check)['framecount']
@@ -0,0 +1,245 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import multiprocessing
+import time
+import numpy as np
+
+import tools.summary as summary
+from tools.soak import SOAK_SUMMARY_SUFFIX
+
+################################################################################
+#
+# Contention injector
+#
+# Generators of CPU, memory-bandwidth and disk-write load run as processes
+# (so they do not compete with the acquisition for the GIL) next to a test.
+# Each generator works for level% of every DUTY_PERIOD and sleeps for the
+# rest: the cpu generator runs one process per logical core, the memory
+# generator copies blocks larger than the caches and the disk generator
+# writes and fsyncs a file on the volume of the output directory. The load
+# they actually produced is measured and reported with the catch rate of the
+# test, and the lowest level with dropped frames is the threshold of the host.
+#
+# The generators are spawned, not forked, as the acquisition threads of the
+# camera may be running (and hold locks) when they start.
+#
+################################################################################
+
+STRESS_KINDS = ['cpu', 'memory', 'disk']
+STRESS_LEVELS = '0,25,50,75,100'
+STRESS_REPORT = 'stress_report.json'
+DUTY_PERIOD = 0.02
+MEMORY_WORKERS = 2
+MEMORY_ARRAY_BYTES = 64 * 1024 * 1024
+MEMORY_BLOCK_BYTES = 8 * 1024 * 1024
+DISK_CHUNK_BYTES = 1024 * 1024
+DISK_FILE_BYTES = 64 * 1024 * 1024
+START_TIMEOUT = 30.0
+
+
+def get_num_cpus():
+    # the cores this process may run on, as limited by affinity or cgroup cpusets
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def parse_stress_levels(levels):
+    return sorted(float(level) for level in levels.split(','))
+
+
+def get_stress_level(levels, ith_test, num_tests):
+    # tests are spread over the levels in increasing order
+    return levels[min(ith_test * len(levels) // max(num_tests, 1), len(levels) - 1)]
+
+
+def get_skipped_levels(levels, num_tests):
+    # levels no test runs at when there are fewer tests than levels
+    run = set(get_stress_level(levels, i, num_tests) for i in range(num_tests))
+    return [level for level in levels if level not in run]
+
+
+def get_work(kind, directory):
+    # returns work(): does a small unit of work and returns its amount, and a cleanup function
+    if kind == 'cpu':
+        def work():
+            x = 0
+            for k in range(1000):
+                x += k * k
+            return 0
+        return work, lambda: None
+
+    if kind == 'memory':
+        src = np.ones(MEMORY_ARRAY_BYTES, dtype=np.uint8)
+        dst = np.empty_like(src)
+        offsets = iter(())
+
+        def work():
+            nonlocal offsets
+            offset = next(offsets, None)
+            if offset is None:
+                offsets = iter(range(0, MEMORY_ARRAY_BYTES, MEMORY_BLOCK_BYTES))
+                offset = next(offsets)
+            np.copyto(dst[offset:offset + MEMORY_BLOCK_BYTES], src[offset:offset + MEMORY_BLOCK_BYTES])
+            # read and written
+            return 2 * MEMORY_BLOCK_BYTES
+        return work, lambda: None
+
+    if kind == 'disk':
+        path = os.path.join(directory, 'stress-disk-{}.tmp'.format(os.getpid()))
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0))
+        chunk = np.random.default_rng(0).integers(0, 256, DISK_CHUNK_BYTES, dtype=np.uint8).tobytes()
+        written = 0
+
+        def work():
+            nonlocal written
+            os.write(fd, chunk)
+            written += len(chunk)
+            if written >= DISK_FILE_BYTES:
+                # the data has to reach the disk, then the file is overwritten from the start
+                os.fsync(fd)
+                os.lseek(fd, 0, os.SEEK_SET)
+                written = 0
+            return len(chunk)
+
+        def cleanup():
+            os.close(fd)
+            os.remove(path)
+        return work, cleanup
+
+    raise Exception('Unknown stress kind {}'.format(kind))
+
+
+def run_generator(kind, level, directory, stop, ready, result):
+    # result: [CPU seconds used, amount of work, seconds elapsed]
+    work, cleanup = get_work(kind, directory)
+    ready.release()
+    amount = 0
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        while not stop.is_set():
+            period_start = time.perf_counter()
+            busy_until = period_start + DUTY_PERIOD * level / 100.0
+            while level > 0:
+                amount += work()
+                if time.perf_counter() >= busy_until:
+                    break
+            rest = period_start + DUTY_PERIOD - time.perf_counter()
+            if rest > 0:
+                stop.wait(rest)
+    finally:
+        cleanup()
+        result[0] = time.process_time() - cpu_start
+        result[1] = amount
+        result[2] = time.perf_counter() - start
+
+
+class ContentionInjector:
+    def __init__(self, kinds, level, directory):
+        self.kinds_ = kinds
+        self.level_ = level
+        self.directory_ = directory
+        self.context_ = multiprocessing.get_context('spawn')
+        self.stop_ = self.context_.Event()
+        self.ready_ = self.context_.Semaphore(0)
+        self.workers_ = []
+
+    def start(self):
+        # returns when every generator is set up and working
+        if self.level_ <= 0:
+            return
+        for kind in self.kinds_:
+            num_workers = {'cpu': get_num_cpus(), 'memory': MEMORY_WORKERS, 'disk': 1}[kind]
+            for i in range(num_workers):
+                result = self.context_.Array('d', 3)
+                worker = self.context_.Process(target=run_generator, daemon=True,
+                                               args=(kind, self.level_, self.directory_, self.stop_, self.ready_, result))
+                worker.start()
+                self.workers_.append((kind, worker, result))
+        for kind, worker, result in self.workers_:
+            if not self.ready_.acquire(timeout=START_TIMEOUT):
+                self.stop()
+                raise Exception('Contention generators did not start in {} s'.format(START_TIMEOUT))
+
+    def stop(self):
+        # returns the load that was produced: cpu in % of all cores, memory and disk in MB/s
+        self.stop_.set()
+        load = {}
+        for kind, worker, result in self.workers_:
+            worker.join()
+            cpu, amount, elapsed = result[:]
+            if elapsed <= 0:
+                continue
+            if kind == 'cpu':
+                load['cpu_pct'] = load.get('cpu_pct', 0.0) + cpu / elapsed * 100.0 / get_num_cpus()
+            else:
+                load[kind + '_mb_per_s'] = load.get(kind + '_mb_per_s', 0.0) + amount / elapsed / 1e6
+        return load
+
+
+################################################################################
+# report
+################################################################################
+def get_catch_rate(run_dir):
+    # lowest catch rate of the cameras of a test, from the frame logs or the soak summaries
+    rates = []
+    for run, camera, log_file in summary.list_runs(run_dir):
+        if run != '.':
+            continue
+        num_caught, drop_start, drop_length, _ = summary.load_run(log_file)
+        rates.append(summary.get_run_stats(num_caught, drop_start, drop_length)['catch_rate'])
+    if not rates:
+        for f in sorted(os.listdir(run_dir)):
+            if f.endswith(SOAK_SUMMARY_SUFFIX):
+                with open(os.path.join(run_dir, f)) as ifs:
+                    rate = json.loads(ifs.read()).get('catch_rate')
+                if rate is not None:
+                    rates.append(rate)
+    return min(rates) if rates else None
+
+
+def get_stress_report(output_directory, kinds, stress_levels, steps):
+    # steps: [{'test', 'level', 'load'}] in the order of the tests
+    for step in steps:
+        step['catch_rate'] = get_catch_rate(os.path.join(output_directory, str(step['test'])))
+    levels = {}
+    for step in steps:
+        if step['catch_rate'] is not None:
+            levels.setdefault(step['level'], []).append(step['catch_rate'])
+    per_level = [{'level': level, 'num_tests': len(rates), 'catch_rate_min': min(rates),
+                  'catch_rate_mean': float(np.mean(rates))} for level, rates in sorted(levels.items())]
+    threshold = next((l['level'] for l in per_level if l['catch_rate_min'] < 100.0), None)
+    return {'kinds': kinds, 'steps': steps, 'levels': per_level, 'drop_threshold_level': threshold,
+            'skipped_levels': get_skipped_levels(stress_levels, len(steps))}
+
+
+def write_stress_report(output_directory, report):
+    report_path = os.path.join(output_directory, STRESS_REPORT)
+    with open(report_path, mode='w') as ofs:
+        ofs.write(json.dumps(report, indent=4))
+    return report_path
+
+
+def print_stress_report(report):
+    print('stress: {}'.format(', '.join(report['kinds'])))
+    for level in report['levels']:
+        loads = {}
+        for step in report['steps']:
+            if step['level'] == level['level']:
+                for key, value in step['load'].items():
+                    loads.setdefault(key, []).append(value)
+        load = ', '.join('{} {:.1f}'.format(key, np.mean(values)) for key, values in loads.items())
+        print('  level {:>5.1f}%         : catch rate min {:.4f}% mean {:.4f}% ({} tests){}'.format(
+            level['level'], level['catch_rate_min'], level['catch_rate_mean'], level['num_tests'],
+            ' [' + load + ']' if load else ''))
+    if report['skipped_levels']:
+        print('  not run              : level {}% (fewer tests than levels)'.format(
+            '%, '.join(str(level) for level in report['skipped_levels'])))
+    if report['drop_threshold_level'] is None:
+        print('  no frame was dropped up to level {}%'.format(report['levels'][-1]['level'] if report['levels'] else 0))
+    else:
+        print('  frames are dropped from level {}%'.format(report['drop_threshold_level']))
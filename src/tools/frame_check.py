@@ -2,11 +2,11 @@ import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# NumPy, the bin scanners and the result tooling are imported by the functions
+# that use them, so that --help and argument errors return without loading them
 from tools.load_config import *
-import struct
-from gendc_python.gendc_separator import descriptor as gendc
-from PIL import Image  
-import numpy as np
+from tools.frame_log import *
+from tools.load_bin import *
 GDC_INTENSITY   = 0x0000000000000001
 
 # to check the framecount
@@ -16,32 +16,73 @@ CONFIG_SUFFIX = 'config.json'
 
 
 
-def write_log(w, h, prefix, framecount, output_directory):
-    logfile_path = os.path.join(output_directory, prefix + 'frame_log.txt')
-    print('log written in {}'.format(logfile_path))
-    with open(logfile_path, mode='w') as ofs:
-        ofs.write('{}x{}\n'.format(w, h))
-        offset_frame_count = 0
-        expected_frame_count = 0
-        frame_drip = False
-
-        for i, fc in enumerate(framecount):
-            if i == 0:
-                if ctypes.c_long(fc & 0xFFFFFFFF).value  == -1:
-                    raise Exception("This U3V Camera does not support Frame count.")
-                offset_frame_count = fc
-                expected_frame_count = offset_frame_count
-                ofs.write('offset_frame_count: {}\n'.format(expected_frame_count))
-
-            frame_drop = fc != expected_frame_count
+def write_log(w, h, prefix, framecount, output_directory, log_format='text'):
+    if len(framecount) > 0 and ctypes.c_long(int(framecount[0]) & 0xFFFFFFFF).value == -1:
+        raise Exception("This U3V Camera does not support Frame count.")
+
+    if log_format in ['npz', 'both']:
+        logfile_path = os.path.join(output_directory, prefix + FRAME_LOG_NPZ_SUFFIX)
+        print('log written in {}'.format(logfile_path))
+        write_npz_log(logfile_path, w, h, framecount)
+    if log_format in ['text', 'both']:
+        logfile_path = os.path.join(output_directory, prefix + FRAME_LOG_SUFFIX)
+        print('log written in {}'.format(logfile_path))
+        write_text_log(logfile_path, w, h, framecount)
+
+################################################################################
+#
+# black pixels
+#
+# images are decoded by a thread pool in batches; at most PREFETCH_BATCHES
+# batches per thread are in flight so that memory stays bounded
+#
+################################################################################
+
+BLACKPIXEL_BATCH_SIZE = 64
+PREFETCH_BATCHES = 2
+
+
+def get_black_ratio_of_images(img_file_names):
+    import numpy as np
+    from PIL import Image
+    black_ratio = np.empty(len(img_file_names), dtype=np.float64)
+    for i, img_file_name in enumerate(img_file_names):
+        with Image.open(img_file_name) as img:
+            numpydata = np.asarray(img)
+        black_ratio[i] = np.count_nonzero(numpydata == 0) * 100.00 / numpydata.size
+    return black_ratio
+
+
+def get_black_ratios(img_file_names, num_threads=None):
+    # percentage of black pixels of each image, in the order of img_file_names
+    import numpy as np
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+    batches = [img_file_names[i:i + BLACKPIXEL_BATCH_SIZE] for i in range(0, len(img_file_names), BLACKPIXEL_BATCH_SIZE)]
+    if len(batches) <= 1:
+        return get_black_ratio_of_images(img_file_names)
+
+    num_threads = num_threads or os.cpu_count() or 1
+    ratios = []
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pending = deque()
+        for batch in batches:
+            if len(pending) >= num_threads * PREFETCH_BATCHES:
+                ratios.append(pending.popleft().result())
+            pending.append(executor.submit(get_black_ratio_of_images, batch))
+        while pending:
+            ratios.append(pending.popleft().result())
+    return np.concatenate(ratios)
+
+
+def count_dark_frames(black_ratio):
+    import numpy as np
+    black_ratio = np.asarray(black_ratio)
+    return {'25': int(np.count_nonzero(black_ratio >= 25.0)),
+            '50': int(np.count_nonzero(black_ratio >= 50.0)),
+            '75': int(np.count_nonzero(black_ratio >= 75.0)),
+            '100': int(np.count_nonzero(black_ratio > 99.9))}
 
-            if frame_drop:
-                while expected_frame_count < fc:
-                    ofs.write('{} : x\n'.format(expected_frame_count))
-                    expected_frame_count += 1
-            frame_drop = False
-            ofs.write('{} : {}\n'.format(expected_frame_count, fc))
-            expected_frame_count += 1
 
 class FrameCheck:
 
@@ -49,100 +90,106 @@ class FrameCheck:
         self.dir_path_ = dir_path
         self.items_ = items
         self.display_result_ = display_result
+        # (framecount, timestamp) of the last GenDC prefix checked with timestamps
+        self.timestamps_ = None
+        self.timestamp_stats_ = None
 
-    def frame_check_non_bin(self, ext, blackpixel=False):
+    def frame_check_non_bin(self, ext, blackpixel=False, num_threads=None):
+        import numpy as np
         if self.display_result_:
             print('{}({})'.format(self.dir_path_, ext))
         ext_items = sorted(self.items_)
         # print(categorized_items[ext])
-        expected_idx = ext_items[0]
-        num_dropped_frame = 0
-        num_catch = 0
-        num_dark = {'25':0, '50':0, '75':0, '100':0}
-        for saved_idx in ext_items:
-            while expected_idx != saved_idx:
-                # print('expected: {}, actual: {}'.format(expected_idx, saved_idx))
-                expected_idx += 1
-                num_dropped_frame += 1
-            expected_idx += 1
-            num_catch += 1
-
-            img_file_name = os.path.join(self.dir_path_, str(saved_idx) + '.' + ext)
+        # every step of the sorted indices must be +1; a gap of k means k-1 dropped frames
+        items = np.array(ext_items, dtype=np.int64)
+        num_dropped_frame = int(np.sum(np.diff(items) - 1))
+        expected_idx = ext_items[-1] + 1
+        num_catch = len(ext_items)
+
+        img_file_names = [os.path.join(self.dir_path_, str(saved_idx) + '.' + ext) for saved_idx in ext_items]
+        for img_file_name in img_file_names:
             if not os.path.isfile(img_file_name):
                 raise Exception('Image {} does not exist'.format(img_file_name))
-            if blackpixel:
-                numpydata = np.array(Image.open(img_file_name)  )  
-                img_size = numpydata.size
-                num_black = np.sum(numpydata == 0)
-                black_ratio =  num_black * 100.00 / img_size
-                if black_ratio >= 25.0:
-                    num_dark['25'] += 1
-                if black_ratio >= 50.0:
-                    num_dark['50'] += 1
-                if black_ratio >= 75.0:
-                    num_dark['75'] += 1
-                if black_ratio > 99.9:
-                    num_dark['100'] += 1
+
+        num_dark = {'25':0, '50':0, '75':0, '100':0}
+        if blackpixel:
+            num_dark = count_dark_frames(get_black_ratios(img_file_names, num_threads))
 
         if self.display_result_:
             self.print_stats(ext_items[0], expected_idx-1, num_catch, num_dropped_frame, num_dark, blackpixel)
         return ext_items
 
-    def frame_check_bin_prefix(self, config_file_path, blackpixel=False):
-        if self.display_result_:
-            print('{}/{}({})'.format(self.dir_path_, get_prefix(config_file_path), 'bin'))
+    def scan_bin_prefix(self, config_file_path, cross_check=False, use_index=True, executor=None, timestamps=False):
+        # framecounts of each bin file in order; futures if an executor is given.
+        # with timestamps, (framecount, timestamp) of each bin file
+        from tools.frame_index import get_framecount, get_framecount_and_timestamp
         w, h, d, c = get_config_info(config_file_path)
         framesize = w * h * d * c
-        expected_idx = 0
-        offset_idx = 0
-        num_dropped_frame = 0
-        num_catch = 0
-
-        ret = []
-
-        for bin_idx, bf in enumerate(self.items_):
+        scan = get_framecount_and_timestamp if timestamps else get_framecount
+        framecounts = []
+        for bf in self.items_:
             bin_file = os.path.join(self.dir_path_, bf)
-
-            with open(bin_file, mode='rb') as ifs:
-                filecontent = ifs.read()   
-                cursor = 0
-                first_frame = True
-
-                while cursor < len(filecontent):
-                    try:
-                        # TODO return NULL for non-gendc format
-                        gendc_container = gendc.Container(filecontent[cursor:])
-                        image_component_idx = gendc_container.get_1st_component_idx_by_typeid(GDC_INTENSITY)
-                        image_component = gendc_container.get_component_by_index(image_component_idx)
-                        part = image_component.get_part_by_index(0)
-                        typespecific3 = part.get_typespecific_by_index(2)
-                        saved_idx = int.from_bytes(typespecific3.to_bytes(8, 'little')[0:4], "little")
-                        cursor = cursor + gendc_container.get_container_size()
-                        ret.append(saved_idx)
-
-                    except:
-                        saved_idx = struct.unpack('I', filecontent[cursor:cursor+4])[0]
-                        cursor = cursor + 4 + framesize
-                        ret.append(saved_idx)
-
-                    if first_frame and bin_idx == 0:
-                        expected_idx = saved_idx
-                        offset_idx = saved_idx
-                        first_frame = False
-
-                    while expected_idx < saved_idx:
-                        expected_idx += 1
-                        num_dropped_frame += 1
-
-                    while expected_idx > saved_idx:
-                        print('Invalid framecount is detected. cancel this run')
-                        return ret
-
-                    expected_idx += 1
-                    num_catch += 1
+            if executor:
+                framecounts.append(executor.submit(scan, bin_file, framesize, cross_check, use_index))
+            else:
+                framecounts.append(scan(bin_file, framesize, cross_check, use_index))
+        return framecounts
+
+    def frame_check_bin_prefix(self, config_file_path, blackpixel=False, cross_check=False, use_index=True, framecounts=None, subsample=1, timestamps=False):
+        import numpy as np
+        from concurrent.futures import Future
+        from tools.frame_stats import get_pixel_max_value, get_frame_stats_of_bin, merge_frame_stats, print_frame_stats
+        from tools.frame_timing import get_timestamp_stats, print_timestamp_stats
+        if self.display_result_:
+            print('{}/{}({})'.format(self.dir_path_, get_prefix(config_file_path), 'bin'))
+        if framecounts is None:
+            framecounts = self.scan_bin_prefix(config_file_path, cross_check, use_index, timestamps=timestamps)
+        # files scanned by a pool are merged in the order of the bin files,
+        # so the continuity check below runs across file boundaries as usual
+        framecounts = [f.result() if isinstance(f, Future) else f for f in framecounts]
+        timestamp = None
+        if timestamps:
+            framecounts, file_timestamps = [f for f, t in framecounts], [t for f, t in framecounts]
+            # the binarysaver layout has no timestamps
+            if file_timestamps and all(t is not None for t in file_timestamps):
+                timestamp = np.concatenate(file_timestamps)
+        framecount = np.concatenate(framecounts) if framecounts else np.zeros(0, dtype=np.uint32)
+        ret = framecount.tolist()
+
+        if len(framecount) == 0:
+            offset_idx = 0
+            expected_idx = 0
+            num_dropped_frame = 0
+        else:
+            # every step of the framecount must be +1; a gap of k means k-1 dropped frames
+            steps = np.diff(framecount.astype(np.int64))
+            invalid = np.flatnonzero(steps < 1)
+            if len(invalid) > 0:
+                print('Invalid framecount is detected. cancel this run')
+                return ret[:invalid[0] + 2]
+            offset_idx = ret[0]
+            expected_idx = ret[-1] + 1
+            num_dropped_frame = int(np.sum(steps - 1))
+        num_catch = len(ret)
+
+        num_dark = None
+        if blackpixel:
+            w, h, d, c = get_config_info(config_file_path)
+            max_value = get_pixel_max_value(config_file_path, d)
+            frame_stats = merge_frame_stats([get_frame_stats_of_bin(os.path.join(self.dir_path_, bf), w, h, d, c, max_value, subsample, use_index)
+                                             for bf in self.items_])
+            num_dark = count_dark_frames(frame_stats['black_ratio'])
+
+        if timestamp is not None:
+            self.timestamps_ = (framecount, timestamp)
+            self.timestamp_stats_ = get_timestamp_stats(framecount, timestamp)
 
         if self.display_result_:
-            self.print_stats(offset_idx, expected_idx-1, num_catch, num_dropped_frame, None, blackpixel)
+            self.print_stats(offset_idx, expected_idx-1, num_catch, num_dropped_frame, num_dark, blackpixel)
+            if blackpixel:
+                print_frame_stats(frame_stats, max_value, subsample)
+            if self.timestamp_stats_:
+                print_timestamp_stats(self.timestamp_stats_)
         return ret
 
     def print_stats(self, min_idx, max_idx, num_catch, num_dropped_frame, num_dark, blackpixel):
@@ -160,7 +207,25 @@ class FrameCheck:
             
    
                     
-from tools.load_bin import *
+def write_timestamp_logs(output_directory, frame_checks, display_result=True):
+    # frame_checks: {prefix: FrameCheck} of one directory. the timestamps of
+    # every prefix are compared with those of the first one (camera-0)
+    from tools.frame_timing import get_timestamp_skew, write_timestamp_log, print_timestamp_skew, \
+        TIMESTAMP_LOG_SUFFIX, TIMESTAMP_SKEW_LOG
+    prefixes = sorted(p for p in frame_checks if frame_checks[p].timestamps_ is not None)
+    for prefix in prefixes:
+        write_timestamp_log(os.path.join(output_directory, prefix + TIMESTAMP_LOG_SUFFIX), frame_checks[prefix].timestamp_stats_)
+    if len(prefixes) < 2:
+        return
+    skew = {}
+    framecount0, timestamp0 = frame_checks[prefixes[0]].timestamps_
+    for prefix in prefixes[1:]:
+        framecount1, timestamp1 = frame_checks[prefix].timestamps_
+        skew[prefixes[0] + prefix] = get_timestamp_skew(framecount0, timestamp0, framecount1, timestamp1)
+        if display_result:
+            print_timestamp_skew(prefixes[0], prefix, skew[prefixes[0] + prefix])
+    write_timestamp_log(os.path.join(output_directory, TIMESTAMP_SKEW_LOG), skew)
+
 
 def main():
 
@@ -173,11 +238,42 @@ def main():
                         help='Prefix of config file e.g. <prefix>-config.json')
     parser.add_argument('-f', '--format', type=str, default=None, \
                         help='File format')
+    parser.add_argument('-cc', '--cross-check', action='store_true', \
+                        help='Validate every GenDC container with gendc_python')
+    parser.add_argument('-ni', '--no-index', action='store_true', \
+                        help='Do not read or write frame index files (<bin>.idx)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, \
+                        help='The number of processes to scan bin files with (threads to decode images with)')
+    parser.add_argument('-lf', '--log-format', type=str, default='text', choices=LOG_FORMATS, \
+                        help='Format of frame logs')
+    parser.add_argument('-ss', '--subsample', type=int, default=1, \
+                        help='Analyse every N-th frame of bin files with --blackpixel')
+    parser.add_argument('-s', '--summary', action='store_true', \
+                        help='Write summary.json/summary.csv over all frame logs under the directory')
+    parser.add_argument('--fps', type=float, default=None, \
+                        help='Nominal frame rate of the camera used for the time-based statistics of the summary')
+    parser.add_argument('--results-db', type=str, default=None, \
+                        help='Ingest the frame logs under the directory into this SQLite file (see tools/results_db.py)')
+    parser.add_argument('-ts', '--timestamps', action='store_true', \
+                        help='Report frame intervals from GenDC timestamps and the skew between cameras')
 
     directory_name = parser.parse_args().directory
     blackpixel = parser.parse_args().blackpixel
     prefix = parser.parse_args().prefix
     fileformat = parser.parse_args().format
+    cross_check = parser.parse_args().cross_check
+    use_index = not parser.parse_args().no_index
+    num_jobs = parser.parse_args().jobs
+    log_format = parser.parse_args().log_format
+    write_summary = parser.parse_args().summary
+    fps = parser.parse_args().fps
+    subsample = parser.parse_args().subsample
+    timestamps = parser.parse_args().timestamps
+    results_db_path = parser.parse_args().results_db
+
+    from concurrent.futures import ProcessPoolExecutor
+    import tools.summary as summary
+    import tools.results_db as results_db
 
     dir_list = get_bin_directories(directory_name, [], prefix, fileformat)
 
@@ -185,7 +281,8 @@ def main():
         print('The directory containing bin files that matches the following conditions was not found.')
         print('prefix: {}'.format(prefix))
         print('format: {}'.format(fileformat))
-    
+
+    checks = []
     for camera_dir in dir_list:
 
         pti = PerformanceTestItems(camera_dir, prefix)
@@ -195,16 +292,45 @@ def main():
             filtered_items_list, configs = pti.check_frame_catch_rate_of_ext(ext)
 
             for i, filtered_items in enumerate(filtered_items_list):
-
-                fc = FrameCheck(camera_dir, filtered_items)
-                if ext == 'bin':
-                    w, h, d, c = get_config_info(os.path.join(camera_dir, configs[i]))
-                    
-                    framecount = fc.frame_check_bin_prefix(os.path.join(camera_dir, configs[i]), blackpixel)
-                    w, h, d, c = get_config_info(os.path.join(camera_dir, configs[i]))
-                    write_log(w, h, get_prefix(configs[i]), framecount, camera_dir)
-                else:
-                    _ = fc.frame_check_non_bin(ext, blackpixel)
+                checks.append((camera_dir, ext, filtered_items, configs[i] if ext == 'bin' else None))
+
+    # with --jobs, all bin files are submitted to the pool first; results are
+    # then consumed (and printed) in the same order as the serial path
+    executor = ProcessPoolExecutor(max_workers=num_jobs) if num_jobs > 1 else None
+    scanned = []
+    for camera_dir, ext, filtered_items, config in checks:
+        if ext == 'bin' and executor:
+            fc = FrameCheck(camera_dir, filtered_items)
+            scanned.append(fc.scan_bin_prefix(os.path.join(camera_dir, config), cross_check, use_index, executor, timestamps))
+        else:
+            scanned.append(None)
+
+    timestamp_checks = {}
+    for (camera_dir, ext, filtered_items, config), framecounts in zip(checks, scanned):
+
+        fc = FrameCheck(camera_dir, filtered_items)
+        if ext == 'bin':
+            framecount = fc.frame_check_bin_prefix(os.path.join(camera_dir, config), blackpixel, cross_check, use_index, framecounts, subsample, timestamps)
+            w, h, d, c = get_config_info(os.path.join(camera_dir, config))
+            write_log(w, h, get_prefix(config), framecount, camera_dir, log_format)
+            if timestamps:
+                timestamp_checks.setdefault(camera_dir, {})[get_prefix(config)] = fc
+        else:
+            _ = fc.frame_check_non_bin(ext, blackpixel, num_jobs if num_jobs > 1 else None)
+
+    for camera_dir in timestamp_checks:
+        write_timestamp_logs(camera_dir, timestamp_checks[camera_dir])
+
+    if executor:
+        executor.shutdown()
+
+    if write_summary:
+        s, rows = summary.summarize(directory_name, fps, num_jobs)
+        summary.print_summary(s)
+        summary.write_summary(directory_name, s, rows)
+
+    if results_db_path:
+        results_db.ingest(results_db_path, [directory_name], num_jobs)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,111 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import struct
+import numpy as np
+
+from tools.bin_scan import *
+
+################################################################################
+#
+# Frame index sidecar <bin file>.idx
+#
+# header: magic, version, kind (0: raw, 1: GenDC), bin file size, bin file
+#         mtime in ns, framesize, number of frames
+# body  : offset (uint64) and framecount (uint32) of every frame, followed by
+#         container size (uint64) and timestamp (uint64) for GenDC
+#
+# The index is valid while the size and the mtime of the bin file (and the
+# framesize from its config) match the header; otherwise it is rebuilt.
+#
+################################################################################
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'U3VFIDX\0'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<8sIIQqQQ')
+
+INDEX_KIND_RAW = 0
+INDEX_KIND_GENDC = 1
+
+
+def get_index_path(bin_file):
+    return bin_file + INDEX_SUFFIX
+
+
+def write_index_file(index_file, frame_index, file_size, mtime_ns, framesize):
+    kind = INDEX_KIND_GENDC if 'timestamp' in frame_index else INDEX_KIND_RAW
+    num_frames = len(frame_index['framecount'])
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, mode='wb') as ofs:
+        ofs.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, kind, file_size, mtime_ns, framesize, num_frames))
+        ofs.write(frame_index['offset'].astype('<u8').tobytes())
+        ofs.write(frame_index['framecount'].astype('<u4').tobytes())
+        if kind == INDEX_KIND_GENDC:
+            ofs.write(frame_index['container_size'].astype('<u8').tobytes())
+            ofs.write(frame_index['timestamp'].astype('<u8').tobytes())
+    os.replace(tmp_file, index_file)
+
+
+def read_index_file(index_file, file_size, mtime_ns, framesize):
+    # return None if the index does not exist or is out of date
+    if not os.path.isfile(index_file):
+        return None
+    with open(index_file, mode='rb') as ifs:
+        content = ifs.read()
+    if len(content) < INDEX_HEADER.size:
+        return None
+    magic, version, kind, saved_size, saved_mtime_ns, saved_framesize, num_frames = INDEX_HEADER.unpack_from(content, 0)
+    if magic != INDEX_MAGIC or version != INDEX_VERSION:
+        return None
+    if saved_size != file_size or saved_mtime_ns != mtime_ns:
+        return None
+    # the frame size only matters to the raw layout
+    if kind == INDEX_KIND_RAW and saved_framesize != framesize:
+        return None
+
+    fields = [('offset', '<u8'), ('framecount', '<u4')]
+    if kind == INDEX_KIND_GENDC:
+        fields += [('container_size', '<u8'), ('timestamp', '<u8')]
+    if len(content) != INDEX_HEADER.size + sum(np.dtype(t).itemsize for _, t in fields) * num_frames:
+        return None
+
+    frame_index = {}
+    cursor = INDEX_HEADER.size
+    for key, dtype in fields:
+        frame_index[key] = np.frombuffer(content, dtype=dtype, count=num_frames, offset=cursor)
+        cursor += np.dtype(dtype).itemsize * num_frames
+    return frame_index
+
+
+def get_frame_index(bin_file, framesize, cross_check=False, use_index=True):
+    # return the frame index of bin_file, from its sidecar if it is up to date
+    stat = os.stat(bin_file)
+    index_file = get_index_path(bin_file)
+    # cross_check asks for a full scan of the bin file
+    if use_index and not cross_check:
+        frame_index = read_index_file(index_file, stat.st_size, stat.st_mtime_ns, framesize)
+        if frame_index is not None:
+            return frame_index
+
+    with map_bin_file(bin_file) as filecontent:
+        frame_index = scan_frame_index(filecontent, framesize, cross_check)
+
+    if use_index:
+        try:
+            write_index_file(index_file, frame_index, stat.st_size, stat.st_mtime_ns, framesize)
+        except OSError as e:
+            print('Failed to write frame index {} ({})'.format(index_file, e))
+    return frame_index
+
+
+def get_framecount(bin_file, framesize, cross_check=False, use_index=True):
+    # framecounts of one bin file; module-level so that it can run in a process pool
+    return get_frame_index(bin_file, framesize, cross_check, use_index)['framecount']
+
+
+def get_framecount_and_timestamp(bin_file, framesize, cross_check=False, use_index=True):
+    # framecounts and GenDC timestamps (None for the binarysaver layout) of one bin file
+    frame_index = get_frame_index(bin_file, framesize, cross_check, use_index)
+    return frame_index['framecount'], frame_index.get('timestamp')
@@ -0,0 +1,140 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import re
+
+################################################################################
+#
+# Frame log
+#
+# text: <prefix>frame_log.txt, one line per frame ("N : N" or "N : x")
+# npz : <prefix>frame_log.npz, the offset, the received framecounts and the
+#       dropped frames as run-length encoded intervals (drop_start, drop_length)
+#
+# NumPy is imported by the functions that use it: frame_check.py reads the
+# constants below before parsing its arguments and starts without NumPy.
+#
+################################################################################
+
+FRAME_LOG_SUFFIX = 'frame_log.txt'
+FRAME_LOG_NPZ_SUFFIX = 'frame_log.npz'
+LOG_FORMATS = ['text', 'npz', 'both']
+
+DROP_LINE = re.compile(rb'^(\d+) : x\r?$', re.M)
+OFFSET_LINE = re.compile(rb'^offset_frame_count: (-?\d+)\r?$', re.M)
+
+
+def get_drop_ranges(framecount):
+    # return the first dropped framecount and the number of dropped frames of each gap
+    import numpy as np
+    framecount = np.asarray(framecount, dtype=np.int64)
+    steps = np.diff(framecount)
+    gaps = np.flatnonzero(steps > 1)
+    return framecount[gaps] + 1, steps[gaps] - 1
+
+
+def write_text_log(logfile_path, w, h, framecount):
+    with open(logfile_path, mode='w') as ofs:
+        ofs.write('{}x{}\n'.format(w, h))
+        expected_frame_count = 0
+
+        for i, fc in enumerate(framecount):
+            if i == 0:
+                expected_frame_count = fc
+                ofs.write('offset_frame_count: {}\n'.format(expected_frame_count))
+
+            while expected_frame_count < fc:
+                ofs.write('{} : x\n'.format(expected_frame_count))
+                expected_frame_count += 1
+            ofs.write('{} : {}\n'.format(expected_frame_count, fc))
+            expected_frame_count += 1
+
+
+def write_npz_log(logfile_path, w, h, framecount):
+    import numpy as np
+    framecount = np.asarray(framecount, dtype=np.uint32)
+    drop_start, drop_length = get_drop_ranges(framecount)
+    np.savez_compressed(logfile_path,
+                        width=w, height=h,
+                        offset=framecount[0] if len(framecount) > 0 else 0,
+                        framecount=framecount,
+                        drop_start=drop_start, drop_length=drop_length)
+
+
+def load_npz_log(logfile_path):
+    import numpy as np
+    with np.load(logfile_path) as log:
+        return {key: log[key] for key in log.files}
+
+
+def load_drop_ranges(logfile_path):
+    # return (offset, number of caught frames, drop_start, drop_length) of a text
+    # or npz log; text logs are matched for dropped lines only, not parsed per line
+    import numpy as np
+    if logfile_path.endswith(FRAME_LOG_NPZ_SUFFIX):
+        log = load_npz_log(logfile_path)
+        return int(log['offset']), len(log['framecount']), \
+            log['drop_start'].astype(np.int64), log['drop_length'].astype(np.int64)
+
+    with open(logfile_path, mode='rb') as f:
+        content = f.read()
+    offset_line = OFFSET_LINE.search(content)
+    offset = int(offset_line.group(1)) if offset_line else 0
+    dropped = np.array([int(m.group(1)) for m in DROP_LINE.finditer(content)], dtype=np.int64)
+    num_caught = content.count(b' : ') - len(dropped)
+
+    if len(dropped) == 0:
+        return offset, num_caught, dropped, np.zeros(0, dtype=np.int64)
+    # consecutive dropped frames into intervals
+    first = np.concatenate([[0], np.flatnonzero(np.diff(dropped) != 1) + 1])
+    drop_length = np.diff(np.concatenate([first, [len(dropped)]]))
+    return offset, num_caught, dropped[first], drop_length
+
+
+def count_drops_per_bucket(drop_start, drop_length, bucket_edges):
+    # number of dropped frames in [bucket_edges[k], bucket_edges[k+1]) computed
+    # from the intervals with prefix sums, without expanding them into frames
+    import numpy as np
+    drop_start = np.asarray(drop_start, dtype=np.int64)
+    drop_end = drop_start + np.asarray(drop_length, dtype=np.int64)
+    bucket_edges = np.asarray(bucket_edges, dtype=np.int64)
+    start_cumsum = np.concatenate([[0], np.cumsum(drop_start)])
+    end_cumsum = np.concatenate([[0], np.cumsum(drop_end)])
+
+    # dropped frames before x = sum(x - start; start < x) - sum(x - end; end < x)
+    num_started = np.searchsorted(drop_start, bucket_edges, side='left')
+    num_ended = np.searchsorted(drop_end, bucket_edges, side='left')
+    dropped_before = (num_started * bucket_edges - start_cumsum[num_started]) \
+        - (num_ended * bucket_edges - end_cumsum[num_ended])
+    return np.diff(dropped_before)
+
+
+def find_frame_log(directory, prefix):
+    # npz log if it exists, otherwise text log; None if there is no log
+    for suffix in [FRAME_LOG_NPZ_SUFFIX, FRAME_LOG_SUFFIX]:
+        logfile_path = os.path.join(directory, prefix + suffix)
+        if os.path.isfile(logfile_path):
+            return logfile_path
+    return None
+
+
+def export_text_log(npz_path, text_path=None):
+    if text_path is None:
+        text_path = npz_path[:-len(FRAME_LOG_NPZ_SUFFIX)] + FRAME_LOG_SUFFIX
+    log = load_npz_log(npz_path)
+    write_text_log(text_path, int(log['width']), int(log['height']), log['framecount'].tolist())
+    print('log exported in {}'.format(text_path))
+    return text_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export npz frame logs as text frame logs")
+    parser.add_argument('logs', type=str, nargs='+', \
+                        help='<prefix>frame_log.npz files')
+    for npz_path in parser.parse_args().logs:
+        export_text_log(npz_path)
+
+if __name__ == "__main__":
+    main()
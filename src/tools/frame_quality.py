@@ -0,0 +1,167 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import threading
+import numpy as np
+
+from tools.frame_check import count_dark_frames
+
+################################################################################
+#
+# Frame quality of realtime-evaluation mode
+#
+# The output buffers of the pipeline are overwritten by every builder.run().
+# After a run, the frame of each device is copied into a free slot of a ring
+# of NUM_SLOTS preallocated frames, and a worker thread reduces the slot into
+# the mean, the ratio of black (0) pixels and the ratio of saturated pixels,
+# written into arrays allocated for the whole test: nothing is allocated per
+# frame. When the ring is full the worker is behind the camera, the frame is
+# skipped and only every 2x-th frame is offered from then on; the step is
+# halved again once the worker has been idle for RECOVER_AFTER frames.
+#
+################################################################################
+
+FRAME_QUALITY_FILE = 'frame_quality.npz'
+FRAME_QUALITY_LOG_SUFFIX = 'frame_quality.json'
+NUM_SLOTS = 2
+MAX_STEP = 64
+RECOVER_AFTER = 16
+
+
+class FrameQualityMonitor:
+    def __init__(self, output_datas, fcdatas, max_value, capacity, num_slots=NUM_SLOTS):
+        self.output_datas_ = output_datas
+        self.fcdatas_ = fcdatas
+        self.max_value_ = max_value
+        self.num_slots_ = num_slots
+        num_devices = len(output_datas)
+
+        self.slots_ = [np.empty((num_slots,) + d.shape, dtype=d.dtype) for d in output_datas]
+        self.slot_framecount_ = np.zeros((num_slots, num_devices), dtype=np.int64)
+        self.mask_ = [np.empty(d.shape, dtype=bool) for d in output_datas]
+        self.num_values_ = [d.size for d in output_datas]
+
+        self.framecount_ = np.zeros((num_devices, capacity), dtype=np.int64)
+        self.mean_ = np.zeros((num_devices, capacity), dtype=np.float64)
+        self.black_ratio_ = np.zeros((num_devices, capacity), dtype=np.float32)
+        self.saturation_ratio_ = np.zeros((num_devices, capacity), dtype=np.float32)
+
+        # frames pushed into / reduced from the ring; each has a single writer
+        self.num_pushed_ = 0
+        self.num_analysed_ = 0
+        self.num_offered_ = 0
+        self.num_skipped_ = 0
+        self.step_ = 1
+        self.max_step_ = 1
+        self.num_idle_ = 0
+        self.ready_ = threading.Semaphore(0)
+        self.stop_ = False
+        self.thread_ = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread_.start()
+
+    def push(self):
+        # after every builder.run(): hand the current frames to the worker if a slot is free
+        self.num_offered_ += 1
+        if self.num_offered_ % self.step_ != 0 or self.num_pushed_ == len(self.mean_[0]):
+            self.num_skipped_ += 1
+            return
+        pending = self.num_pushed_ - self.num_analysed_
+        if pending >= self.num_slots_:
+            self.num_skipped_ += 1
+            self.step_ = min(self.step_ * 2, MAX_STEP)
+            self.max_step_ = max(self.max_step_, self.step_)
+            self.num_idle_ = 0
+            return
+        if pending == 0 and self.step_ > 1:
+            self.num_idle_ += 1
+            if self.num_idle_ >= RECOVER_AFTER:
+                self.step_ //= 2
+                self.num_idle_ = 0
+        slot = self.num_pushed_ % self.num_slots_
+        for nd, data in enumerate(self.output_datas_):
+            np.copyto(self.slots_[nd][slot], data)
+            self.slot_framecount_[slot, nd] = self.fcdatas_[nd][0]
+        self.num_pushed_ += 1
+        self.ready_.release()
+
+    def reduce(self, slot, i):
+        for nd, slots in enumerate(self.slots_):
+            frame = slots[slot]
+            mask = self.mask_[nd]
+            self.framecount_[nd, i] = self.slot_framecount_[slot, nd]
+            self.mean_[nd, i] = np.add.reduce(frame, axis=None, dtype=np.float64) / self.num_values_[nd]
+            np.equal(frame, 0, out=mask)
+            self.black_ratio_[nd, i] = np.count_nonzero(mask) * 100.0 / self.num_values_[nd]
+            # values above the bit depth of the pixelformat count as saturated
+            np.greater_equal(frame, self.max_value_, out=mask)
+            self.saturation_ratio_[nd, i] = np.count_nonzero(mask) * 100.0 / self.num_values_[nd]
+
+    def run(self):
+        while True:
+            self.ready_.acquire()
+            if self.num_analysed_ == self.num_pushed_ and self.stop_:
+                return
+            self.reduce(self.num_analysed_ % self.num_slots_, self.num_analysed_)
+            self.num_analysed_ += 1
+
+    def stop(self):
+        # the frames in the ring are reduced before the worker ends
+        self.stop_ = True
+        self.ready_.release()
+        self.thread_.join()
+
+    def get_stats(self, ith_device):
+        n = self.num_analysed_
+        return {
+            'framecount': self.framecount_[ith_device, :n],
+            'mean': self.mean_[ith_device, :n],
+            'black_ratio': self.black_ratio_[ith_device, :n],
+            'saturation_ratio': self.saturation_ratio_[ith_device, :n],
+            'num_analysed': n,
+            'num_skipped': self.num_skipped_,
+            'max_step': self.max_step_,
+        }
+
+    def write(self, output_directory, prefixes):
+        arrays = {}
+        for nd, prefix in enumerate(prefixes):
+            stats = self.get_stats(nd)
+            for key in ['framecount', 'mean', 'black_ratio', 'saturation_ratio']:
+                arrays['{}_{}'.format(key, nd)] = stats[key]
+            with open(os.path.join(output_directory, prefix + FRAME_QUALITY_LOG_SUFFIX), mode='w') as f:
+                f.write(json.dumps(get_frame_quality_summary(stats), indent=4))
+        np.savez(os.path.join(output_directory, FRAME_QUALITY_FILE), max_value=np.int64(self.max_value_), **arrays)
+
+
+def get_frame_quality_summary(stats):
+    summary = {'num_analysed': stats['num_analysed'], 'num_skipped': stats['num_skipped'], 'max_step': stats['max_step']}
+    if stats['num_analysed'] > 0:
+        for key in ['mean', 'black_ratio', 'saturation_ratio']:
+            summary[key] = {'avg': float(np.mean(stats[key])), 'min': float(np.min(stats[key])), 'max': float(np.max(stats[key]))}
+        # the same thresholds as the black pixel check of frame_check.py
+        num_dark = count_dark_frames(stats['black_ratio'])
+        for threshold in ['25', '50', '75']:
+            summary['black_pixels_over_' + threshold] = num_dark[threshold]
+        summary['black_pixels_over_99_9'] = num_dark['100']
+        summary['saturated_over_1'] = int(np.count_nonzero(stats['saturation_ratio'] > 1.0))
+    return summary
+
+
+def print_frame_quality(prefix, stats):
+    summary = get_frame_quality_summary(stats)
+    print(prefix)
+    print('  analysed / skipped   : {} / {} frames (subsampled up to every {} frames)'.format(
+        summary['num_analysed'], summary['num_skipped'], summary['max_step']))
+    if summary['num_analysed'] == 0:
+        return
+    print('  mean (avg/min/max)   : {avg:.2f} / {min:.2f} / {max:.2f}'.format(**summary['mean']))
+    print('  black pixels > 25%   : {}'.format(summary['black_pixels_over_25']))
+    print('  black pixels > 50%   : {}'.format(summary['black_pixels_over_50']))
+    print('  black pixels > 75%   : {}'.format(summary['black_pixels_over_75']))
+    print('  black pixels > 99.9% : {}'.format(summary['black_pixels_over_99_9']))
+    print('  saturated > 1%       : {}'.format(summary['saturated_over_1']))
+    print('  saturation (avg/max) : {:.3f}% / {:.3f}%'.format(summary['saturation_ratio']['avg'], summary['saturation_ratio']['max']))
@@ -0,0 +1,145 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import numpy as np
+
+from tools.util import *
+from tools.bin_scan import map_bin_file
+from tools.frame_index import get_frame_index
+import tools.gendc_header as gendc_header
+
+################################################################################
+#
+# Frame content statistics of bin recordings
+#
+# Frames are read as (frames x pixels) NumPy views over the memory map of the
+# bin file, a batch of frames at a time, so nothing is copied but the batch
+# being reduced. Works on the binarysaver layout and on the intensity
+# component of GenDC containers.
+#
+################################################################################
+
+# bytes of pixels reduced at once
+BATCH_BYTES = 64 * 1024 * 1024
+HISTOGRAM_BINS = 16
+# pixels counted into the histogram at once; np.bincount works on an intp copy of them
+HISTOGRAM_VALUES = 1024 * 1024
+
+
+def get_max_value(pfnc_pixelformat, bytedepth):
+    if pfnc_pixelformat in [Mono10, BayerBG10]:
+        bitdepth = 10
+    elif pfnc_pixelformat in [Mono12, BayerBG12]:
+        bitdepth = 12
+    else:
+        bitdepth = 8
+    return (1 << min(bitdepth, 8 * bytedepth)) - 1
+
+
+def get_pixel_max_value(config_file_path, bytedepth):
+    with open(config_file_path, mode='r') as f:
+        pfnc_pixelformat = json.loads(f.read())["pfnc_pixelformat"]
+    return get_max_value(pfnc_pixelformat, bytedepth)
+
+
+def get_image_offsets(filecontent, frame_index, image_size):
+    # offset of the pixels of every frame in the bin file; GenDC containers whose
+    # intensity part is not image_size bytes are left out
+    offsets = frame_index['offset'].astype(np.int64)
+    if 'container_size' not in frame_index:
+        # binarysaver: 4 bytes of framecount followed by the pixels
+        return offsets + 4, np.ones(len(offsets), dtype=bool)
+    if len(offsets) == 0:
+        return offsets, np.zeros(0, dtype=bool)
+    container_size = frame_index['container_size']
+    if np.all(container_size == container_size[0]):
+        data_offset, data_size = gendc_header.get_image_part(filecontent, int(offsets[0]))
+        return offsets + data_offset, np.full(len(offsets), data_size == image_size)
+    parts = np.array([gendc_header.get_image_part(filecontent, int(o)) for o in offsets], dtype=np.int64)
+    return offsets + parts[:, 0], parts[:, 1] == image_size
+
+
+def reduce_batch(batch, max_value, histogram):
+    # batch: (frames x pixels); the per-frame values are reductions along the
+    # pixels of the whole batch and the histogram is accumulated in place
+    num_values = batch.shape[1]
+    black_ratio = np.count_nonzero(batch == 0, axis=1) * 100.00 / num_values
+    # values above the bit depth of the pixelformat count as saturated
+    saturation_ratio = np.count_nonzero(batch >= max_value, axis=1) * 100.00 / num_values
+    mean = np.add.reduce(batch, axis=1, dtype=np.uint64) / num_values
+
+    # level counts over the batch, a few frames at a time
+    levels = np.zeros(max_value + 1, dtype=np.int64)
+    num_frames = max(1, HISTOGRAM_VALUES // num_values)
+    for i in range(0, len(batch), num_frames):
+        counts = np.bincount(batch[i:i + num_frames].ravel(), minlength=max_value + 1)
+        levels[:max_value] += counts[:max_value]
+        levels[max_value] += np.sum(counts[max_value:])
+    histogram += np.add.reduceat(levels, np.linspace(0, max_value + 1, HISTOGRAM_BINS + 1).astype(np.int64)[:-1])
+    return black_ratio, mean, saturation_ratio
+
+
+def get_frame_stats(filecontent, image_offsets, num_values, dtype, max_value):
+    dtype = np.dtype(dtype)
+    histogram = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    results = []
+    if len(image_offsets) > 1 and np.all(np.diff(image_offsets) == image_offsets[1] - image_offsets[0]):
+        # frames at a constant stride: one 2D view per batch
+        stride = int(image_offsets[1] - image_offsets[0])
+        batch_size = max(1, BATCH_BYTES // (num_values * dtype.itemsize))
+        for i in range(0, len(image_offsets), batch_size):
+            num_frames = min(batch_size, len(image_offsets) - i)
+            batch = np.ndarray(shape=(num_frames, num_values), dtype=dtype, buffer=filecontent,
+                               offset=int(image_offsets[i]), strides=(stride, dtype.itemsize))
+            results.append(reduce_batch(batch, max_value, histogram))
+            del batch
+    else:
+        for image_offset in image_offsets:
+            frame = np.ndarray(shape=(1, num_values), dtype=dtype, buffer=filecontent, offset=int(image_offset))
+            results.append(reduce_batch(frame, max_value, histogram))
+            del frame
+
+    stats = {'histogram': histogram}
+    for i, key in enumerate(['black_ratio', 'mean', 'saturation_ratio']):
+        stats[key] = np.concatenate([r[i] for r in results]) if results else np.zeros(0)
+    return stats
+
+
+def get_frame_stats_of_bin(bin_file, w, h, d, c, max_value, subsample=1, use_index=True):
+    # statistics of every subsample-th frame of bin_file
+    frame_index = get_frame_index(bin_file, w * h * d * c, use_index=use_index)
+    with map_bin_file(bin_file) as filecontent:
+        image_offsets, valid = get_image_offsets(filecontent, frame_index, w * h * d * c)
+        selected = np.flatnonzero(valid)[::subsample]
+        stats = get_frame_stats(filecontent, image_offsets[selected], w * h * c, '<u2' if d == 2 else np.uint8, max_value)
+    stats['framecount'] = frame_index['framecount'][selected]
+    stats['num_skipped'] = int(len(valid) - np.count_nonzero(valid))
+    return stats
+
+
+def merge_frame_stats(stats_list):
+    stats = {'histogram': np.sum([s['histogram'] for s in stats_list], axis=0) if stats_list else np.zeros(HISTOGRAM_BINS, dtype=np.int64)}
+    stats['num_skipped'] = sum(s['num_skipped'] for s in stats_list)
+    for key in ['framecount', 'black_ratio', 'mean', 'saturation_ratio']:
+        stats[key] = np.concatenate([s[key] for s in stats_list]) if stats_list else np.zeros(0)
+    return stats
+
+
+def print_frame_stats(stats, max_value, subsample=1):
+    num_frames = len(stats['mean'])
+    if stats['num_skipped'] > 0:
+        print('  not analysed         : {} frames (image size does not match the config)'.format(stats['num_skipped']))
+    if num_frames == 0:
+        return
+    print('  analysed frames      : {}{}'.format(num_frames, ' (every {} frames)'.format(subsample) if subsample > 1 else ''))
+    print('  mean (avg/min/max)   : {:.2f} / {:.2f} / {:.2f}'.format(
+        np.mean(stats['mean']), np.min(stats['mean']), np.max(stats['mean'])))
+    print('  saturated > 1%       : {}'.format(int(np.count_nonzero(stats['saturation_ratio'] > 1.0))))
+    print('  saturation (avg/max) : {:.3f}% / {:.3f}%'.format(
+        np.mean(stats['saturation_ratio']), np.max(stats['saturation_ratio'])))
+    histogram = stats['histogram'] * 100.0 / max(1, int(np.sum(stats['histogram'])))
+    bin_width = (max_value + 1) / HISTOGRAM_BINS
+    print('  histogram            : ' + ', '.join(
+        '{}-{}: {:.1f}%'.format(int(k * bin_width), int((k + 1) * bin_width) - 1, v) for k, v in enumerate(histogram)))
@@ -0,0 +1,165 @@
+import os
+import json
+import numpy as np
+
+TIMING_LOG_SUFFIX = 'frame_timing.json'
+TIMING_DATA_FILE = 'frame_timing.npz'
+TIMESTAMP_LOG_SUFFIX = 'timestamp_stats.json'
+TIMESTAMP_SKEW_LOG = 'timestamp_skew.json'
+
+# an interval is an outlier if it is off the median by more than this ratio
+OUTLIER_RATIO = 0.1
+MAX_OUTLIERS_LISTED = 20
+
+PERCENTILES = [50, 90, 99]
+
+
+def get_distribution(values):
+    # p50/p90/p99/max/mean of values
+    if len(values) == 0:
+        return None
+    stats = {'p{}'.format(p): float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+    stats['max'] = float(np.max(values))
+    stats['mean'] = float(np.mean(values))
+    return stats
+
+
+def get_timing_stats(run_start_ns, run_end_ns, framecount):
+    # run_start_ns/run_end_ns: perf_counter_ns before and after each builder.run()
+    # framecount: framecount of the device read after each builder.run()
+    run_start_ns = np.asarray(run_start_ns, dtype=np.int64)
+    run_end_ns = np.asarray(run_end_ns, dtype=np.int64)
+    framecount = np.asarray(framecount, dtype=np.int64)
+
+    stats = {'num_runs': int(len(run_end_ns))}
+    stats['run_time_ms'] = get_distribution((run_end_ns - run_start_ns) / 1e6)
+
+    # a new frame arrives when the framecount changes
+    new_frame = np.ones(len(framecount), dtype=bool)
+    new_frame[1:] = np.diff(framecount) != 0
+    arrival_ns = run_end_ns[new_frame]
+    stats['num_frames'] = int(len(arrival_ns))
+
+    if len(arrival_ns) > 1:
+        elapsed_s = (arrival_ns[-1] - arrival_ns[0]) / 1e9
+        interval_ms = np.diff(arrival_ns) / 1e6
+        stats['achieved_fps'] = float((len(arrival_ns) - 1) / elapsed_s) if elapsed_s > 0 else None
+        # the rate the camera produced frames at, dropped ones included
+        arrived = framecount[new_frame]
+        stats['camera_fps'] = float((arrived[-1] - arrived[0]) / elapsed_s) if elapsed_s > 0 else None
+        stats['interval_ms'] = get_distribution(interval_ms)
+        stats['jitter_ms'] = {
+            'std': float(np.std(interval_ms)),
+            'max_deviation': float(np.max(np.abs(interval_ms - np.median(interval_ms)))),
+        }
+    return stats
+
+
+def write_timing_log(prefix, stats, output_directory):
+    logfile_path = os.path.join(output_directory, prefix + TIMING_LOG_SUFFIX)
+    print('timing log written in {}'.format(logfile_path))
+    with open(logfile_path, mode='w') as ofs:
+        ofs.write(json.dumps(stats, indent=4))
+
+
+def write_timing_data(run_start_ns, run_end_ns, framecounts, output_directory):
+    # raw timestamps of every builder.run(); framecounts[i] is the record of the i-th device
+    data = {'run_start_ns': np.asarray(run_start_ns, dtype=np.int64),
+            'run_end_ns': np.asarray(run_end_ns, dtype=np.int64)}
+    for i, framecount in enumerate(framecounts):
+        data['framecount_{}'.format(i)] = np.asarray(framecount, dtype=np.uint32)
+    np.savez(os.path.join(output_directory, TIMING_DATA_FILE), **data)
+
+
+def print_timing_stats(prefix, stats):
+    print('{}'.format(prefix))
+    if stats['run_time_ms']:
+        print('  run time p50/p90/p99/max : {p50:.3f} / {p90:.3f} / {p99:.3f} / {max:.3f} ms'.format(**stats['run_time_ms']))
+    if 'achieved_fps' in stats:
+        print('  achieved fps             : {}'.format(stats['achieved_fps']))
+        print('  camera fps               : {}'.format(stats['camera_fps']))
+        print('  jitter (std/max)         : {std:.3f} / {max_deviation:.3f} ms'.format(**stats['jitter_ms']))
+
+
+################################################################################
+#
+# device timestamps of GenDC recordings
+#
+# intervals are divided by the framecount step, so a dropped frame does not
+# look like a late one; drift is the deviation from a constant frame period
+# fitted over the whole recording.
+#
+################################################################################
+def get_timestamp_stats(framecount, timestamp_ns, outlier_ratio=OUTLIER_RATIO):
+    framecount = np.asarray(framecount, dtype=np.int64)
+    timestamp_ns = np.asarray(timestamp_ns, dtype=np.uint64).astype(np.int64)
+    stats = {'num_frames': int(len(framecount))}
+    if len(framecount) < 2:
+        return stats
+
+    steps = np.diff(framecount)
+    valid = steps > 0
+    interval_ms = np.diff(timestamp_ns)[valid] / steps[valid] / 1e6
+    elapsed_ns = timestamp_ns[-1] - timestamp_ns[0]
+    stats['estimated_fps'] = float((framecount[-1] - framecount[0]) * 1e9 / elapsed_ns) if elapsed_ns > 0 else None
+    stats['interval_ms'] = get_distribution(interval_ms)
+    stats['interval_ms']['min'] = float(np.min(interval_ms))
+    stats['jitter_ms'] = {
+        'std': float(np.std(interval_ms)),
+        'max_deviation': float(np.max(np.abs(interval_ms - np.median(interval_ms)))),
+    }
+
+    # deviation from timestamp = t0 + period * (framecount - fc0)
+    x = (framecount - framecount[0]).astype(np.float64)
+    y = (timestamp_ns - timestamp_ns[0]).astype(np.float64)
+    period_ns, offset_ns = np.polyfit(x, y, 1)
+    residual_ms = (y - (period_ns * x + offset_ns)) / 1e6
+    stats['fitted_period_ms'] = float(period_ns / 1e6)
+    stats['drift_ms'] = {'max': float(np.max(np.abs(residual_ms))), 'std': float(np.std(residual_ms))}
+
+    median = np.median(interval_ms)
+    outliers = np.flatnonzero(np.abs(interval_ms - median) > outlier_ratio * median)
+    stats['num_outliers'] = int(len(outliers))
+    # framecount of the frame that arrived early or late, and its interval
+    outlier_framecount = framecount[1:][valid][outliers]
+    stats['outliers'] = [[int(fc), float(ms)] for fc, ms in
+                         zip(outlier_framecount[:MAX_OUTLIERS_LISTED], interval_ms[outliers][:MAX_OUTLIERS_LISTED])]
+    return stats
+
+
+def get_timestamp_skew(framecount0, timestamp0_ns, framecount1, timestamp1_ns):
+    # timestamp of camera-0 minus that of camera-1 for the frames both received
+    _, idx0, idx1 = np.intersect1d(np.asarray(framecount0, dtype=np.int64), np.asarray(framecount1, dtype=np.int64),
+                                   assume_unique=True, return_indices=True)
+    skew_ms = (np.asarray(timestamp0_ns, dtype=np.uint64)[idx0].astype(np.int64)
+               - np.asarray(timestamp1_ns, dtype=np.uint64)[idx1].astype(np.int64)) / 1e6
+    stats = {'num_frames': int(len(skew_ms))}
+    if len(skew_ms) > 0:
+        stats['skew_ms'] = get_distribution(skew_ms)
+        stats['skew_ms']['min'] = float(np.min(skew_ms))
+        stats['skew_ms']['std'] = float(np.std(skew_ms))
+    return stats
+
+
+def write_timestamp_log(logfile_path, stats):
+    print('timestamp log written in {}'.format(logfile_path))
+    with open(logfile_path, mode='w') as ofs:
+        ofs.write(json.dumps(stats, indent=4))
+
+
+def print_timestamp_stats(stats):
+    if 'interval_ms' not in stats:
+        return
+    print('  estimated fps        : {}'.format(stats['estimated_fps']))
+    print('  interval p50/p99/max : {p50:.3f} / {p99:.3f} / {max:.3f} ms (min {min:.3f})'.format(**stats['interval_ms']))
+    print('  jitter (std/max)     : {std:.3f} / {max_deviation:.3f} ms'.format(**stats['jitter_ms']))
+    print('  drift (std/max)      : {std:.3f} / {max:.3f} ms'.format(**stats['drift_ms']))
+    print('  interval outliers    : {}'.format(stats['num_outliers']))
+
+
+def print_timestamp_skew(prefix0, prefix1, stats):
+    if 'skew_ms' not in stats:
+        return
+    print('timestamp skew {} - {} ({} frames)'.format(prefix0, prefix1, stats['num_frames']))
+    print('  skew mean/std        : {:.3f} / {:.3f} ms'.format(stats['skew_ms']['mean'], stats['skew_ms']['std']))
+    print('  skew min/max         : {:.3f} / {:.3f} ms'.format(stats['skew_ms']['min'], stats['skew_ms']['max']))
@@ -0,0 +1,182 @@
+import struct
+import numpy as np
+
+################################################################################
+#
+# Lightweight GenDC descriptor reader.
+# Only the fields needed to walk a recording are read, at their fixed offsets
+# in the container/component/part headers (same layout as gendc_python).
+# All offsets in a descriptor are relative to the start of the container.
+#
+################################################################################
+
+GDC_SIGNATURE = 0x43444E47
+GDC_INTENSITY = 0x0000000000000001
+
+# container header
+CONTAINER_DATASIZE_OFFSET = 32
+CONTAINER_DESCRIPTORSIZE_OFFSET = 48
+CONTAINER_COMPONENTCOUNT_OFFSET = 52
+CONTAINER_COMPONENTOFFSET_OFFSET = 56
+# component header
+COMPONENT_FLAGS_OFFSET = 2
+COMPONENT_TIMESTAMP_OFFSET = 24
+COMPONENT_TYPEID_OFFSET = 32
+COMPONENT_PARTCOUNT_OFFSET = 46
+COMPONENT_PARTOFFSET_OFFSET = 48
+# part header
+PART_DATASIZE_OFFSET = 24
+PART_DATAOFFSET_OFFSET = 32
+PART_TYPESPECIFIC_OFFSET = 40
+
+# framecount is stored in the lower 4 bytes of typespecific3 of the 1st part
+FRAMECOUNT_TYPESPECIFIC_INDEX = 2
+
+
+def is_gendc_descriptor(filecontent, cursor=0):
+    return len(filecontent) - cursor >= 4 and struct.unpack_from('<I', filecontent, cursor)[0] == GDC_SIGNATURE
+
+
+def get_container_size(filecontent, cursor=0):
+    data_size = struct.unpack_from('<Q', filecontent, cursor + CONTAINER_DATASIZE_OFFSET)[0]
+    descriptor_size = struct.unpack_from('<I', filecontent, cursor + CONTAINER_DESCRIPTORSIZE_OFFSET)[0]
+    return data_size + descriptor_size
+
+
+def get_component_offsets(filecontent, cursor=0):
+    num_components = struct.unpack_from('<I', filecontent, cursor + CONTAINER_COMPONENTCOUNT_OFFSET)[0]
+    return list(struct.unpack_from('<{}Q'.format(num_components), filecontent, cursor + CONTAINER_COMPONENTOFFSET_OFFSET))
+
+
+def get_1st_component_offset_by_typeid(filecontent, cursor=0, target_type=GDC_INTENSITY):
+    for component_offset in get_component_offsets(filecontent, cursor):
+        flags = struct.unpack_from('<H', filecontent, cursor + component_offset + COMPONENT_FLAGS_OFFSET)[0]
+        typeid = struct.unpack_from('<Q', filecontent, cursor + component_offset + COMPONENT_TYPEID_OFFSET)[0]
+        # flags != 0 means the component is not valid
+        if flags == 0 and typeid == target_type:
+            return component_offset
+    return -1
+
+
+def get_part_offset(filecontent, component_offset, cursor=0, jth_part=0):
+    return struct.unpack_from('<Q', filecontent, cursor + component_offset + COMPONENT_PARTOFFSET_OFFSET + 8 * jth_part)[0]
+
+
+def get_framecount_offset(filecontent, cursor=0):
+    # offset of the framecount from the start of the container
+    component_offset = get_1st_component_offset_by_typeid(filecontent, cursor, GDC_INTENSITY)
+    if component_offset < 0:
+        raise Exception("GenDC container does not have an intensity component")
+    part_offset = get_part_offset(filecontent, component_offset, cursor)
+    return part_offset + PART_TYPESPECIFIC_OFFSET + 8 * FRAMECOUNT_TYPESPECIFIC_INDEX
+
+
+def get_timestamp_offset(filecontent, cursor=0):
+    # offset of the timestamp of the intensity component from the start of the container
+    component_offset = get_1st_component_offset_by_typeid(filecontent, cursor, GDC_INTENSITY)
+    if component_offset < 0:
+        raise Exception("GenDC container does not have an intensity component")
+    return component_offset + COMPONENT_TIMESTAMP_OFFSET
+
+
+def get_image_part(filecontent, cursor=0):
+    # offset from the start of the container and size of the image data of the intensity component
+    component_offset = get_1st_component_offset_by_typeid(filecontent, cursor, GDC_INTENSITY)
+    if component_offset < 0:
+        raise Exception("GenDC container does not have an intensity component")
+    part_offset = get_part_offset(filecontent, component_offset, cursor)
+    data_size = struct.unpack_from('<Q', filecontent, cursor + part_offset + PART_DATASIZE_OFFSET)[0]
+    data_offset = struct.unpack_from('<Q', filecontent, cursor + part_offset + PART_DATAOFFSET_OFFSET)[0]
+    return data_offset, data_size
+
+
+def read_framecount(filecontent, cursor=0):
+    # return the framecount of the container at cursor and the cursor of the next container
+    if not is_gendc_descriptor(filecontent, cursor):
+        raise Exception("This is not valid GenDC")
+    saved_idx = struct.unpack_from('<I', filecontent, cursor + get_framecount_offset(filecontent, cursor))[0]
+    return saved_idx, cursor + get_container_size(filecontent, cursor)
+
+
+def read_timestamp(filecontent, cursor=0):
+    return struct.unpack_from('<Q', filecontent, cursor + get_timestamp_offset(filecontent, cursor))[0]
+
+
+################################################################################
+#
+# Scan a whole GenDC recording.
+# Sensors stream containers of a constant size and layout; in that case every
+# field is read for all containers at once through strided views.
+# Otherwise containers are walked one by one with the header reader above.
+#
+################################################################################
+def _strided(filecontent, offset, dtype, num_containers, container_size):
+    return np.ndarray(shape=(num_containers,), dtype=dtype, buffer=filecontent,
+                      offset=offset, strides=(container_size,))
+
+
+def _scan_fixed_size(filecontent):
+    container_size = get_container_size(filecontent)
+    if container_size == 0 or len(filecontent) % container_size != 0:
+        return None
+    num_containers = len(filecontent) // container_size
+    descriptor_size = struct.unpack_from('<I', filecontent, CONTAINER_DESCRIPTORSIZE_OFFSET)[0]
+    component_offset = get_1st_component_offset_by_typeid(filecontent)
+    if component_offset < 0:
+        raise Exception("GenDC container does not have an intensity component")
+    component_idx = get_component_offsets(filecontent).index(component_offset)
+    part_offset = get_part_offset(filecontent, component_offset)
+    framecount_offset = get_framecount_offset(filecontent)
+
+    # the first container must describe all of them
+    same_layout = True
+    for offset, dtype, value in [
+            (0, '<u4', GDC_SIGNATURE),
+            (CONTAINER_DESCRIPTORSIZE_OFFSET, '<u4', descriptor_size),
+            (CONTAINER_COMPONENTOFFSET_OFFSET + 8 * component_idx, '<u8', component_offset),
+            (component_offset + COMPONENT_PARTOFFSET_OFFSET, '<u8', part_offset)]:
+        same_layout = same_layout and bool(np.all(_strided(filecontent, offset, dtype, num_containers, container_size) == value))
+    if not same_layout:
+        return None
+
+    return {
+        'offset': np.arange(num_containers, dtype=np.uint64) * np.uint64(container_size),
+        'framecount': _strided(filecontent, framecount_offset, '<u4', num_containers, container_size).copy(),
+        'container_size': np.full(num_containers, container_size, dtype=np.uint64),
+        'timestamp': _strided(filecontent, component_offset + COMPONENT_TIMESTAMP_OFFSET, '<u8', num_containers, container_size).copy(),
+    }
+
+
+def _scan_variable_size(filecontent):
+    offsets = []
+    framecount = []
+    timestamp = []
+    cursor = 0
+    while cursor < len(filecontent):
+        offsets.append(cursor)
+        timestamp.append(read_timestamp(filecontent, cursor))
+        saved_idx, cursor = read_framecount(filecontent, cursor)
+        framecount.append(saved_idx)
+    offsets = np.array(offsets, dtype=np.uint64)
+    return {
+        'offset': offsets,
+        'framecount': np.array(framecount, dtype=np.uint32),
+        'container_size': np.diff(np.append(offsets, np.uint64(cursor))),
+        'timestamp': np.array(timestamp, dtype=np.uint64),
+    }
+
+
+def scan_gendc(filecontent):
+    # return the offset, framecount, container size and timestamp of every
+    # container of a GenDC recording
+    if len(filecontent) == 0:
+        return {
+            'offset': np.zeros(0, dtype=np.uint64),
+            'framecount': np.zeros(0, dtype=np.uint32),
+            'container_size': np.zeros(0, dtype=np.uint64),
+            'timestamp': np.zeros(0, dtype=np.uint64),
+        }
+    ret = _scan_fixed_size(filecontent)
+    if ret is None:
+        ret = _scan_variable_size(filecontent)
+    return ret
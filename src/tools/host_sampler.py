@@ -0,0 +1,244 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import threading
+import time
+import numpy as np
+
+################################################################################
+#
+# Host resource sampler (Linux)
+#
+# A thread reads /proc at a fixed interval: busy ratio of every core, context
+# switches, available/dirty/writeback memory, memory stall time (PSI) and the
+# writes of the block device of the output directory. Samples are timed with
+# perf_counter_ns, the clock of builder.run() in frame_timing.npz, and saved
+# as host_samples.npz in the test directory with the perf_counter_ns of the
+# first and last frame, so that they can be placed on the frame timeline.
+#
+# The /proc files are kept open and re-read with pread. The CPU time of the
+# thread is measured; when it takes more than MAX_CPU_SHARE of a core over a
+# window of GUARD_WINDOW seconds the interval is doubled, so the sampler
+# stays cheap whatever the host.
+#
+################################################################################
+
+HOST_SAMPLES_FILE = 'host_samples.npz'
+SAMPLE_INTERVAL = 0.1
+MAX_INTERVAL = 2.0
+MAX_CPU_SHARE = 0.005
+GUARD_WINDOW = 1.0
+INITIAL_CAPACITY = 4096
+READ_SIZE = 1 << 16
+
+# rows of the scalar samples in host_samples.npz
+HOST_METRICS = ['mem_available_mb', 'dirty_mb', 'writeback_mb', 'memory_stall_pct',
+                'disk_write_mb_per_s', 'disk_write_latency_ms', 'context_switches_per_s']
+
+
+def is_supported():
+    return os.path.isfile('/proc/stat')
+
+
+def find_block_device(directory):
+    # name of the /proc/diskstats entry of the volume of directory, or None
+    st_dev = os.stat(directory).st_dev
+    major, minor = os.major(st_dev), os.minor(st_dev)
+    with open('/proc/diskstats') as f:
+        for line in f:
+            fields = line.split()
+            if int(fields[0]) == major and int(fields[1]) == minor:
+                return fields[2]
+    return None
+
+
+class HostSampler:
+    def __init__(self, output_directory, interval=SAMPLE_INTERVAL):
+        self.interval_ = interval
+        self.block_device_ = find_block_device(output_directory)
+        self.fds_ = {'stat': os.open('/proc/stat', os.O_RDONLY),
+                     'meminfo': os.open('/proc/meminfo', os.O_RDONLY)}
+        for name, path in [('pressure', '/proc/pressure/memory'), ('diskstats', '/proc/diskstats')]:
+            try:
+                self.fds_[name] = os.open(path, os.O_RDONLY)
+            except OSError:
+                pass
+        self.num_cores_ = len(self.read_cpu()[0])
+
+        self.size_ = 0
+        self.t_ns_ = np.zeros(INITIAL_CAPACITY, dtype=np.int64)
+        self.cpu_busy_ = np.zeros((INITIAL_CAPACITY, self.num_cores_), dtype=np.float32)
+        self.metrics_ = np.zeros((INITIAL_CAPACITY, len(HOST_METRICS)), dtype=np.float32)
+        self.prev_ = None
+        self.cpu_ns_ = 0
+        self.num_reads_ = 0
+        self.start_ns_ = None
+        self.window_start_ns_ = None
+        self.window_cpu_ns_ = 0
+        self.stop_ = threading.Event()
+        self.thread_ = threading.Thread(target=self.run, daemon=True)
+
+    def read(self, name):
+        # until a short read: the intr line of /proc/stat alone can exceed READ_SIZE on large hosts
+        data = os.pread(self.fds_[name], READ_SIZE, 0)
+        while data and len(data) % READ_SIZE == 0:
+            chunk = os.pread(self.fds_[name], READ_SIZE, len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def read_cpu(self):
+        # (busy jiffies per core, total jiffies per core, context switches)
+        busy, total, ctxt = [], [], 0
+        for line in self.read('stat').split(b'\n'):
+            if line.startswith(b'cpu') and line[3:4].isdigit():
+                values = [int(v) for v in line.split()[1:]]
+                # idle and iowait
+                busy.append(sum(values) - values[3] - values[4])
+                total.append(sum(values))
+            elif line.startswith(b'ctxt'):
+                ctxt = int(line.split()[1])
+        return np.array(busy, dtype=np.int64), np.array(total, dtype=np.int64), ctxt
+
+    def read_meminfo(self):
+        values = {}
+        for line in self.read('meminfo').split(b'\n'):
+            key, _, rest = line.partition(b':')
+            if key in (b'MemAvailable', b'Dirty', b'Writeback'):
+                values[key] = int(rest.split()[0]) / 1024.0
+        return values.get(b'MemAvailable', np.nan), values.get(b'Dirty', np.nan), values.get(b'Writeback', np.nan)
+
+    def read_memory_stall_us(self):
+        if 'pressure' not in self.fds_:
+            return None
+        # "some ... total=<us>": time at least one task stalled on memory
+        return int(self.read('pressure').split(b'\n')[0].rsplit(b'=', 1)[1])
+
+    def read_disk(self):
+        # (sectors written, writes completed, ms spent writing) of the block device
+        if self.block_device_ is None or 'diskstats' not in self.fds_:
+            return None
+        name = self.block_device_.encode()
+        for line in self.read('diskstats').split(b'\n'):
+            fields = line.split()
+            if len(fields) > 10 and fields[2] == name:
+                return int(fields[9]), int(fields[7]), int(fields[10])
+        return None
+
+    def sample(self):
+        cpu_start_ns = time.thread_time_ns()
+        t_ns = time.perf_counter_ns()
+        busy, total, ctxt = self.read_cpu()
+        current = (t_ns, busy, total, ctxt, self.read_memory_stall_us(), self.read_disk())
+        mem_available, dirty, writeback = self.read_meminfo()
+        if self.prev_ is not None:
+            prev_t_ns, prev_busy, prev_total, prev_ctxt, prev_stall, prev_disk = self.prev_
+            elapsed_s = (t_ns - prev_t_ns) / 1e9
+            if self.size_ == len(self.t_ns_):
+                self.grow()
+            i = self.size_
+            self.t_ns_[i] = t_ns
+            self.cpu_busy_[i] = (busy - prev_busy) * 100.0 / np.maximum(total - prev_total, 1)
+            stall = (current[4] - prev_stall) / 1e4 / elapsed_s if current[4] is not None else np.nan
+            write_mb_per_s, write_latency_ms = np.nan, np.nan
+            if current[5] is not None and prev_disk is not None:
+                sectors, writes, write_ms = np.subtract(current[5], prev_disk)
+                write_mb_per_s = sectors * 512 / 1e6 / elapsed_s
+                write_latency_ms = write_ms / writes if writes > 0 else 0.0
+            self.metrics_[i] = [mem_available, dirty, writeback, stall, write_mb_per_s, write_latency_ms,
+                                (ctxt - prev_ctxt) / elapsed_s]
+            self.size_ += 1
+        self.prev_ = current
+        self.num_reads_ += 1
+        cpu_ns = time.thread_time_ns() - cpu_start_ns
+        self.cpu_ns_ += cpu_ns
+        self.window_cpu_ns_ += cpu_ns
+        # keep the sampler under MAX_CPU_SHARE of a core, the share that stop() reports
+        window_ns = time.perf_counter_ns() - self.window_start_ns_
+        if window_ns >= GUARD_WINDOW * 1e9:
+            if self.window_cpu_ns_ / window_ns > MAX_CPU_SHARE and self.interval_ < MAX_INTERVAL:
+                self.interval_ = min(MAX_INTERVAL, self.interval_ * 2)
+            self.window_start_ns_ = time.perf_counter_ns()
+            self.window_cpu_ns_ = 0
+
+    def grow(self):
+        self.t_ns_ = np.concatenate([self.t_ns_, np.zeros_like(self.t_ns_)])
+        self.cpu_busy_ = np.concatenate([self.cpu_busy_, np.zeros_like(self.cpu_busy_)])
+        self.metrics_ = np.concatenate([self.metrics_, np.zeros_like(self.metrics_)])
+
+    def run(self):
+        self.start_ns_ = time.perf_counter_ns()
+        self.window_start_ns_ = self.start_ns_
+        self.sample()
+        while not self.stop_.wait(self.interval_):
+            self.sample()
+
+    def start(self):
+        self.thread_.start()
+
+    def stop(self):
+        # returns the overhead: samples, CPU ms per sample, share of one core, last interval
+        self.stop_.set()
+        self.thread_.join()
+        self.sample()
+        for fd in self.fds_.values():
+            os.close(fd)
+        elapsed_s = (time.perf_counter_ns() - self.start_ns_) / 1e9
+        return {
+            'num_samples': self.num_reads_,
+            'cpu_ms_per_sample': self.cpu_ns_ / 1e6 / max(self.num_reads_, 1),
+            'cpu_share_pct': self.cpu_ns_ / 1e9 / elapsed_s * 100.0 if elapsed_s > 0 else 0.0,
+            'interval_s': self.interval_,
+        }
+
+    def write(self, output_directory, overhead, recording_start_ns=None, recording_end_ns=None):
+        np.savez(os.path.join(output_directory, HOST_SAMPLES_FILE),
+                 t_ns=self.t_ns_[:self.size_],
+                 cpu_busy_pct=self.cpu_busy_[:self.size_],
+                 metrics=self.metrics_[:self.size_],
+                 metric_names=np.array(HOST_METRICS),
+                 block_device=np.array(self.block_device_ or ''),
+                 recording_start_ns=np.int64(recording_start_ns if recording_start_ns is not None else -1),
+                 recording_end_ns=np.int64(recording_end_ns if recording_end_ns is not None else -1),
+                 overhead=np.array([overhead['num_samples'], overhead['cpu_ms_per_sample'],
+                                    overhead['cpu_share_pct'], overhead['interval_s']]))
+
+
+################################################################################
+# reading the samples back on the frame timeline
+################################################################################
+def load_host_samples(run_dir):
+    path = os.path.join(run_dir, HOST_SAMPLES_FILE)
+    if not os.path.isfile(path):
+        return None
+    with np.load(path) as data:
+        samples = {key: data[key] for key in data.files}
+    for i, name in enumerate(samples['metric_names']):
+        samples[str(name)] = samples['metrics'][:, i]
+    samples['cpu_mean_pct'] = np.mean(samples['cpu_busy_pct'], axis=1) if samples['cpu_busy_pct'].size else np.zeros(0)
+    samples['cpu_max_pct'] = np.max(samples['cpu_busy_pct'], axis=1) if samples['cpu_busy_pct'].size else np.zeros(0)
+    return samples
+
+
+def get_frame_positions(samples, run_dir, ith_device, num_frames, timing_file='frame_timing.npz'):
+    # frame index (from the first frame of the log) at the time of every sample:
+    # interpolated over the arrival time of each frame if frame_timing.npz was
+    # recorded (realtime-evaluation mode), linear over the recording otherwise
+    timing_path = os.path.join(run_dir, timing_file)
+    if os.path.isfile(timing_path):
+        with np.load(timing_path) as timing:
+            key = 'framecount_{}'.format(ith_device)
+            if key in timing.files and len(timing[key]) > 0:
+                run_end_ns = timing['run_end_ns']
+                framecount = timing[key].astype(np.int64)
+                new_frame = np.ones(len(framecount), dtype=bool)
+                new_frame[1:] = np.diff(framecount) != 0
+                return np.interp(samples['t_ns'], run_end_ns[new_frame], framecount[new_frame] - framecount[0],
+                                 left=np.nan, right=np.nan)
+    start_ns, end_ns = int(samples['recording_start_ns']), int(samples['recording_end_ns'])
+    if start_ns < 0 or end_ns <= start_ns:
+        return None
+    position = (samples['t_ns'] - start_ns) * (num_frames - 1) / (end_ns - start_ns)
+    return np.where((position >= 0) & (position <= num_frames - 1), position, np.nan)
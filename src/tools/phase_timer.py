@@ -0,0 +1,140 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cProfile
+import io
+import json
+import pstats
+import time
+from contextlib import contextmanager, nullcontext
+import numpy as np
+
+################################################################################
+#
+# Phase timers
+#
+# The time of each named phase of a test (pipeline build, recording, bin scan,
+# deletion of bin files, frame logs...) is accumulated by a PhaseTimer and
+# saved as phase_times.json in the test directory. The file is merged on
+# write, so that the phases of the background analysis (--pipelined) are
+# added to those of the recording. With --profile the Python-side analysis
+# phases run under cProfile and profile.prof / profile.txt are saved as well.
+# summarize_phases() gathers all tests into phase_summary.json.
+#
+################################################################################
+
+PHASE_LOG = 'phase_times.json'
+PHASE_SUMMARY = 'phase_summary.json'
+PROFILE_STATS = 'profile.prof'
+PROFILE_REPORT = 'profile.txt'
+PROFILE_SUMMARY = 'profile_summary.txt'
+PROFILE_LINES = 30
+
+
+class PhaseTimer:
+    def __init__(self, profile=False):
+        self.phases_ = {}
+        self.profiler_ = cProfile.Profile() if profile else None
+        self.profiled_ = False
+
+    def add(self, name, seconds):
+        self.phases_[name] = self.phases_.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name, profile=False):
+        # profile: run the phase under cProfile when the timer profiles
+        profiler = self.profiler_ if profile else None
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler:
+                profiler.disable()
+                self.profiled_ = True
+            self.add(name, time.perf_counter() - start)
+
+    def write(self, output_directory):
+        log_path = os.path.join(output_directory, PHASE_LOG)
+        phases = {}
+        if os.path.isfile(log_path):
+            with open(log_path) as f:
+                phases = json.loads(f.read())["phases"]
+        for name, seconds in self.phases_.items():
+            phases[name] = phases.get(name, 0.0) + seconds
+        with open(log_path, mode='w') as f:
+            f.write(json.dumps({"phases": phases}, indent=4))
+
+        if self.profiled_:
+            self.profiler_.dump_stats(os.path.join(output_directory, PROFILE_STATS))
+            with open(os.path.join(output_directory, PROFILE_REPORT), mode='w') as f:
+                pstats.Stats(self.profiler_, stream=f).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return log_path
+
+
+def phase(timer, name, profile=False):
+    # timer may be None when phases are not recorded
+    return timer.phase(name, profile) if timer else nullcontext()
+
+
+################################################################################
+# summary across tests
+################################################################################
+def list_test_directories(root_dir):
+    tests = [d for d in os.listdir(root_dir) if d.isdigit() and os.path.isdir(os.path.join(root_dir, d))]
+    return [os.path.join(root_dir, d) for d in sorted(tests, key=int)]
+
+
+def summarize_phases(root_dir, campaign_phases=None):
+    # campaign_phases: {name: seconds} of phases run once for all tests (e.g. device discovery)
+    times = {}
+    num_tests = 0
+    for test_dir in list_test_directories(root_dir):
+        log_path = os.path.join(test_dir, PHASE_LOG)
+        if not os.path.isfile(log_path):
+            continue
+        with open(log_path) as f:
+            phases = json.loads(f.read())["phases"]
+        num_tests += 1
+        for name, seconds in phases.items():
+            times.setdefault(name, []).append(seconds)
+
+    per_phase = {}
+    for name, seconds in times.items():
+        per_phase[name] = {
+            'num_tests': len(seconds),
+            'mean_s': float(np.mean(seconds)),
+            'min_s': float(np.min(seconds)),
+            'max_s': float(np.max(seconds)),
+            'total_s': float(np.sum(seconds)),
+        }
+    for name, seconds in (campaign_phases or {}).items():
+        per_phase[name] = {'num_tests': 0, 'mean_s': seconds, 'min_s': seconds, 'max_s': seconds, 'total_s': seconds}
+    total = sum(p['total_s'] for p in per_phase.values())
+    for p in per_phase.values():
+        p['share_pct'] = p['total_s'] * 100.0 / total if total > 0 else 0.0
+    ordered = dict(sorted(per_phase.items(), key=lambda item: -item[1]['total_s']))
+    return {'num_tests': num_tests, 'total_s': total, 'phases': ordered}
+
+
+def write_phase_summary(root_dir, summary):
+    with open(os.path.join(root_dir, PHASE_SUMMARY), mode='w') as f:
+        f.write(json.dumps(summary, indent=4))
+
+    # profiles of all tests in a single report
+    profiles = [os.path.join(d, PROFILE_STATS) for d in list_test_directories(root_dir)
+                if os.path.isfile(os.path.join(d, PROFILE_STATS))]
+    if profiles:
+        stream = io.StringIO()
+        pstats.Stats(*profiles, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        with open(os.path.join(root_dir, PROFILE_SUMMARY), mode='w') as f:
+            f.write(stream.getvalue())
+
+
+def print_phase_summary(summary):
+    print('phases ({} tests, {:.3f} s in total)'.format(summary['num_tests'], summary['total_s']))
+    for name, p in summary['phases'].items():
+        print('  {:<20s} : mean {:.3f} s, min {:.3f} s, max {:.3f} s, total {:.3f} s ({:.1f}%)'.format(
+            name, p['mean_s'], p['min_s'], p['max_s'], p['total_s'], p['share_pct']))
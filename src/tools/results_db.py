@@ -0,0 +1,458 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import datetime
+import json
+import platform
+import re
+import sqlite3
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+
+import tools.util as util
+from tools.frame_log import FRAME_LOG_SUFFIX
+from tools.frame_timing import TIMING_LOG_SUFFIX, TIMESTAMP_LOG_SUFFIX
+from tools.load_config import CONFIG_SUFFIX
+import tools.summary as summary
+from tools.soak import SOAK_SUMMARY_SUFFIX
+import numpy as np
+
+################################################################################
+#
+# Results database
+#
+# Campaigns (a U3V-performance-test-* directory, or any directory of frame
+# logs checked with frame_check.py) are ingested into a SQLite file: one row
+# per campaign with the device, test parameters, host and tool versions, one
+# row per run and camera, and the drop intervals of every run. test_performance
+# writes campaign.json at the start of a campaign for this; older campaigns
+# get what their config files tell. Columns used to select campaigns are
+# indexed, so queries read only the rows they need.
+#
+################################################################################
+
+CAMPAIGN_INFO = 'campaign.json'
+CAMPAIGN_DIR = re.compile(r'^U3V-performance-test-(?:without-saving-)?(\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})$')
+RESULTS_DB = 'results.sqlite'
+# distributions of the sensing-dev SDK recorded with every campaign
+SDK_DISTRIBUTIONS = ['ion-contrib-python', 'gendc-python', 'numpy']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS campaigns (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    started_at TEXT,
+    hostname TEXT,
+    platform TEXT,
+    tool_revision TEXT,
+    ion_version TEXT,
+    gendc_version TEXT,
+    width INTEGER,
+    height INTEGER,
+    pixelformat TEXT,
+    gendc INTEGER,
+    num_devices INTEGER,
+    realtime_evaluation INTEGER,
+    num_frames INTEGER,
+    duration REAL,
+    dev_info TEXT,
+    test_info TEXT,
+    host_info TEXT,
+    versions TEXT,
+    signature TEXT,
+    ingested_at TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id),
+    run TEXT,
+    camera INTEGER,
+    num_frames INTEGER,
+    num_caught INTEGER,
+    num_dropped INTEGER,
+    catch_rate REAL,
+    num_bursts INTEGER,
+    max_burst INTEGER,
+    first_drop_frame INTEGER,
+    longest_clean_streak INTEGER,
+    achieved_fps REAL,
+    interval_p99_ms REAL,
+    jitter_std_ms REAL,
+    timestamp_interval_p99_ms REAL,
+    timestamp_jitter_std_ms REAL,
+    elapsed_s REAL
+);
+CREATE TABLE IF NOT EXISTS drops (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    start INTEGER,
+    length INTEGER
+);
+CREATE INDEX IF NOT EXISTS campaigns_started_at ON campaigns(started_at);
+CREATE INDEX IF NOT EXISTS campaigns_hostname ON campaigns(hostname);
+CREATE INDEX IF NOT EXISTS campaigns_format ON campaigns(pixelformat, width, height);
+CREATE INDEX IF NOT EXISTS campaigns_ion_version ON campaigns(ion_version);
+CREATE INDEX IF NOT EXISTS runs_campaign ON runs(campaign_id);
+CREATE INDEX IF NOT EXISTS drops_run ON drops(run_id);
+'''
+
+CAMPAIGN_COLUMNS = ['path', 'started_at', 'hostname', 'platform', 'tool_revision', 'ion_version', 'gendc_version',
+                    'width', 'height', 'pixelformat', 'gendc', 'num_devices', 'realtime_evaluation', 'num_frames',
+                    'duration', 'dev_info', 'test_info', 'host_info', 'versions', 'signature', 'ingested_at']
+RUN_COLUMNS = ['campaign_id', 'run', 'camera', 'num_frames', 'num_caught', 'num_dropped', 'catch_rate', 'num_bursts',
+               'max_burst', 'first_drop_frame', 'longest_clean_streak', 'achieved_fps', 'interval_p99_ms',
+               'jitter_std_ms', 'timestamp_interval_p99_ms', 'timestamp_jitter_std_ms', 'elapsed_s']
+
+GROUP_BY = ['campaign', 'hostname', 'ion_version', 'gendc_version', 'tool_revision', 'pixelformat']
+
+
+################################################################################
+# campaign.json
+################################################################################
+def get_host_info():
+    return {
+        'hostname': platform.node(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+
+
+def get_tool_versions():
+    versions = {}
+    for name in SDK_DISTRIBUTIONS:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    versions['SENSING_DEV_ROOT'] = os.environ.get('SENSING_DEV_ROOT')
+    # revision of this tool, if it runs from a git checkout
+    try:
+        versions['tool_revision'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                                   cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        versions['tool_revision'] = None
+    return versions
+
+
+def write_campaign_info(output_directory, dev_info, test_info):
+    info = {
+        'started_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'dev_info': dev_info,
+        'test_info': test_info,
+        'host': get_host_info(),
+        'versions': get_tool_versions(),
+    }
+    with open(os.path.join(output_directory, CAMPAIGN_INFO), mode='w') as f:
+        f.write(json.dumps(info, indent=4))
+
+
+################################################################################
+# ingest
+################################################################################
+def connect(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    # databases created before soak tests were ingested
+    if 'elapsed_s' not in [column[1] for column in conn.execute('PRAGMA table_info(runs)')]:
+        conn.execute('ALTER TABLE runs ADD COLUMN elapsed_s REAL')
+    return conn
+
+
+def list_campaign_runs(campaign_dir):
+    # [(run, camera, frame log or soak summary)]
+    return summary.list_runs(campaign_dir) + summary.list_soak_runs(campaign_dir)
+
+
+def is_campaign(dir_path):
+    return CAMPAIGN_DIR.match(os.path.basename(os.path.normpath(dir_path))) is not None \
+        or os.path.isfile(os.path.join(dir_path, CAMPAIGN_INFO))
+
+
+def find_campaigns(root_dir):
+    # the campaign root_dir belongs to, or all campaigns under it; a directory
+    # of frame logs that belongs to no campaign is a campaign of its own
+    root_dir = os.path.abspath(root_dir)
+    parent = root_dir
+    while True:
+        if is_campaign(parent):
+            return [parent]
+        if os.path.dirname(parent) == parent:
+            break
+        parent = os.path.dirname(parent)
+
+    campaigns = []
+    for dir_path, dirs, _ in os.walk(root_dir):
+        if is_campaign(dir_path):
+            campaigns.append(dir_path)
+            dirs[:] = []
+        else:
+            dirs.sort()
+    if not campaigns and list_campaign_runs(root_dir):
+        campaigns.append(root_dir)
+    return campaigns
+
+
+def get_pixelformat_name(pfnc_pixelformat):
+    for name in ['Mono8', 'Mono10', 'Mono12', 'RGB8', 'BGR8', 'BayerBG8', 'BayerBG10', 'BayerBG12']:
+        if getattr(util, name) == pfnc_pixelformat:
+            return name
+    return None
+
+
+def get_campaign_row(campaign_dir, runs, signature):
+    row = dict.fromkeys(CAMPAIGN_COLUMNS)
+    row['path'] = campaign_dir
+    row['signature'] = signature
+    row['ingested_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+    m = CAMPAIGN_DIR.match(os.path.basename(campaign_dir))
+    if m:
+        row['started_at'] = datetime.datetime.strptime(m.group(1), '%Y-%m-%d-%H-%M-%S').isoformat()
+
+    info_file = os.path.join(campaign_dir, CAMPAIGN_INFO)
+    if os.path.isfile(info_file):
+        with open(info_file) as f:
+            info = json.loads(f.read())
+        dev_info, test_info = info['dev_info'], info['test_info']
+        host, versions = info.get('host', {}), info.get('versions', {})
+        row.update({
+            'started_at': info.get('started_at', row['started_at']),
+            'hostname': host.get('hostname'),
+            'platform': host.get('platform'),
+            'tool_revision': versions.get('tool_revision'),
+            'ion_version': versions.get('ion-contrib-python'),
+            'gendc_version': versions.get('gendc-python'),
+            'width': dev_info.get('Width'),
+            'height': dev_info.get('Height'),
+            'pixelformat': dev_info.get('PixelFormat'),
+            'gendc': dev_info.get('GenDCStreamingMode'),
+            'num_devices': dev_info.get('Number of Devices'),
+            'realtime_evaluation': test_info.get('Realtime-evaluation mode'),
+            'num_frames': test_info.get('Number of Frames'),
+            'duration': test_info.get('Duration'),
+            'dev_info': json.dumps(dev_info),
+            'test_info': json.dumps(test_info),
+            'host_info': json.dumps(host),
+            'versions': json.dumps(versions),
+        })
+        return row
+
+    # campaigns without campaign.json: the image format from a config file
+    cameras = set()
+    for run, camera, log_file in runs:
+        cameras.add(camera)
+        if log_file.endswith(SOAK_SUMMARY_SUFFIX):
+            continue
+        config_file = log_file[:-len(FRAME_LOG_SUFFIX)] + CONFIG_SUFFIX
+        if row['width'] is None and os.path.isfile(config_file):
+            with open(config_file) as f:
+                config = json.loads(f.read())
+            row['width'], row['height'] = config.get('width'), config.get('height')
+            row['pixelformat'] = get_pixelformat_name(config.get('pfnc_pixelformat'))
+    row['num_devices'] = len(cameras) if cameras else None
+    return row
+
+
+def load_json(path):
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.loads(f.read())
+
+
+def load_run_results(log_file):
+    # module-level so that it can run in a process pool
+    if log_file.endswith(SOAK_SUMMARY_SUFFIX):
+        # soak tests keep no drops, only their counts and burst histogram
+        stats, soak = summary.get_soak_run_stats(log_file)
+        no_drops = np.zeros(0, dtype=np.int64)
+        return stats, no_drops, no_drops, {'elapsed_s': soak['elapsed_s']}
+    num_caught, drop_start, drop_length, achieved_fps = summary.load_run(log_file)
+    stats = summary.get_run_stats(num_caught, drop_start, drop_length, achieved_fps=achieved_fps)
+    prefix = log_file[:-len(FRAME_LOG_SUFFIX)]
+    timing = load_json(prefix + TIMING_LOG_SUFFIX)
+    timestamp = load_json(prefix + TIMESTAMP_LOG_SUFFIX)
+    extra = {
+        'interval_p99_ms': (timing.get('interval_ms') or {}).get('p99'),
+        'jitter_std_ms': (timing.get('jitter_ms') or {}).get('std'),
+        'timestamp_interval_p99_ms': (timestamp.get('interval_ms') or {}).get('p99'),
+        'timestamp_jitter_std_ms': (timestamp.get('jitter_ms') or {}).get('std'),
+        'elapsed_s': None,
+    }
+    return stats, drop_start, drop_length, extra
+
+
+def get_signature(runs):
+    # changes when a frame log is added or rewritten
+    mtimes = [os.stat(log_file).st_mtime_ns for _, _, log_file in runs]
+    return '{}:{}'.format(len(mtimes), max(mtimes) if mtimes else 0)
+
+
+def delete_campaign(conn, campaign_id):
+    conn.execute('DELETE FROM drops WHERE run_id IN (SELECT id FROM runs WHERE campaign_id = ?)', (campaign_id,))
+    conn.execute('DELETE FROM runs WHERE campaign_id = ?', (campaign_id,))
+    conn.execute('DELETE FROM campaigns WHERE id = ?', (campaign_id,))
+
+
+def insert_campaign(conn, campaign_dir, runs, signature, loaded):
+    row = get_campaign_row(campaign_dir, runs, signature)
+    campaign_id = conn.execute('INSERT INTO campaigns ({}) VALUES ({})'.format(
+        ', '.join(CAMPAIGN_COLUMNS), ', '.join('?' * len(CAMPAIGN_COLUMNS))), [row[c] for c in CAMPAIGN_COLUMNS]).lastrowid
+    for (run, camera, _), (stats, drop_start, drop_length, extra) in zip(runs, loaded):
+        stats = dict(stats, **extra, campaign_id=campaign_id, run=run, camera=camera, achieved_fps=stats['delivered_fps'])
+        run_id = conn.execute('INSERT INTO runs ({}) VALUES ({})'.format(
+            ', '.join(RUN_COLUMNS), ', '.join('?' * len(RUN_COLUMNS))), [stats.get(c) for c in RUN_COLUMNS]).lastrowid
+        conn.executemany('INSERT INTO drops (run_id, start, length) VALUES (?, ?, ?)',
+                         zip([run_id] * len(drop_start), drop_start.tolist(), drop_length.tolist()))
+
+
+def ingest(db_path, paths, num_jobs=1, force=False):
+    # campaigns whose frame logs did not change since the last ingest are
+    # skipped; the frame logs of all others are read in one pass (by a pool
+    # with num_jobs > 1) and written in one transaction
+    campaigns = []
+    for path in paths:
+        campaigns += [c for c in find_campaigns(path) if c not in campaigns]
+    conn = connect(db_path)
+    try:
+        pending = []
+        for campaign_dir in campaigns:
+            runs = list_campaign_runs(campaign_dir)
+            signature = get_signature(runs)
+            existing = conn.execute('SELECT id, signature FROM campaigns WHERE path = ?', (campaign_dir,)).fetchone()
+            if existing and existing[1] == signature and not force:
+                continue
+            pending.append((campaign_dir, runs, signature, existing[0] if existing else None))
+
+        log_files = [log_file for _, runs, _, _ in pending for _, _, log_file in runs]
+        if num_jobs > 1 and len(log_files) > 1:
+            with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+                loaded = list(executor.map(load_run_results, log_files, chunksize=max(1, len(log_files) // (4 * num_jobs))))
+        else:
+            loaded = [load_run_results(log_file) for log_file in log_files]
+
+        with conn:
+            i = 0
+            for campaign_dir, runs, signature, campaign_id in pending:
+                if campaign_id is not None:
+                    delete_campaign(conn, campaign_id)
+                insert_campaign(conn, campaign_dir, runs, signature, loaded[i:i + len(runs)])
+                i += len(runs)
+    finally:
+        conn.close()
+    print('{} of {} campaigns ({} runs) ingested into {}'.format(len(pending), len(campaigns), len(log_files), db_path))
+    return len(pending)
+
+
+################################################################################
+# query
+################################################################################
+def query(db_path, group_by='campaign', hostname=None, pixelformat=None, width=None, height=None, since=None, until=None):
+    # catch rate and jitter of the runs of the selected campaigns, per group
+    conditions = []
+    params = []
+    for column, value in [('hostname', hostname), ('pixelformat', pixelformat), ('width', width), ('height', height)]:
+        if value is not None:
+            conditions.append('c.{} = ?'.format(column))
+            params.append(value)
+    if since:
+        conditions.append('c.started_at >= ?')
+        params.append(since)
+    if until:
+        conditions.append('c.started_at < ?')
+        params.append(until)
+    key = 'c.path' if group_by == 'campaign' else 'c.' + group_by
+    sql = '''
+        SELECT {key}, COUNT(DISTINCT c.id), COUNT(r.id), AVG(r.catch_rate), MIN(r.catch_rate),
+               SUM(r.num_dropped), MAX(r.max_burst), MAX(r.interval_p99_ms), MAX(r.timestamp_jitter_std_ms)
+        FROM campaigns c JOIN runs r ON r.campaign_id = c.id
+        {where}
+        GROUP BY {key}
+        ORDER BY MIN(c.started_at)
+    '''.format(key=key, where='WHERE ' + ' AND '.join(conditions) if conditions else '')
+    conn = connect(db_path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def print_rows(header, rows):
+    widths = [max([len(str(h))] + [len(format_value(r[i])) for r in rows]) for i, h in enumerate(header)]
+    print('  '.join(str(h).ljust(w) for h, w in zip(header, widths)))
+    for r in rows:
+        print('  '.join(format_value(v).ljust(w) for v, w in zip(r, widths)))
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return '{:.4f}'.format(value)
+    return str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store and query results of performance tests")
+    parser.add_argument('-db', '--database', default=RESULTS_DB, type=str, \
+                        help='SQLite file of the results')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help='Ingest campaigns under the directories')
+    ingest_parser.add_argument('directories', nargs='+', type=str, \
+                               help='Campaign directories or directories containing campaigns')
+    ingest_parser.add_argument('-j', '--jobs', type=int, default=1, \
+                               help='The number of processes to read frame logs with')
+    ingest_parser.add_argument('-f', '--force', action='store_true', \
+                               help='Ingest campaigns again even if their frame logs did not change')
+
+    query_parser = subparsers.add_parser('query', help='Catch rate and jitter per campaign, host, version or pixelformat')
+    query_parser.add_argument('-g', '--group-by', default='campaign', choices=GROUP_BY, \
+                              help='Group the runs by')
+    query_parser.add_argument('--host', type=str, default=None, \
+                              help='Only campaigns of this host')
+    query_parser.add_argument('--pixelformat', type=str, default=None, \
+                              help='Only campaigns of this pixelformat e.g. Mono12')
+    query_parser.add_argument('--width', type=int, default=None, \
+                              help='Only campaigns of this width')
+    query_parser.add_argument('--height', type=int, default=None, \
+                              help='Only campaigns of this height')
+    query_parser.add_argument('--since', type=str, default=None, \
+                              help='Only campaigns started at or after this time e.g. 2024-05-01')
+    query_parser.add_argument('--until', type=str, default=None, \
+                              help='Only campaigns started before this time')
+
+    sql_parser = subparsers.add_parser('sql', help='Run an SQL statement on the database')
+    sql_parser.add_argument('statement', type=str, \
+                            help='e.g. "SELECT hostname, AVG(catch_rate) FROM runs JOIN campaigns ON campaign_id = campaigns.id GROUP BY hostname"')
+
+    args = parser.parse_args()
+    if args.command == 'ingest':
+        ingest(args.database, args.directories, args.jobs, args.force)
+        return
+
+    start = time.perf_counter()
+    if args.command == 'query':
+        rows = query(args.database, args.group_by, args.host, args.pixelformat, args.width, args.height, args.since, args.until)
+        header = [args.group_by, 'campaigns', 'runs', 'catch rate avg', 'catch rate min', 'dropped', 'max burst',
+                  'interval p99 (ms)', 'timestamp jitter (ms)']
+    else:
+        conn = connect(args.database)
+        cursor = conn.execute(args.statement)
+        rows = cursor.fetchall()
+        header = [d[0] for d in cursor.description] if cursor.description else []
+        conn.commit()
+        conn.close()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if header:
+        print_rows(header, rows)
+    print('{} rows in {:.1f} ms'.format(len(rows), elapsed_ms))
+
+
+if __name__ == "__main__":
+    main()
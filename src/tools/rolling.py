@@ -0,0 +1,117 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import re
+import threading
+
+from tools.load_config import *
+from tools.frame_index import get_frame_index
+
+################################################################################
+#
+# Rolling recording
+#
+# The saver writes <prefix><N>.bin and moves on to <prefix><N+1>.bin when a
+# file is full, so <prefix><N>.bin is complete as soon as the next one exists.
+# A background thread scans every completed bin file for its framecounts,
+# keeps them in file order and deletes the file, so the disk holds little more
+# than the files being written. The framecounts are checked for continuity
+# across files afterwards, exactly as if all files had been kept.
+#
+################################################################################
+
+BIN_FILE_PATTERN = r'^{}(\d+)\.bin$'
+POLL_INTERVAL = 0.2
+
+
+class RollingBinScanner:
+    def __init__(self, output_directory, prefixes, disk_cap_bytes=None, poll_interval=POLL_INTERVAL):
+        self.output_directory_ = output_directory
+        self.prefixes_ = prefixes
+        self.patterns_ = [re.compile(BIN_FILE_PATTERN.format(re.escape(prefix))) for prefix in prefixes]
+        self.disk_cap_bytes_ = disk_cap_bytes
+        self.poll_interval_ = poll_interval
+
+        self.framecounts_ = [[] for prefix in prefixes]
+        # index of the next bin file to scan, per prefix
+        self.next_idx_ = [0 for prefix in prefixes]
+        self.num_scanned_ = 0
+        self.peak_disk_usage_ = 0
+        self.over_cap_ = threading.Event()
+        self.stop_ = threading.Event()
+        self.error_ = None
+        self.thread_ = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread_.start()
+
+    def is_over_cap(self):
+        return self.over_cap_.is_set()
+
+    def has_failed(self):
+        return self.error_ is not None
+
+    def list_bin_files(self):
+        # {prefix index: {bin index: size}}
+        bin_files = [{} for prefix in self.prefixes_]
+        disk_usage = 0
+        with os.scandir(self.output_directory_) as entries:
+            for entry in entries:
+                for i, pattern in enumerate(self.patterns_):
+                    m = pattern.match(entry.name)
+                    if m:
+                        try:
+                            size = entry.stat().st_size
+                        except FileNotFoundError:
+                            continue
+                        bin_files[i][int(m.group(1))] = size
+                        disk_usage += size
+        self.peak_disk_usage_ = max(self.peak_disk_usage_, disk_usage)
+        if self.disk_cap_bytes_ and disk_usage > self.disk_cap_bytes_:
+            self.over_cap_.set()
+        return bin_files
+
+    def get_framesize(self, i):
+        w, h, d, c = get_config_info(os.path.join(self.output_directory_, self.prefixes_[i] + CONFIG_SUFFIX))
+        return w * h * d * c
+
+    def consume(self, i, idx):
+        bin_file = os.path.join(self.output_directory_, self.prefixes_[i] + str(idx) + '.bin')
+        frame_index = get_frame_index(bin_file, self.get_framesize(i), use_index=False)
+        self.framecounts_[i].append(frame_index['framecount'])
+        os.remove(bin_file)
+        self.num_scanned_ += 1
+
+    def scan_completed(self, last=False):
+        # scan and delete the completed bin files of every prefix in order;
+        # with last, the file being written is complete too
+        bin_files = self.list_bin_files()
+        for i in range(len(self.prefixes_)):
+            if not bin_files[i]:
+                continue
+            newest = max(bin_files[i])
+            while self.next_idx_[i] <= newest:
+                idx = self.next_idx_[i]
+                if idx == newest and not last:
+                    break
+                if idx in bin_files[i]:
+                    self.consume(i, idx)
+                self.next_idx_[i] += 1
+
+    def run(self):
+        try:
+            while not self.stop_.wait(self.poll_interval_):
+                self.scan_completed()
+        except Exception as e:
+            # bin files are no longer deleted: the recording has to stop
+            self.error_ = e
+
+    def finish(self):
+        # stop the thread, scan the remaining files and return the framecounts of each prefix
+        self.stop_.set()
+        self.thread_.join()
+        if self.error_ is not None:
+            raise self.error_
+        self.scan_completed(last=True)
+        return self.framecounts_
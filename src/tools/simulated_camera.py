@@ -0,0 +1,274 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import random
+import struct
+import time
+import numpy as np
+
+from tools.util import *
+from tools.gendc_header import *
+
+################################################################################
+#
+# Simulated U3V camera
+#
+# SimulatedDevice answers the same feature queries as an Aravis device, and
+# SimulatedBuilder stands in for the ion pipeline: every run() delivers one
+# frame per device, either into the bound output/frame_count arrays
+# (realtime-evaluation mode) or into bin files and config json written in the
+# same layout as image_io_binarysaver_* / image_io_binary_gendc_saver.
+#
+################################################################################
+
+SIMULATED_DEVICE_ID = 'Simulated-U3V-Camera'
+
+# bin files are rotated when the next frame would exceed this size
+BIN_FILE_SIZE_LIMIT = 64 * 1024 * 1024
+
+GDC_COMPONENT_HEADER_SIZE = 56
+GDC_PART_HEADER_SIZE = PART_TYPESPECIFIC_OFFSET + 8 * 3
+
+
+def get_pixel_layout(pixelformat):
+    # return (bytedepth, channel) of the pixelformat written by the binarysaver
+    if pixelformat in ["Mono8", "BayerBG8"]:
+        return 1, 1
+    elif pixelformat in ["Mono10", "Mono12", "BayerBG10", "BayerBG12"]:
+        return 2, 1
+    elif pixelformat in ["RGB8", "BGR8"]:
+        return 1, 3
+    else:
+        raise Exception(pixelformat + " is not supported by the simulated camera")
+
+
+def get_bit_depth(pixelformat):
+    return {"Mono10": 10, "BayerBG10": 10, "Mono12": 12, "BayerBG12": 12}.get(pixelformat, 8)
+
+
+def generate_test_pattern(width, height, pixelformat):
+    # horizontal gradient over the full range of the pixelformat
+    bytedepth, channel = get_pixel_layout(pixelformat)
+    max_value = (1 << get_bit_depth(pixelformat)) - 1
+    row = (np.arange(width, dtype=np.uint32) * max_value // max(width - 1, 1))
+    image = np.repeat(row[np.newaxis, :], height, axis=0).astype(np.uint8 if bytedepth == 1 else np.uint16)
+    if channel == 3:
+        image = np.repeat(image[:, :, np.newaxis], 3, axis=2)
+    return image
+
+
+def build_gendc_container(image, width, height, pixelformat):
+    # one container with one intensity component of one 2D image part.
+    # returns the container and the offsets of the framecount and the timestamp
+    # so that they can be patched for every frame.
+    data = image.tobytes()
+    container_header_size = CONTAINER_COMPONENTOFFSET_OFFSET + 8
+    component_offset = container_header_size
+    part_offset = component_offset + GDC_COMPONENT_HEADER_SIZE
+    descriptor_size = part_offset + GDC_PART_HEADER_SIZE
+    pfnc_pixelformat = get_pixelformat_in_int(pixelformat)
+
+    container = bytearray(descriptor_size + len(data))
+    # container header
+    struct.pack_into('<I3sBHHIQH6xQQII', container, 0,
+                     GDC_SIGNATURE, b'\x01\x00\x00', 0, 0x1000, 0, container_header_size, 0, 0,
+                     len(data), descriptor_size, descriptor_size, 1)
+    struct.pack_into('<Q', container, CONTAINER_COMPONENTOFFSET_OFFSET, component_offset)
+    # component header
+    struct.pack_into('<HHIHHHHIIQQIHH', container, component_offset,
+                     0x2000, 0, GDC_COMPONENT_HEADER_SIZE, 0, 0, 0, 0, 0, 0, 0,
+                     GDC_INTENSITY, pfnc_pixelformat, 0, 1)
+    struct.pack_into('<Q', container, component_offset + COMPONENT_PARTOFFSET_OFFSET, part_offset)
+    # part header: typespecific1 = dimension, typespecific3 = framecount
+    struct.pack_into('<HHIIHHQQQQQQ', container, part_offset,
+                     0x4200, 0, GDC_PART_HEADER_SIZE, pfnc_pixelformat, 0, 0, 0,
+                     len(data), descriptor_size, width | (height << 32), 0, 0)
+    container[descriptor_size:] = data
+
+    framecount_offset = part_offset + PART_TYPESPECIFIC_OFFSET + 8 * FRAMECOUNT_TYPESPECIFIC_INDEX
+    timestamp_offset = component_offset + COMPONENT_TIMESTAMP_OFFSET
+    return container, framecount_offset, timestamp_offset
+
+
+class DropPattern:
+    # comma separated list of
+    #   N          : drop framecount N
+    #   A-B        : drop framecount A to B
+    #   every:N    : drop every N-th frame
+    #   rate:P     : drop each frame with probability P
+    def __init__(self, pattern, seed=0):
+        self.frames_ = set()
+        self.ranges_ = []
+        self.every_ = []
+        self.rate_ = 0.0
+        self.rng_ = random.Random(seed)
+
+        if not pattern:
+            return
+        for item in pattern.split(','):
+            item = item.strip()
+            if item.startswith('every:'):
+                self.every_.append(int(item.split(':')[1]))
+            elif item.startswith('rate:'):
+                self.rate_ = float(item.split(':')[1])
+            elif '-' in item:
+                first, last = item.split('-')
+                self.ranges_.append((int(first), int(last)))
+            elif item:
+                self.frames_.add(int(item))
+
+    def is_dropped(self, framecount):
+        if framecount in self.frames_:
+            return True
+        for first, last in self.ranges_:
+            if first <= framecount <= last:
+                return True
+        for n in self.every_:
+            if framecount % n == n - 1:
+                return True
+        return self.rate_ > 0.0 and self.rng_.random() < self.rate_
+
+
+class SimulatedDevice:
+    def __init__(self, width, height, pixelformat, gendc=False, num_devices=1, fps=60.0):
+        bytedepth, channel = get_pixel_layout(pixelformat)
+        payloadsize = width * height * bytedepth * channel
+        if gendc:
+            container, _, _ = build_gendc_container(generate_test_pattern(width, height, pixelformat), width, height, pixelformat)
+            payloadsize = len(container)
+
+        self.features_ = {
+            "DeviceModelName": SIMULATED_DEVICE_ID,
+            "OperationMode": "Came1" if num_devices == 1 else "Came2",
+            "Width": width,
+            "Height": height,
+            "PayloadSize": payloadsize,
+            "PixelFormat": pixelformat,
+            "AcquisitionFrameRate": fps,
+        }
+        if gendc:
+            self.features_["GenDCDescriptor"] = 1
+            self.features_["GenDCStreamingMode"] = "On"
+
+    def is_feature_available(self, key):
+        return key in self.features_
+
+    def get_string_feature_value(self, key):
+        return str(self.features_[key])
+
+    def get_integer_feature_value(self, key):
+        return int(self.features_[key])
+
+    def get_float_feature_value(self, key):
+        return float(self.features_[key])
+
+
+class SimulatedBuilder:
+    def __init__(self, dev_info, output_directory_path, prefixes, fps=60.0, drop_pattern=None,
+                 output_datas=None, fcdatas=None):
+        self.num_devices_ = dev_info["Number of Devices"]
+        self.width_ = dev_info["Width"]
+        self.height_ = dev_info["Height"]
+        self.pixelformat_ = dev_info["PixelFormat"]
+        self.gendc_ = dev_info["GenDCStreamingMode"]
+        self.output_directory_ = output_directory_path
+        self.prefixes_ = prefixes
+        self.period_ = 1.0 / fps if fps > 0 else 0.0
+        self.drop_patterns_ = [DropPattern(drop_pattern, seed=i) for i in range(self.num_devices_)]
+
+        # realtime-evaluation mode if the output arrays are given
+        self.output_datas_ = output_datas
+        self.fcdatas_ = fcdatas
+
+        self.image_ = generate_test_pattern(self.width_, self.height_, self.pixelformat_)
+        if self.gendc_:
+            self.container_, self.framecount_offset_, self.timestamp_offset_ = \
+                build_gendc_container(self.image_, self.width_, self.height_, self.pixelformat_)
+        else:
+            self.record_ = bytearray(4) + self.image_.tobytes()
+
+        self.next_framecount_ = [0] * self.num_devices_
+        self.start_time_ = None
+        self.start_framecount_ = 0
+        self.start_timestamp_ns_ = time.time_ns()
+        self.bin_files_ = [None] * self.num_devices_
+        self.bin_file_idx_ = [-1] * self.num_devices_
+        self.bin_file_size_ = [0] * self.num_devices_
+
+    def write_config(self, ith_device):
+        config = {
+            "width": self.width_,
+            "height": self.height_,
+            "pfnc_pixelformat": get_pixelformat_in_int(self.pixelformat_),
+        }
+        config_path = os.path.join(self.output_directory_, self.prefixes_[ith_device] + 'config.json')
+        with open(config_path, mode='w') as f:
+            f.write(json.dumps(config))
+
+    def save(self, ith_device, framecount):
+        if self.gendc_:
+            record = self.container_
+            struct.pack_into('<I', record, self.framecount_offset_, framecount)
+            struct.pack_into('<Q', record, self.timestamp_offset_,
+                             self.start_timestamp_ns_ + int(framecount * self.period_ * 1e9))
+        else:
+            record = self.record_
+            struct.pack_into('<I', record, 0, framecount)
+
+        if self.bin_files_[ith_device] is None:
+            self.write_config(ith_device)
+        if self.bin_files_[ith_device] is None or self.bin_file_size_[ith_device] + len(record) > BIN_FILE_SIZE_LIMIT:
+            if self.bin_files_[ith_device] is not None:
+                self.bin_files_[ith_device].close()
+            self.bin_file_idx_[ith_device] += 1
+            bin_file = os.path.join(self.output_directory_,
+                                    self.prefixes_[ith_device] + str(self.bin_file_idx_[ith_device]) + '.bin')
+            self.bin_files_[ith_device] = open(bin_file, mode='wb')
+            self.bin_file_size_[ith_device] = 0
+
+        self.bin_files_[ith_device].write(record)
+        # keep whole records on disk so that bin files can be scanned while recording
+        self.bin_files_[ith_device].flush()
+        self.bin_file_size_[ith_device] += len(record)
+
+    def set_output_directory(self, output_directory_path):
+        # start new bin files in another directory; the camera keeps counting
+        self.close()
+        self.output_directory_ = output_directory_path
+        self.bin_file_idx_ = [-1] * self.num_devices_
+        self.bin_file_size_ = [0] * self.num_devices_
+        # pace from the next frame on, as the camera was idle in between
+        self.start_time_ = None
+        self.start_framecount_ = max(self.next_framecount_)
+
+    def run(self):
+        if self.start_time_ is None:
+            self.start_time_ = time.perf_counter()
+
+        # the camera keeps sending frames while the host drops them,
+        # so run() returns when the latest delivered frame is due
+        last_framecount = 0
+        for ith_device in range(self.num_devices_):
+            framecount = self.next_framecount_[ith_device]
+            while self.drop_patterns_[ith_device].is_dropped(framecount):
+                framecount += 1
+            self.next_framecount_[ith_device] = framecount + 1
+            last_framecount = max(last_framecount, framecount)
+
+            if self.fcdatas_ is not None:
+                np.copyto(self.output_datas_[ith_device], self.image_.reshape(self.output_datas_[ith_device].shape))
+                self.fcdatas_[ith_device][0] = framecount
+            else:
+                self.save(ith_device, framecount)
+
+        wait = self.start_time_ + (last_framecount + 1 - self.start_framecount_) * self.period_ - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+
+    def close(self):
+        for ith_device, bin_file in enumerate(self.bin_files_):
+            if bin_file is not None:
+                bin_file.close()
+                self.bin_files_[ith_device] = None
@@ -0,0 +1,186 @@
+import os
+import json
+import numpy as np
+
+################################################################################
+#
+# Soak test
+#
+# Framecounts read after every builder.run() go to a preallocated ring; when
+# the ring is full (and at every checkpoint) it is folded into RunningStats,
+# so memory does not depend on the length of the test. The summary is
+# checkpointed to <prefix>soak_summary.json.
+#
+################################################################################
+
+SOAK_SUMMARY_SUFFIX = 'soak_summary.json'
+RING_CAPACITY = 1 << 16
+MINUTE_NS = 60 * 1000 * 1000 * 1000
+
+
+def parse_duration(duration):
+    # seconds from "90", "90s", "30m", "24h"
+    units = {'s': 1, 'm': 60, 'h': 3600}
+    if duration[-1] in units:
+        return float(duration[:-1]) * units[duration[-1]]
+    return float(duration)
+
+
+class FramecountRing:
+    def __init__(self, capacity=RING_CAPACITY):
+        self.framecount_ = np.zeros(capacity, dtype=np.uint32)
+        self.run_end_ns_ = np.zeros(capacity, dtype=np.int64)
+        self.size_ = 0
+
+    def is_full(self):
+        return self.size_ == len(self.framecount_)
+
+    def append(self, framecount, run_end_ns):
+        self.framecount_[self.size_] = framecount
+        self.run_end_ns_[self.size_] = run_end_ns
+        self.size_ += 1
+
+    def drain(self):
+        # views of the stored entries; valid until the next append
+        size = self.size_
+        self.size_ = 0
+        return self.framecount_[:size], self.run_end_ns_[:size]
+
+
+class RunningStats:
+    def __init__(self, start_ns):
+        self.start_ns_ = start_ns
+        self.last_framecount_ = None
+        self.last_arrival_ns_ = None
+        self.first_framecount_ = None
+        self.num_runs_ = 0
+        # odd while fold_ring() moves the ring into the statistics; read by RunningStatsProbe
+        self.version_ = 0
+        self.num_caught_ = 0
+        self.num_dropped_ = 0
+        self.num_resets_ = 0
+        self.first_drop_ns_ = None
+        # burst lengths grouped by ceil(log2(length))
+        self.burst_groups_ = np.zeros(33, dtype=np.int64)
+        self.max_burst_ = 0
+        self.clean_streak_ = 0
+        self.longest_clean_streak_ = 0
+        self.max_interval_ns_ = 0
+        # per minute since start: frames caught, frames expected
+        self.minute_caught_ = np.zeros(0, dtype=np.int64)
+        self.minute_expected_ = np.zeros(0, dtype=np.int64)
+
+    def fold_ring(self, ring):
+        self.version_ += 1
+        self.fold(*ring.drain())
+        self.version_ += 1
+
+    def fold(self, framecount, run_end_ns):
+        self.num_runs_ += len(framecount)
+        if len(framecount) == 0:
+            return
+        framecount = framecount.astype(np.int64)
+
+        # a new frame arrives when the framecount changes
+        prev = framecount[0] - 1 if self.last_framecount_ is None else self.last_framecount_
+        steps = np.diff(framecount, prepend=prev)
+        new_frame = steps != 0
+        framecount = framecount[new_frame]
+        arrival_ns = run_end_ns[new_frame]
+        steps = steps[new_frame]
+        if len(framecount) == 0:
+            return
+        if self.first_framecount_ is None:
+            self.first_framecount_ = int(framecount[0])
+
+        # a step back means the camera restarted counting; it is not a drop
+        self.num_resets_ += int(np.count_nonzero(steps < 0))
+        dropped = np.where(steps > 1, steps - 1, 0)
+        self.num_caught_ += len(framecount)
+        self.num_dropped_ += int(np.sum(dropped))
+
+        bursts = np.flatnonzero(dropped)
+        if len(bursts) > 0:
+            if self.first_drop_ns_ is None:
+                self.first_drop_ns_ = int(arrival_ns[bursts[0]])
+            groups = np.ceil(np.log2(dropped[bursts])).astype(np.int64)
+            self.burst_groups_ += np.bincount(groups, minlength=len(self.burst_groups_))[:len(self.burst_groups_)]
+            self.max_burst_ = max(self.max_burst_, int(np.max(dropped[bursts])))
+            # clean streaks: caught frames between bursts, carried across folds
+            streaks = np.diff(np.concatenate([[0], bursts, [len(framecount)]]))
+            streaks[0] += self.clean_streak_
+            self.longest_clean_streak_ = max(self.longest_clean_streak_, int(np.max(streaks[:-1])))
+            self.clean_streak_ = int(streaks[-1])
+        else:
+            self.clean_streak_ += len(framecount)
+        self.longest_clean_streak_ = max(self.longest_clean_streak_, self.clean_streak_)
+
+        if self.last_arrival_ns_ is not None:
+            intervals = np.diff(arrival_ns, prepend=self.last_arrival_ns_)
+        else:
+            intervals = np.diff(arrival_ns)
+        if len(intervals) > 0:
+            self.max_interval_ns_ = max(self.max_interval_ns_, int(np.max(intervals)))
+
+        minute = (arrival_ns - self.start_ns_) // MINUTE_NS
+        num_minutes = int(minute[-1]) + 1
+        if num_minutes > len(self.minute_caught_):
+            self.minute_caught_ = np.pad(self.minute_caught_, (0, num_minutes - len(self.minute_caught_)))
+            self.minute_expected_ = np.pad(self.minute_expected_, (0, num_minutes - len(self.minute_expected_)))
+        self.minute_caught_ += np.bincount(minute, minlength=num_minutes)
+        self.minute_expected_ += np.bincount(minute, weights=1 + dropped, minlength=num_minutes).astype(np.int64)
+
+        self.last_framecount_ = int(framecount[-1])
+        self.last_arrival_ns_ = int(arrival_ns[-1])
+
+    def to_dict(self, now_ns):
+        elapsed_s = (now_ns - self.start_ns_) / 1e9
+        num_frames = self.num_caught_ + self.num_dropped_
+        histogram = {}
+        for g in np.flatnonzero(self.burst_groups_):
+            low = 1 if g == 0 else (1 << (g - 1)) + 1
+            label = str(low) if low == 1 << g else '{}-{}'.format(low, 1 << g)
+            histogram[label] = int(self.burst_groups_[g])
+        minute_rate = self.minute_caught_ * 100.0 / np.maximum(self.minute_expected_, 1)
+        return {
+            'elapsed_s': elapsed_s,
+            'num_runs': self.num_runs_,
+            'num_frames': num_frames,
+            'num_caught': self.num_caught_,
+            'num_dropped': self.num_dropped_,
+            'num_resets': self.num_resets_,
+            'catch_rate': self.num_caught_ * 100.0 / num_frames if num_frames > 0 else None,
+            'achieved_fps': self.num_caught_ / elapsed_s if elapsed_s > 0 else None,
+            'first_framecount': self.first_framecount_,
+            'last_framecount': self.last_framecount_,
+            'first_drop_s': (self.first_drop_ns_ - self.start_ns_) / 1e9 if self.first_drop_ns_ is not None else None,
+            'num_bursts': int(np.sum(self.burst_groups_)),
+            'max_burst': self.max_burst_,
+            'burst_histogram': histogram,
+            'longest_clean_streak': self.longest_clean_streak_,
+            'max_interval_ms': self.max_interval_ns_ / 1e6,
+            'minute_catch_rate': minute_rate.tolist(),
+            'worst_minute': int(np.argmin(minute_rate)) if len(minute_rate) > 0 else None,
+        }
+
+
+def write_soak_summary(prefix, summary, output_directory):
+    # replaced atomically so that a crash leaves the previous checkpoint intact
+    summary_path = os.path.join(output_directory, prefix + SOAK_SUMMARY_SUFFIX)
+    tmp_path = summary_path + '.tmp'
+    with open(tmp_path, mode='w') as ofs:
+        ofs.write(json.dumps(summary, indent=4))
+    os.replace(tmp_path, summary_path)
+    return summary_path
+
+
+def print_soak_summary(prefix, summary):
+    print('{}'.format(prefix))
+    print('  elapsed              : {:.1f} s'.format(summary['elapsed_s']))
+    if summary['catch_rate'] is not None:
+        print('  frame catch rate     : {}%'.format(summary['catch_rate']))
+    print('  frame catch          : {} frames'.format(summary['num_caught']))
+    print('  dropped frames       : {} in {} bursts (max {})'.format(summary['num_dropped'], summary['num_bursts'], summary['max_burst']))
+    print('  longest clean streak : {} frames'.format(summary['longest_clean_streak']))
+    if summary['worst_minute'] is not None:
+        print('  worst minute         : {} ({}%)'.format(summary['worst_minute'], summary['minute_catch_rate'][summary['worst_minute']]))
@@ -0,0 +1,137 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import numpy as np
+
+from tools.util import *
+
+################################################################################
+#
+# Startup benchmark of the analysis tools
+#
+# Every command runs in a fresh interpreter; the median wall time of several
+# runs is reported. The "without SDK" runs block the sensing-dev SDK modules
+# (and PIL) at import, which shows that these paths never load them.
+#
+# The baseline imports what frame_check.py used to load before it parsed its
+# arguments (the SDK modules that are installed, PIL, NumPy, the bin scanners
+# and the result tooling), and the CLIs are reported as a ratio of it.
+#
+################################################################################
+
+SDK_MODULES = ['gendc_python', 'ionpy', 'aravis', 'PIL']
+
+BLOCK_SDK = '''
+import sys, importlib.abc
+class BlockSDK(importlib.abc.MetaPathFinder):
+    def find_spec(self, name, path, target=None):
+        if name.split('.')[0] in {}:
+            raise ImportError(name + ' is blocked')
+sys.meta_path.insert(0, BlockSDK())
+'''.format(SDK_MODULES)
+
+IMPORT_SDK = '''
+import importlib
+for name in {}:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass
+'''.format(SDK_MODULES + ['gendc_python.gendc_separator.descriptor', 'PIL.Image'])
+
+BASELINE_IMPORTS = ['numpy', 'PIL.Image', 'gendc_python.gendc_separator.descriptor', 'gendc_python.genicam',
+                    'concurrent.futures.process', 'tools.frame_index', 'tools.frame_stats', 'tools.frame_timing',
+                    'tools.summary', 'tools.results_db']
+
+IMPORT_BASELINE = '''
+import importlib, sys
+sys.path.append({!r})
+for name in {}:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        pass
+'''
+
+RUN_SCRIPT = '''
+import runpy, sys
+sys.argv = {}
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+
+def write_raw_recording(directory, w=640, h=480, num_frames=1000):
+    # a recording of the binarysaver layout with a few dropped frames
+    prefix = 'camera-0-'
+    with open(os.path.join(directory, prefix + 'config.json'), mode='w') as f:
+        f.write(json.dumps({"width": w, "height": h, "pfnc_pixelformat": Mono8}))
+    image = np.zeros(w * h, dtype=np.uint8).tobytes()
+    with open(os.path.join(directory, prefix + '0.bin'), mode='wb') as f:
+        for framecount in range(num_frames):
+            if framecount % 97 != 96:
+                f.write(struct.pack('<I', framecount))
+                f.write(image)
+
+
+def measure(argv, block_sdk=False, repeat=5):
+    code = (BLOCK_SDK if block_sdk else '') + RUN_SCRIPT.format(argv) if argv[0].endswith('.py') \
+        else (BLOCK_SDK if block_sdk else '') + argv[0]
+    elapsed = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        ret = subprocess.run([sys.executable, '-c', code], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        elapsed.append(time.perf_counter() - start)
+        if ret.returncode != 0:
+            return None, ret.stderr.decode().strip().splitlines()[-1]
+    return float(np.median(elapsed)), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the startup time of the analysis tools")
+    parser.add_argument('-r', '--repeat', type=int, default=5, \
+                        help='The number of runs of each command')
+    args = parser.parse_args()
+
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    frame_check = os.path.join(src_dir, 'tools', 'frame_check.py')
+    visualize_frame_log = os.path.join(src_dir, 'visualize_frame_log.py')
+    test_performance = os.path.join(src_dir, 'test_performance.py')
+    work_dir = tempfile.mkdtemp()
+    try:
+        write_raw_recording(work_dir)
+        commands = [
+            ('python (no import)', ['pass'], False),
+            ('import SDK modules (installed ones)', [IMPORT_SDK], False),
+            ('baseline (imports before lazy loading)', [IMPORT_BASELINE.format(src_dir, BASELINE_IMPORTS)], False),
+            ('frame_check.py --help', [frame_check, '--help'], False),
+            ('frame_check.py --help without SDK', [frame_check, '--help'], True),
+            ('frame_check.py raw bin', [frame_check, '-d', work_dir, '-ni'], False),
+            ('frame_check.py raw bin without SDK', [frame_check, '-d', work_dir, '-ni'], True),
+            ('visualize_frame_log.py --help', [visualize_frame_log, '--help'], False),
+            ('test_performance.py --help without SDK', [test_performance, '--help'], True),
+        ]
+        baseline = None
+        for name, argv, block_sdk in commands:
+            elapsed, error = measure(argv, block_sdk, args.repeat)
+            if elapsed is None:
+                print('{:<40s}: failed ({})'.format(name, error))
+            elif baseline is None or not name.startswith('frame_check.py --help'):
+                print('{:<40s}: {:.3f} s'.format(name, elapsed))
+            else:
+                print('{:<40s}: {:.3f} s ({:.0f}% of the baseline)'.format(name, elapsed, elapsed * 100.0 / baseline))
+            if name.startswith('baseline'):
+                baseline = elapsed
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
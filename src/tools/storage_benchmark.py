@@ -0,0 +1,206 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import shutil
+import tempfile
+import threading
+import time
+import numpy as np
+
+from tools.frame_timing import get_distribution
+
+################################################################################
+#
+# Storage pre-flight benchmark
+#
+# One writer thread per device writes records of the saver's size into
+# <prefix><N>.bin files rotated at the same size, the way the binary savers
+# do. The paced phase writes at the camera's frame rate and shows whether the
+# volume keeps up and how long writes stall; the unpaced phase writes as fast
+# as possible and gives the sustained throughput of the volume.
+#
+# A rotated file is deleted as soon as it is closed, so each writer keeps a
+# single file on the volume, and the rotation size is limited so that the
+# files fit in the free space less FREE_MARGIN.
+#
+################################################################################
+
+STORAGE_PREFLIGHT_LOG = 'storage_preflight.json'
+ROTATION_SIZE = 64 * 1024 * 1024
+MIN_HEADROOM = 1.5
+# share of the free space left untouched
+FREE_MARGIN = 0.1
+
+
+def get_record_size(dev_info):
+    # bytes written per frame by the saver of one device
+    if dev_info["GenDCStreamingMode"]:
+        return dev_info["PayloadSize"]
+    pixelformat = dev_info["PixelFormat"]
+    bytedepth = 2 if pixelformat in ["Mono10", "Mono12", "BayerBG10", "BayerBG12"] else 1
+    channel = 3 if pixelformat in ["RGB8", "BGR8"] else 1
+    # 4 bytes of framecount followed by the image
+    return 4 + dev_info["Width"] * dev_info["Height"] * bytedepth * channel
+
+
+class SaverWriter(threading.Thread):
+    def __init__(self, directory, prefix, record, fps, duration, rotation_size=ROTATION_SIZE):
+        super().__init__(daemon=True)
+        self.directory_ = directory
+        self.prefix_ = prefix
+        self.record_ = record
+        self.period_ = 1.0 / fps if fps > 0 else 0.0
+        self.duration_ = duration
+        self.rotation_size_ = rotation_size
+        self.latency_ns_ = []
+        self.num_late_ = 0
+        self.bytes_written_ = 0
+        self.elapsed_ = 0.0
+        self.error_ = None
+
+    def run(self):
+        try:
+            self.write()
+        except Exception as e:
+            self.error_ = e
+
+    def write(self):
+        fd = None
+        file_idx = -1
+        file_size = 0
+        start = time.perf_counter()
+        end = start + self.duration_
+        i = 0
+        while True:
+            due = start + i * self.period_
+            now = time.perf_counter()
+            if now >= end:
+                break
+            if due > now:
+                time.sleep(due - now)
+            elif self.period_ > 0 and now - due > self.period_:
+                # the previous write took longer than a frame period
+                self.num_late_ += 1
+
+            if fd is None or file_size + len(self.record_) > self.rotation_size_:
+                if fd is not None:
+                    os.fsync(fd)
+                    os.close(fd)
+                    os.remove(path)
+                file_idx += 1
+                path = os.path.join(self.directory_, self.prefix_ + str(file_idx) + '.bin')
+                fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0))
+                file_size = 0
+
+            write_start = time.perf_counter_ns()
+            os.write(fd, self.record_)
+            self.latency_ns_.append(time.perf_counter_ns() - write_start)
+            file_size += len(self.record_)
+            self.bytes_written_ += len(self.record_)
+            i += 1
+        if fd is not None:
+            # data still in the page cache counts against the throughput
+            os.fsync(fd)
+            os.close(fd)
+        self.elapsed_ = time.perf_counter() - start
+
+
+def run_phase(directory, record_size, num_devices, fps, duration, rotation_size):
+    # every writer has one file of up to rotation_size on the volume at a time
+    free_per_writer = int(shutil.disk_usage(directory).free * (1.0 - FREE_MARGIN)) // num_devices
+    rotation_size = min(rotation_size, free_per_writer)
+    if rotation_size < record_size:
+        raise Exception("Not enough free space in {} to write a frame of {} bytes per device".format(directory, record_size))
+    record = np.random.default_rng(0).integers(0, 256, record_size, dtype=np.uint8).tobytes()
+    phase_dir = tempfile.mkdtemp(prefix='storage-preflight-', dir=directory)
+    try:
+        writers = [SaverWriter(phase_dir, 'camera-' + str(i) + '-', record, fps, duration, rotation_size)
+                   for i in range(num_devices)]
+        for w in writers:
+            w.start()
+        for w in writers:
+            w.join()
+    finally:
+        shutil.rmtree(phase_dir, ignore_errors=True)
+    for w in writers:
+        if w.error_ is not None:
+            raise w.error_
+
+    elapsed = max(w.elapsed_ for w in writers)
+    bytes_written = sum(w.bytes_written_ for w in writers)
+    latency_ms = np.concatenate([np.array(w.latency_ns_, dtype=np.int64) for w in writers]) / 1e6
+    stats = {
+        'num_records': int(len(latency_ms)),
+        'mb_per_s': bytes_written / elapsed / 1e6 if elapsed > 0 else None,
+        'write_latency_ms': get_distribution(latency_ms),
+    }
+    if len(latency_ms) > 0:
+        stats['write_latency_ms']['p99.9'] = float(np.percentile(latency_ms, 99.9))
+    if fps > 0:
+        stats['num_late'] = sum(w.num_late_ for w in writers)
+    return stats
+
+
+def run_storage_benchmark(directory, record_size, num_devices, fps, duration=10.0, rotation_size=ROTATION_SIZE):
+    required = record_size * fps * num_devices / 1e6
+    result = {
+        'directory': os.path.abspath(directory),
+        'record_size': record_size,
+        'num_devices': num_devices,
+        'fps': fps,
+        'required_mb_per_s': required,
+        'paced': run_phase(directory, record_size, num_devices, fps, duration, rotation_size),
+        'unpaced': run_phase(directory, record_size, num_devices, 0, duration, rotation_size),
+    }
+    sustained = result['unpaced']['mb_per_s']
+    result['headroom'] = sustained / required if sustained and required > 0 else None
+    return result
+
+
+def write_storage_benchmark(result, output_directory):
+    logfile_path = os.path.join(output_directory, STORAGE_PREFLIGHT_LOG)
+    with open(logfile_path, mode='w') as ofs:
+        ofs.write(json.dumps(result, indent=4))
+    return logfile_path
+
+
+def print_storage_benchmark(result):
+    print('storage pre-flight: {}'.format(result['directory']))
+    print('  required             : {:.1f} MB/s ({} devices x {} bytes x {} fps)'.format(
+        result['required_mb_per_s'], result['num_devices'], result['record_size'], result['fps']))
+    for phase in ['paced', 'unpaced']:
+        stats = result[phase]
+        print('  {:<21s}: {:.1f} MB/s'.format(phase, stats['mb_per_s'] or 0.0))
+        if stats['write_latency_ms']:
+            latency = stats['write_latency_ms']
+            print('    write p50/p99/p99.9/max : {:.3f} / {:.3f} / {:.3f} / {:.3f} ms'.format(
+                latency['p50'], latency['p99'], latency['p99.9'], latency['max']))
+        if 'num_late' in stats:
+            print('    writes behind by a frame: {} of {}'.format(stats['num_late'], stats['num_records']))
+    if result['headroom'] is not None:
+        print('  headroom             : {:.2f}x'.format(result['headroom']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check if a volume can store the data of the cameras")
+    parser.add_argument('-d', '--directory', default='.', type=str, \
+                        help='Directory on the volume to test')
+    parser.add_argument('-s', '--record-size', required=True, type=int, \
+                        help='Bytes per frame (PayloadSize for GenDC, 4 + image size otherwise)')
+    parser.add_argument('-fps', '--fps', required=True, type=float, \
+                        help='Frame rate of the camera')
+    parser.add_argument('-nd', '--number-of-device', default=1, type=int, \
+                        help='The number of devices')
+    parser.add_argument('-t', '--duration', default=10.0, type=float, \
+                        help='Seconds of each phase')
+    args = parser.parse_args()
+
+    result = run_storage_benchmark(args.directory, args.record_size, args.number_of_device, args.fps, args.duration)
+    print_storage_benchmark(result)
+
+
+if __name__ == "__main__":
+    main()
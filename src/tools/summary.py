@@ -0,0 +1,278 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import csv
+import json
+import re
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from tools.frame_log import *
+from tools.frame_timing import TIMING_LOG_SUFFIX
+
+################################################################################
+#
+# Cross-run summary
+#
+# Every directory under the root that has camera-N-frame_log.(npz|txt) is a
+# run of camera N. Runs are reduced to drop intervals and all statistics are
+# computed over arrays of runs, so thousands of runs are summarised at once.
+# Soak tests (-re --duration) keep no frame log; their camera-N-soak_summary.json
+# is taken as the run instead.
+#
+################################################################################
+
+SUMMARY_JSON = 'summary.json'
+SUMMARY_CSV = 'summary.csv'
+
+FRAME_LOG_PREFIX = re.compile(r'^(camera-(\d+)-)frame_log\.(npz|txt)$')
+SOAK_SUMMARY_PREFIX = re.compile(r'^(camera-(\d+)-)soak_summary\.json$')
+
+PERCENTILES = [5, 50, 95]
+
+# two-sided 95% t values for 1..30 degrees of freedom; 1.96 beyond
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+
+def run_order(key):
+    return [int(p) if p.isdigit() else p for p in re.split(r'[\\/]', key[0])], key[1]
+
+
+def list_runs(root_dir):
+    # return [(run, camera index, log file)] of all frame logs under root_dir
+    runs = {}
+    for dir_path, _, files in os.walk(root_dir):
+        for f in files:
+            m = FRAME_LOG_PREFIX.match(f)
+            if m:
+                run = os.path.relpath(dir_path, root_dir)
+                key = (run, int(m.group(2)))
+                # prefer npz when both formats exist
+                if key not in runs or f.endswith(FRAME_LOG_NPZ_SUFFIX):
+                    runs[key] = os.path.join(dir_path, f)
+    return [(run, camera, runs[(run, camera)]) for run, camera in sorted(runs, key=run_order)]
+
+
+def list_soak_runs(root_dir):
+    # return [(run, camera index, soak summary)] of the runs under root_dir without a frame log
+    logged = set((run, camera) for run, camera, _ in list_runs(root_dir))
+    runs = {}
+    for dir_path, _, files in os.walk(root_dir):
+        for f in files:
+            m = SOAK_SUMMARY_PREFIX.match(f)
+            if m:
+                key = (os.path.relpath(dir_path, root_dir), int(m.group(2)))
+                if key not in logged:
+                    runs[key] = os.path.join(dir_path, f)
+    return [(run, camera, runs[(run, camera)]) for run, camera in sorted(runs, key=run_order)]
+
+
+def load_run(log_file):
+    offset, num_caught, drop_start, drop_length = load_drop_ranges(log_file)
+    # delivered fps measured in realtime-evaluation mode, if any
+    timing_file = log_file[:-len(FRAME_LOG_SUFFIX)] + TIMING_LOG_SUFFIX
+    achieved_fps = None
+    if os.path.isfile(timing_file):
+        with open(timing_file) as f:
+            achieved_fps = json.loads(f.read()).get('achieved_fps')
+    return num_caught, drop_start - offset, drop_length, achieved_fps
+
+
+def get_confidence_interval(values):
+    # 95% confidence interval of the mean
+    n = len(values)
+    if n < 2:
+        return None
+    t = T_95[n - 2] if n - 1 <= len(T_95) else 1.96
+    half = t * np.std(values, ddof=1) / np.sqrt(n)
+    mean = float(np.mean(values))
+    return [mean - float(half), mean + float(half)]
+
+
+def get_burst_distribution(drop_length):
+    # burst lengths grouped into 1, 2, 3-4, 5-8, ... frames
+    if len(drop_length) == 0:
+        return {'num_bursts': 0}
+    group = np.ceil(np.log2(drop_length)).astype(np.int64)
+    counts = np.bincount(group)
+    histogram = {}
+    for g in np.flatnonzero(counts):
+        low = 1 if g == 0 else (1 << (g - 1)) + 1
+        label = str(low) if low == 1 << g else '{}-{}'.format(low, 1 << g)
+        histogram[label] = int(counts[g])
+    return {
+        'num_bursts': int(len(drop_length)),
+        'mean': float(np.mean(drop_length)),
+        'p50': float(np.percentile(drop_length, 50)),
+        'p99': float(np.percentile(drop_length, 99)),
+        'max': int(np.max(drop_length)),
+        'histogram': histogram,
+    }
+
+
+def get_run_stats(num_caught, drop_start, drop_length, fps=None, achieved_fps=None):
+    num_dropped = int(np.sum(drop_length))
+    num_frames = num_caught + num_dropped
+    # clean streaks are the stretches before, between and after the bursts
+    clean_start = np.concatenate([[0], drop_start + drop_length])
+    clean_end = np.concatenate([drop_start, [num_frames]])
+    first_drop = int(drop_start[0]) if len(drop_start) > 0 else None
+
+    stats = {
+        'num_frames': num_frames,
+        'num_caught': num_caught,
+        'num_dropped': num_dropped,
+        'catch_rate': num_caught * 100.0 / num_frames if num_frames > 0 else 0.0,
+        'num_bursts': int(len(drop_length)),
+        'max_burst': int(np.max(drop_length)) if len(drop_length) > 0 else 0,
+        'first_drop_frame': first_drop,
+        'first_drop_time': first_drop / fps if fps and first_drop is not None else None,
+        'longest_clean_streak': int(np.max(clean_end - clean_start)),
+        'delivered_fps': achieved_fps if achieved_fps else
+                         (fps * num_caught / num_frames if fps and num_frames > 0 else None),
+    }
+    return stats
+
+
+def get_soak_run_stats(soak_summary_file):
+    # the statistics of get_run_stats() from the summary of a soak test; the
+    # frames of the drops are not kept, only the times and the burst histogram
+    with open(soak_summary_file) as f:
+        soak = json.loads(f.read())
+    stats = {
+        'num_frames': soak['num_frames'],
+        'num_caught': soak['num_caught'],
+        'num_dropped': soak['num_dropped'],
+        'catch_rate': soak['catch_rate'] if soak['catch_rate'] is not None else 0.0,
+        'num_bursts': soak['num_bursts'],
+        'max_burst': soak['max_burst'],
+        'first_drop_frame': None,
+        'first_drop_time': soak['first_drop_s'],
+        'longest_clean_streak': soak['longest_clean_streak'],
+        'delivered_fps': soak['achieved_fps'],
+    }
+    return stats, soak
+
+
+def get_group_upper_bound(label):
+    # '1', '2', '3-4', '5-8', ... of get_burst_distribution()
+    return int(label.split('-')[-1])
+
+
+def merge_burst_histograms(bursts, soak_summaries):
+    # adds the burst histograms of soak tests to get_burst_distribution(). soak
+    # tests keep only the histogram: the mean is recomputed from the dropped
+    # frames, and the percentiles from the merged histogram as the upper bound
+    # of the group that holds them (at most the longest burst)
+    soak_summaries = [soak for soak in soak_summaries if soak['num_bursts'] > 0]
+    if not soak_summaries:
+        return bursts
+    num_bursts = bursts['num_bursts']
+    num_dropped = bursts['mean'] * num_bursts if num_bursts > 0 else 0.0
+    max_burst = bursts.get('max', 0)
+    histogram = dict(bursts.get('histogram', {}))
+    for soak in soak_summaries:
+        num_bursts += soak['num_bursts']
+        num_dropped += soak['num_dropped']
+        max_burst = max(max_burst, soak['max_burst'])
+        for label, count in soak['burst_histogram'].items():
+            histogram[label] = histogram.get(label, 0) + count
+    labels = sorted(histogram, key=get_group_upper_bound)
+    cumulative = np.cumsum([histogram[label] for label in labels])
+    percentiles = [min(get_group_upper_bound(labels[int(np.searchsorted(cumulative, num_bursts * p / 100.0))]), max_burst)
+                   for p in [50, 99]]
+    return {
+        'num_bursts': num_bursts,
+        'mean': float(num_dropped / num_bursts),
+        'p50': float(percentiles[0]),
+        'p99': float(percentiles[1]),
+        'max': max_burst,
+        'histogram': {label: histogram[label] for label in labels},
+    }
+
+
+def summarize_camera(run_stats, drop_length, soak_summaries=()):
+    catch_rate = np.array([s['catch_rate'] for s in run_stats])
+    first_drop = np.array([s['first_drop_frame'] for s in run_stats if s['first_drop_frame'] is not None])
+    delivered_fps = np.array([s['delivered_fps'] for s in run_stats if s['delivered_fps'] is not None])
+    summary = {
+        'num_runs': len(run_stats),
+        'num_runs_with_drop': int(sum(1 for s in run_stats if s['num_dropped'] > 0)),
+        'catch_rate': {
+            'mean': float(np.mean(catch_rate)),
+            'min': float(np.min(catch_rate)),
+            'max': float(np.max(catch_rate)),
+            'std': float(np.std(catch_rate, ddof=1)) if len(catch_rate) > 1 else 0.0,
+            'ci95': get_confidence_interval(catch_rate),
+        },
+        'bursts': merge_burst_histograms(get_burst_distribution(drop_length), soak_summaries),
+        'first_drop_frame_min': int(np.min(first_drop)) if len(first_drop) > 0 else None,
+        'longest_clean_streak': int(max(s['longest_clean_streak'] for s in run_stats)),
+        'delivered_fps_mean': float(np.mean(delivered_fps)) if len(delivered_fps) > 0 else None,
+    }
+    for p, v in zip(PERCENTILES, np.percentile(catch_rate, PERCENTILES)):
+        summary['catch_rate']['p{}'.format(p)] = float(v)
+    return summary
+
+
+def summarize(root_dir, fps=None, num_jobs=1):
+    runs = list_runs(root_dir)
+    log_files = [log_file for _, _, log_file in runs]
+    if num_jobs > 1 and len(log_files) > 1:
+        with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+            loaded = list(executor.map(load_run, log_files, chunksize=max(1, len(log_files) // (4 * num_jobs))))
+    else:
+        loaded = [load_run(log_file) for log_file in log_files]
+
+    rows = []
+    cameras = {}
+    for (run, camera, _), (num_caught, drop_start, drop_length, achieved_fps) in zip(runs, loaded):
+        stats = get_run_stats(num_caught, drop_start, drop_length, fps, achieved_fps)
+        rows.append(dict({'run': run, 'camera': camera}, **stats))
+        cameras.setdefault(camera, ([], [], []))
+        cameras[camera][0].append(stats)
+        cameras[camera][1].append(drop_length)
+    for run, camera, soak_summary_file in list_soak_runs(root_dir):
+        stats, soak = get_soak_run_stats(soak_summary_file)
+        rows.append(dict({'run': run, 'camera': camera}, **stats))
+        cameras.setdefault(camera, ([], [], []))
+        cameras[camera][0].append(stats)
+        cameras[camera][2].append(soak)
+
+    summary = {'root': os.path.abspath(root_dir), 'nominal_fps': fps, 'cameras': {}}
+    for camera in sorted(cameras):
+        run_stats, drop_lengths, soak_summaries = cameras[camera]
+        drop_length = np.concatenate(drop_lengths) if drop_lengths else np.zeros(0, dtype=np.int64)
+        summary['cameras']['camera-{}'.format(camera)] = summarize_camera(run_stats, drop_length, soak_summaries)
+    return summary, rows
+
+
+def write_summary(root_dir, summary, rows):
+    json_path = os.path.join(root_dir, SUMMARY_JSON)
+    with open(json_path, mode='w') as f:
+        f.write(json.dumps(summary, indent=4))
+    csv_path = os.path.join(root_dir, SUMMARY_CSV)
+    with open(csv_path, mode='w', newline='') as f:
+        if rows:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    print('summary written in {} and {}'.format(json_path, csv_path))
+
+
+def print_summary(summary):
+    for camera, s in summary['cameras'].items():
+        print('{} ({} runs)'.format(camera, s['num_runs']))
+        print('  catch rate mean/min  : {:.4f}% / {:.4f}%'.format(s['catch_rate']['mean'], s['catch_rate']['min']))
+        print('  catch rate p5/p50/p95: {:.4f}% / {:.4f}% / {:.4f}%'.format(
+            s['catch_rate']['p5'], s['catch_rate']['p50'], s['catch_rate']['p95']))
+        if s['catch_rate']['ci95']:
+            print('  catch rate 95% CI    : {:.4f}% - {:.4f}%'.format(*s['catch_rate']['ci95']))
+        print('  runs with drops      : {}'.format(s['num_runs_with_drop']))
+        print('  drop bursts          : {}'.format(s['bursts']))
+        print('  longest clean streak : {} frames'.format(s['longest_clean_streak']))
+        if s['delivered_fps_mean']:
+            print('  delivered fps        : {}'.format(s['delivered_fps_mean']))
@@ -0,0 +1,287 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import re
+import shutil
+import struct
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+import tools.gendc_header as gendc_header
+from tools.rolling import BIN_FILE_PATTERN
+
+################################################################################
+#
+# Live telemetry
+#
+# A sampler thread polls one probe per device every interval and publishes
+# the metrics in the Prometheus text format, to a file rewritten atomically
+# and/or on http://127.0.0.1:<port>/metrics. The acquisition loop is not
+# touched: probes read what the loop already produces (bin files, the list of
+# framecounts or the soak statistics and ring). The CPU time of the sampler
+# thread is measured, since that is the time it can take the GIL from the loop.
+#
+################################################################################
+
+METRIC_PREFIX = 'perf_test_'
+SAMPLE_INTERVAL = 1.0
+DROP_WINDOW = 60.0
+# enough for the container header up to the component offsets
+CONTAINER_HEADER_BYTES = 64
+
+
+class BinFileProbe:
+    # frames and bytes in the bin files of one prefix. records are assumed to
+    # be of a constant size (record_size of the binarysaver, or the size of the
+    # first GenDC container), and the sizes of files are kept after they are
+    # deleted (--rolling)
+    def __init__(self, output_directory, prefix, record_size):
+        self.output_directory_ = output_directory
+        self.prefix_ = prefix
+        self.pattern_ = re.compile(BIN_FILE_PATTERN.format(re.escape(prefix)))
+        self.raw_record_size_ = record_size
+        self.sizes_ = {}
+        self.record_size_ = None
+        self.framecount_offset_ = 0
+        self.first_framecount_ = None
+        self.last_framecount_ = None
+
+    def read_layout(self, bin_file):
+        with open(bin_file, mode='rb') as f:
+            head = f.read(CONTAINER_HEADER_BYTES)
+            if not gendc_header.is_gendc_descriptor(head):
+                if len(head) >= 4:
+                    self.record_size_ = self.raw_record_size_
+                return
+            if len(head) < CONTAINER_HEADER_BYTES:
+                return
+            descriptor_size = struct.unpack_from('<I', head, gendc_header.CONTAINER_DESCRIPTORSIZE_OFFSET)[0]
+            f.seek(0)
+            descriptor = f.read(descriptor_size)
+            if len(descriptor) < descriptor_size:
+                return
+            self.framecount_offset_ = gendc_header.get_framecount_offset(descriptor)
+            self.record_size_ = gendc_header.get_container_size(descriptor)
+
+    def read_framecount(self, bin_file, ith_record):
+        with open(bin_file, mode='rb') as f:
+            f.seek(ith_record * self.record_size_ + self.framecount_offset_)
+            return struct.unpack('<I', f.read(4))[0]
+
+    def sample(self):
+        # (frames caught, frames dropped, bytes, last framecount)
+        with os.scandir(self.output_directory_) as entries:
+            for entry in entries:
+                m = self.pattern_.match(entry.name)
+                if m:
+                    try:
+                        self.sizes_[int(m.group(1))] = entry.stat().st_size
+                    except FileNotFoundError:
+                        pass
+        if not self.sizes_:
+            return 0, 0, 0, None
+        num_bytes = sum(self.sizes_.values())
+        try:
+            if self.record_size_ is None:
+                self.read_layout(self.get_path(min(self.sizes_)))
+            if self.record_size_ is None:
+                return 0, 0, num_bytes, None
+            if self.first_framecount_ is None:
+                self.first_framecount_ = self.read_framecount(self.get_path(min(self.sizes_)), 0)
+            newest = max(self.sizes_)
+            if self.sizes_[newest] >= self.record_size_:
+                self.last_framecount_ = self.read_framecount(self.get_path(newest), self.sizes_[newest] // self.record_size_ - 1)
+        except (OSError, struct.error):
+            # the file was deleted or is being rotated; try again at the next sample
+            pass
+        num_caught = sum(size // self.record_size_ for size in self.sizes_.values())
+        num_dropped = 0
+        if self.first_framecount_ is not None and self.last_framecount_ is not None:
+            num_dropped = max(0, self.last_framecount_ - self.first_framecount_ + 1 - num_caught)
+        return num_caught, num_dropped, num_bytes, self.last_framecount_
+
+    def get_path(self, idx):
+        return os.path.join(self.output_directory_, self.prefix_ + str(idx) + '.bin')
+
+
+class FramecountListProbe:
+    # framecounts appended by the loop of realtime-evaluation mode after every run
+    def __init__(self, framecounts):
+        self.framecounts_ = framecounts
+        self.num_read_ = 0
+        self.last_framecount_ = None
+        self.num_caught_ = 0
+        self.num_dropped_ = 0
+
+    def sample(self):
+        num_entries = len(self.framecounts_)
+        if num_entries > self.num_read_:
+            framecount = np.array(self.framecounts_[self.num_read_:num_entries], dtype=np.int64)
+            self.num_read_ = num_entries
+            prev = framecount[0] - 1 if self.last_framecount_ is None else self.last_framecount_
+            # a new frame arrives when the framecount changes
+            steps = np.diff(framecount, prepend=prev)
+            steps = steps[steps != 0]
+            self.num_caught_ += len(steps)
+            self.num_dropped_ += int(np.sum(steps[steps > 1] - 1))
+            self.last_framecount_ = int(framecount[-1])
+        return self.num_caught_, self.num_dropped_, 0, self.last_framecount_
+
+
+class RunningStatsProbe:
+    # soak statistics plus the framecounts of the ring that are not folded yet.
+    # the version of the statistics is odd during a fold, and the probe reads
+    # again if a fold started or ended while it was reading
+    def __init__(self, stats, ring):
+        self.stats_ = stats
+        self.ring_ = ring
+
+    def sample(self):
+        while True:
+            version = self.stats_.version_
+            if version % 2 == 0:
+                num_caught, num_dropped = self.stats_.num_caught_, self.stats_.num_dropped_
+                last_framecount = self.stats_.last_framecount_
+                framecount = self.ring_.framecount_[:self.ring_.size_].astype(np.int64)
+                if self.stats_.version_ == version:
+                    break
+            time.sleep(0)
+        if len(framecount) > 0:
+            prev = framecount[0] - 1 if last_framecount is None else last_framecount
+            # a new frame arrives when the framecount changes, as in RunningStats.fold()
+            steps = np.diff(framecount, prepend=prev)
+            steps = steps[steps != 0]
+            num_caught += len(steps)
+            num_dropped += int(np.sum(steps[steps > 1] - 1))
+            last_framecount = int(framecount[-1])
+        return num_caught, num_dropped, 0, last_framecount
+
+
+class TelemetrySampler:
+    def __init__(self, output_directory, metrics_file=None, port=None, interval=SAMPLE_INTERVAL, window=DROP_WINDOW):
+        self.output_directory_ = output_directory
+        self.metrics_file_ = metrics_file
+        self.interval_ = interval
+        self.window_ = window
+        self.lock_ = threading.Lock()
+        self.test_ = None
+        self.prefixes_ = []
+        self.probes_ = []
+        self.history_ = []
+        self.text_ = ''
+        self.num_samples_ = 0
+        self.cpu_ns_ = 0
+        self.start_ = time.perf_counter()
+        self.stop_ = threading.Event()
+        self.thread_ = threading.Thread(target=self.run, daemon=True)
+        self.server_ = None
+        if port is not None:
+            self.server_ = ThreadingHTTPServer(('127.0.0.1', port), self.get_handler())
+            self.server_thread_ = threading.Thread(target=self.server_.serve_forever, daemon=True)
+
+    def get_handler(self):
+        sampler = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = sampler.text_.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MetricsHandler
+
+    def start(self):
+        self.thread_.start()
+        if self.server_:
+            self.server_thread_.start()
+
+    def set_probes(self, test, prefixes, probes):
+        with self.lock_:
+            self.test_ = test
+            self.prefixes_ = prefixes
+            self.probes_ = probes
+            self.history_ = [deque() for probe in probes]
+
+    def run(self):
+        while not self.stop_.wait(self.interval_):
+            self.sample()
+
+    def sample(self):
+        cpu_start_ns = time.thread_time_ns()
+        now = time.perf_counter()
+        devices = []
+        with self.lock_:
+            for prefix, probe, history in zip(self.prefixes_, self.probes_, self.history_):
+                num_caught, num_dropped, num_bytes, last_framecount = probe.sample()
+                prev = history[-1] if history else None
+                history.append((now, num_caught, num_dropped, num_bytes))
+                while now - history[0][0] > self.window_:
+                    history.popleft()
+                elapsed = now - prev[0] if prev else 0
+                devices.append({
+                    'device': prefix.rstrip('-'),
+                    'frames_caught_total': num_caught,
+                    'frames_dropped_total': num_dropped,
+                    'frames_dropped_window': num_dropped - history[0][2],
+                    'fps': (num_caught - prev[1]) / elapsed if elapsed > 0 else 0.0,
+                    'last_framecount': last_framecount if last_framecount is not None else -1,
+                    'bin_bytes_total': num_bytes,
+                    'bin_bytes_per_second': (num_bytes - prev[3]) / elapsed if elapsed > 0 else 0.0,
+                })
+            test = self.test_
+        disk_free = shutil.disk_usage(self.output_directory_).free
+        self.num_samples_ += 1
+        self.text_ = self.format_metrics(test, devices, disk_free)
+        if self.metrics_file_:
+            tmp_path = self.metrics_file_ + '.tmp'
+            with open(tmp_path, mode='w') as ofs:
+                ofs.write(self.text_)
+            os.replace(tmp_path, self.metrics_file_)
+        self.cpu_ns_ += time.thread_time_ns() - cpu_start_ns
+
+    def format_metrics(self, test, devices, disk_free):
+        metrics = [
+            ('frames_caught_total', 'counter', 'Frames caught in the current test'),
+            ('frames_dropped_total', 'counter', 'Frames dropped in the current test'),
+            ('frames_dropped_window', 'gauge', 'Frames dropped in the last {:g} s'.format(self.window_)),
+            ('fps', 'gauge', 'Frames caught per second since the previous sample'),
+            ('last_framecount', 'gauge', 'Latest framecount of the device'),
+            ('bin_bytes_total', 'counter', 'Bytes of bin files written in the current test'),
+            ('bin_bytes_per_second', 'gauge', 'Bytes of bin files written per second since the previous sample'),
+        ]
+        lines = []
+        for name, metric_type, description in metrics:
+            lines.append('# HELP {}{} {}'.format(METRIC_PREFIX, name, description))
+            lines.append('# TYPE {}{} {}'.format(METRIC_PREFIX, name, metric_type))
+            for device in devices:
+                lines.append('{}{}{{device="{}",test="{}"}} {}'.format(METRIC_PREFIX, name, device['device'], test, device[name]))
+        lines.append('# HELP {}disk_free_bytes Free space of the volume of the output directory'.format(METRIC_PREFIX))
+        lines.append('# TYPE {}disk_free_bytes gauge'.format(METRIC_PREFIX))
+        lines.append('{}disk_free_bytes {}'.format(METRIC_PREFIX, disk_free))
+        lines.append('# HELP {}sampler_cpu_seconds_total CPU time of the telemetry sampler thread'.format(METRIC_PREFIX))
+        lines.append('# TYPE {}sampler_cpu_seconds_total counter'.format(METRIC_PREFIX))
+        lines.append('{}sampler_cpu_seconds_total {}'.format(METRIC_PREFIX, self.cpu_ns_ / 1e9))
+        return '\n'.join(lines) + '\n'
+
+    def stop(self):
+        # returns the overhead of the sampler: samples, CPU ms per sample, share of one core
+        self.stop_.set()
+        self.thread_.join()
+        # the published metrics end with the state at the end of the tests
+        self.sample()
+        if self.server_:
+            self.server_.shutdown()
+            self.server_.server_close()
+        elapsed = time.perf_counter() - self.start_
+        cpu_ms = self.cpu_ns_ / 1e6 / self.num_samples_ if self.num_samples_ > 0 else 0.0
+        return self.num_samples_, cpu_ms, self.cpu_ns_ / 1e9 / elapsed * 100.0 if elapsed > 0 else 0.0
@@ -1,14 +1,15 @@
-from gendc_python.genicam import tool as genicam
-
+# PFNC values of the pixelformats (same as gendc_python.genicam.tool.pfnc_convert_pixelformat),
+# kept as constants so that the analysis tools do not need the SDK
 GDC_INTENSITY = 0x0000000000000001
-Mono8 = genicam.pfnc_convert_pixelformat("Mono8")
-Mono10 = genicam.pfnc_convert_pixelformat("Mono10")
-Mono12 = genicam.pfnc_convert_pixelformat("Mono12")
-RGB8 = genicam.pfnc_convert_pixelformat("RGB8")
-BGR8 = genicam.pfnc_convert_pixelformat("BGR8")
-BayerBG8 = genicam.pfnc_convert_pixelformat("BayerBG8")
-BayerBG10 = genicam.pfnc_convert_pixelformat("BayerBG10")
-BayerBG12 = genicam.pfnc_convert_pixelformat("BayerBG12")
+Mono8 = 0x01080001
+Mono10 = 0x01100003
+Mono12 = 0x01100005
+RGB8 = 0x02180014
+BGR8 = 0x02180015
+BayerBG8 = 0x0108000B
+BayerBG10 = 0x0110000F
+BayerBG12 = 0x01100013
+
 gain = 40
 exposure = 400
 
@@ -1,12 +1,21 @@
 import os
 import sys
-from matplotlib import pyplot as plt
 import numpy as np
 import argparse
 import json
+from concurrent.futures import ProcessPoolExecutor
+
+from tools.frame_log import *
+from tools.host_sampler import HOST_METRICS, load_host_samples, get_frame_positions
+
+# host metrics that can be drawn over the dropped frames with --host-metric
+HOST_OVERLAYS = ['cpu_max_pct', 'cpu_mean_pct'] + HOST_METRICS
 
 
 def check_frame_catch(logfile):
+    if logfile.endswith(FRAME_LOG_NPZ_SUFFIX):
+        return check_frame_catch_npz(logfile)
+
     num_frames = 0
     num_skipped = 0
     skipped_frames = []
@@ -15,9 +24,9 @@ def check_frame_catch(logfile):
         for line in lines:
             if 'offset' in line:
                 offset = int(line.split(':')[-1])
-            if ':' in line:
+            elif ':' in line:
                 num_frames += 1
-                if 'x' in line:
+                if line.split(':')[-1].strip() == 'x':
                     num_skipped += 1
                     skipped_index = int(line.split(':')[0])
                     skipped_frames.append(skipped_index - offset)
@@ -25,6 +34,19 @@ def check_frame_catch(logfile):
     return (offset, num_frames - num_skipped, num_frames, skipped_frames)
 
 
+def check_frame_catch_npz(logfile):
+    log = load_npz_log(logfile)
+    offset = int(log['offset'])
+    drop_start = log['drop_start'] - offset
+    drop_length = log['drop_length']
+    num_caught = len(log['framecount'])
+    num_skipped = int(np.sum(drop_length))
+    # expand the dropped intervals into frame indices
+    skipped_frames = np.repeat(drop_start - np.cumsum(drop_length) + drop_length, drop_length) \
+        + np.arange(num_skipped)
+    return (offset, num_caught, num_caught + num_skipped, skipped_frames.tolist())
+
+
 def get_bin_directory_prefix():
     with open('kizashi_config.h') as f:
         lines = f.readlines()
@@ -45,14 +67,27 @@ def list_all_directories():
     return os.path.join(parent_dir, list_of_files[int(idx)])
 
 
-def get_stats(target_dir, ith_device, display_plot=False):
+def overlay_host_samples(ax, run_dir, ith_device, num_frames, host_metric):
+    # draw host_samples.npz of the run on the frame axis of ax
+    samples = load_host_samples(run_dir)
+    if samples is None:
+        return
+    x = get_frame_positions(samples, run_dir, ith_device, num_frames)
+    if x is None:
+        return
+    host_ax = ax.twinx()
+    host_ax.plot(x, samples[host_metric], color='tab:orange', linewidth=1)
+    host_ax.set_ylabel(host_metric, color='tab:orange')
+
+
+def get_stats(target_dir, ith_device, display_plot=False, host_metric=None):
+    from matplotlib import pyplot as plt
     percent = []
     skipped_frames_for_all_run = []
 
     num_runs = 0
     for d in os.listdir(target_dir):
-        if os.path.isdir(os.path.join(target_dir, d)) and 'camera-0-frame_log.txt' in os.listdir(
-                os.path.join(target_dir, d)):
+        if os.path.isdir(os.path.join(target_dir, d)) and find_frame_log(os.path.join(target_dir, d), 'camera-0-'):
             num_runs += 1
 
     plot_height = 2 * num_runs
@@ -61,7 +96,7 @@ def get_stats(target_dir, ith_device, display_plot=False):
     fig.tight_layout(rect=[0, 0, 1, 0.96])
 
     for i in range(num_runs):
-        log_file = os.path.join(target_dir, str(i), 'camera-' + str(ith_device) + '-frame_log.txt')
+        log_file = find_frame_log(os.path.join(target_dir, str(i)), 'camera-' + str(ith_device) + '-')
         (offset, caught_frames, all_frames, skipped_frames) = check_frame_catch(log_file)
         percent.append(caught_frames * 100.0 / all_frames)
         skipped_frames_for_all_run.append(skipped_frames)
@@ -73,22 +108,104 @@ def get_stats(target_dir, ith_device, display_plot=False):
             axes[i].scatter(x, y)
             axes[i].set_ylim(0.5, 1.5)
             axes[i].set_yticks([])
+            if host_metric:
+                overlay_host_samples(axes[i], os.path.join(target_dir, str(i)), ith_device, all_frames, host_metric)
     plt.savefig(os.path.join(target_dir, 'stat' + str(ith_device) + '.png'))
     print("image is saved under", os.path.join(target_dir, 'stat' + str(ith_device) + '.png'))
     return num_runs, percent
 
 
+################################################################################
+#
+# drop-density heatmap: one row per run, one column per bucket of frames.
+# runs are loaded in parallel as drop intervals and binned with prefix sums,
+# so memory is bounded by the number of runs x buckets, not frames.
+#
+################################################################################
+def list_run_logs(target_dir, ith_device):
+    run_logs = []
+    for d in os.listdir(target_dir):
+        if d.isdigit() and os.path.isdir(os.path.join(target_dir, d)):
+            log_file = find_frame_log(os.path.join(target_dir, d), 'camera-' + str(ith_device) + '-')
+            if log_file:
+                run_logs.append((int(d), log_file))
+    return [log_file for _, log_file in sorted(run_logs)]
+
+
+def load_run(log_file):
+    offset, num_caught, drop_start, drop_length = load_drop_ranges(log_file)
+    return num_caught, num_caught + int(np.sum(drop_length)), drop_start - offset, drop_length
+
+
+def get_heatmap(target_dir, ith_device, num_buckets=500, num_jobs=1):
+    from matplotlib import pyplot as plt
+    run_logs = list_run_logs(target_dir, ith_device)
+    num_runs = len(run_logs)
+    if num_runs == 0:
+        return 0, []
+
+    if num_jobs > 1:
+        with ProcessPoolExecutor(max_workers=num_jobs) as executor:
+            runs = list(executor.map(load_run, run_logs, chunksize=max(1, num_runs // (4 * num_jobs))))
+    else:
+        runs = [load_run(log_file) for log_file in run_logs]
+
+    num_caught = np.array([run[0] for run in runs], dtype=np.int64)
+    num_frames = np.array([run[1] for run in runs], dtype=np.int64)
+    percent = (num_caught * 100.0 / np.maximum(num_frames, 1)).tolist()
+
+    max_frames = int(np.max(num_frames))
+    num_buckets = max(1, min(num_buckets, max_frames))
+    bucket_edges = np.linspace(0, max_frames, num_buckets + 1).round().astype(np.int64)
+    bucket_size = np.diff(bucket_edges)
+
+    density = np.full((num_runs, num_buckets), np.nan, dtype=np.float32)
+    for i, (_, frames, drop_start, drop_length) in enumerate(runs):
+        # buckets after the end of a shorter run stay empty
+        in_run = bucket_edges[:-1] < frames
+        frames_in_bucket = np.minimum(bucket_edges[1:], frames) - bucket_edges[:-1]
+        drops = count_drops_per_bucket(drop_start, drop_length, bucket_edges)
+        density[i, in_run] = drops[in_run] / frames_in_bucket[in_run]
+
+    fig, ax = plt.subplots(1, 1, figsize=(20, 10))
+    cmap = plt.get_cmap('viridis').copy()
+    cmap.set_bad('white')
+    image = ax.imshow(np.ma.masked_invalid(density), aspect='auto', interpolation='nearest', cmap=cmap,
+                      vmin=0.0, vmax=max(float(np.nanmax(density)), 1e-6), extent=[0, max_frames, num_runs, 0])
+    ax.set_xlabel('frame index (bucket of {} frames)'.format(int(np.max(bucket_size))))
+    ax.set_ylabel('run')
+    fig.colorbar(image, ax=ax, label='ratio of dropped frames')
+    fig.suptitle('dropped frames in all ' + str(num_runs) + ' runs')
+
+    image_path = os.path.join(target_dir, 'stat' + str(ith_device) + '_heatmap.png')
+    plt.savefig(image_path)
+    plt.close(fig)
+    print("image is saved under", image_path)
+    return num_runs, percent
+
+
 def main():
     parser = argparse.ArgumentParser(description="Performance test for your U3V Camera")
     parser.add_argument('-d', '--directory', type=str,
                         help='Directory to save log', required=True)
     parser.add_argument('-nd', '--number-of-device', default=1, type=int, help='The number of devices')
+    parser.add_argument('-hm', '--heatmap', action='store_true',
+                        help='Draw drop density of all runs in a single heatmap')
+    parser.add_argument('-nb', '--number-of-buckets', default=500, type=int,
+                        help='The number of frame buckets of the heatmap')
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help='The number of processes to load logs with')
+    parser.add_argument('-hx', '--host-metric', default=None, choices=HOST_OVERLAYS,
+                        help='Draw this host metric of host_samples.npz (test_performance.py --host-sampler) over the dropped frames')
     args = parser.parse_args()
 
     num_devices = args.number_of_device
 
     for n in range(num_devices):
-        num_runs, percent = get_stats(args.directory, n, True)
+        if args.heatmap:
+            num_runs, percent = get_heatmap(args.directory, n, args.number_of_buckets, args.jobs)
+        else:
+            num_runs, percent = get_stats(args.directory, n, True, args.host_metric)
         print('total run: ' + str(num_runs))
         print(percent)
 